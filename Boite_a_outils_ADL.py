@@ -353,8 +353,9 @@ class MainPlugin_BAO_ADL(object):
     def on_GBDD_Import_en_masse_depuis_un_dossier (self):
         try:
             from .GBDD.GBDD_Import_en_masse_depuis_un_dossier import ImportFromFolderDialog
-            dialog = ImportFromFolderDialog(self.iface.mainWindow())
-            dialog.exec_()
+            # Dialogue non modal : l'import tourne en tâche de fond pendant que l'on continue à travailler
+            self.gbdd_import_dialog = ImportFromFolderDialog(self.iface.mainWindow())
+            self.gbdd_import_dialog.show()
         except Exception as e:
             QMessageBox.critical(None, "Erreur", f"Une erreur est survenue : {e}")
    
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Banc d'essai du chargeur GBDD contre une base PostGIS locale jetable.
+
+Génère des couches synthétiques (points, lignes, polygones) en shapefile, GeoPackage et CSV,
+les importe avec import_shapefile, import_geopackage et import_csv, puis affiche pour chaque
+cas le débit (lignes/s), la mémoire résidente maximale et la durée totale.
+
+Exemples (depuis l'interpréteur Python de QGIS) :
+    python GBDD/GBDD_Banc_essai_import.py --backend docker --sizes 10000 100000
+    python GBDD/GBDD_Banc_essai_import.py --backend pg_ctl --formats binary text --json resultats.json
+    python GBDD/GBDD_Banc_essai_import.py --backend dsn --dsn "host=localhost dbname=essai user=postgres"
+
+Chaque cas tourne dans un processus séparé pour que la mémoire maximale mesurée lui soit propre.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import psycopg2
+from qgis.core import (
+    QgsApplication, QgsCoordinateReferenceSystem, QgsCoordinateTransformContext, QgsFeature, QgsField,
+    QgsFields, QgsGeometry, QgsPointXY, QgsVectorFileWriter, QgsWkbTypes
+)
+from qgis.PyQt.QtCore import QDate, QVariant
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Dossier du plugin, pour la mesure mémoire partagée avec le profil Naïades
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import GBDD_Import_en_masse_depuis_un_dossier as gbdd  # noqa: E402
+from memoire_BAO_ADL import peak_rss_mb  # noqa: E402
+
+# Tailles des jeux de données générés (nombre d'entités par couche)
+DEFAULT_SIZES = [10000, 100000, 1000000]
+# Emprise approximative de la Côte-d'Or en Lambert-93
+BENCH_EXTENT = (780000.0, 6630000.0, 880000.0, 6730000.0)
+BENCH_SCHEMA = "banc_essai"
+BENCH_GEO_SUFFIX = "_000"
+DOCKER_IMAGE = "postgis/postgis:16-3.4"
+GEOMETRY_KINDS = [("points", QgsWkbTypes.Point), ("lignes", QgsWkbTypes.LineString), ("polygones", QgsWkbTypes.Polygon)]
+
+
+def bench_fields():
+    fields = QgsFields()
+    fields.append(QgsField("code", QVariant.Int))
+    fields.append(QgsField("nom", QVariant.String, len=80))
+    fields.append(QgsField("valeur", QVariant.Double))
+    fields.append(QgsField("date_maj", QVariant.Date))
+    return fields
+
+
+def random_geometry(kind, rng):
+    """Géométrie aléatoire dans l'emprise : point, ligne brisée de 10 sommets ou polygone de 16 sommets."""
+    x = rng.uniform(BENCH_EXTENT[0], BENCH_EXTENT[2])
+    y = rng.uniform(BENCH_EXTENT[1], BENCH_EXTENT[3])
+    if kind == "points":
+        return QgsGeometry.fromPointXY(QgsPointXY(x, y))
+    if kind == "lignes":
+        points = [QgsPointXY(x, y)]
+        for _ in range(9):
+            x += rng.uniform(-200, 200)
+            y += rng.uniform(-200, 200)
+            points.append(QgsPointXY(x, y))
+        return QgsGeometry.fromPolylineXY(points)
+    radius = rng.uniform(20, 300)
+    ring = [QgsPointXY(x + radius * math.cos(2 * math.pi * i / 16), y + radius * math.sin(2 * math.pi * i / 16))
+            for i in range(16)]
+    return QgsGeometry.fromPolygonXY([ring + [ring[0]]])
+
+
+def random_attributes(index, rng):
+    day = date(2000, 1, 1) + timedelta(days=rng.randrange(9000))
+    return [index, f"entite {index}", rng.uniform(0, 1000), QDate(day.year, day.month, day.day)]
+
+
+def write_vector_layer(path, driver, layer_name, kind, wkb_type, size, seed):
+    """Écrit une couche synthétique par lots, sans garder les entités en mémoire."""
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver
+    options.layerName = layer_name
+    options.fileEncoding = "UTF-8"
+    if os.path.exists(path):
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    writer = QgsVectorFileWriter.create(
+        path, bench_fields(), wkb_type, QgsCoordinateReferenceSystem("EPSG:2154"),
+        QgsCoordinateTransformContext(), options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError(f"Écriture de {path} impossible : {writer.errorMessage()}")
+    rng = random.Random(seed)
+    batch = []
+    for index in range(size):
+        feature = QgsFeature(bench_fields())
+        feature.setAttributes(random_attributes(index, rng))
+        feature.setGeometry(random_geometry(kind, rng))
+        batch.append(feature)
+        if len(batch) >= gbdd.DEFAULT_COPY_CHUNK_SIZE:
+            writer.addFeatures(batch)
+            batch = []
+    writer.addFeatures(batch)
+    del writer  # Ferme et finalise le fichier
+
+
+def write_csv(path, size, seed):
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["code", "nom", "valeur", "date_maj", "x", "y"])
+        for index in range(size):
+            day = date(2000, 1, 1) + timedelta(days=rng.randrange(9000))
+            writer.writerow([index, f"entite {index}", f"{rng.uniform(0, 1000):.3f}", day.isoformat(),
+                             f"{rng.uniform(BENCH_EXTENT[0], BENCH_EXTENT[2]):.2f}",
+                             f"{rng.uniform(BENCH_EXTENT[1], BENCH_EXTENT[3]):.2f}"])
+
+
+def generate_datasets(data_dir, sizes):
+    """Génère (ou réutilise) les jeux d'essai. Renvoie la liste des (type d'import, fichier, taille)."""
+    os.makedirs(data_dir, exist_ok=True)
+    datasets = []
+    for size in sizes:
+        for seed, (kind, wkb_type) in enumerate(GEOMETRY_KINDS):
+            shp_path = os.path.join(data_dir, f"{kind}_{size}.shp")
+            if not os.path.exists(shp_path):
+                print(f"Génération de {shp_path}...", flush=True)
+                write_vector_layer(shp_path, "ESRI Shapefile", f"{kind}_{size}", kind, wkb_type, size, seed)
+            datasets.append(("shp", shp_path, size))
+        gpkg_path = os.path.join(data_dir, f"couches_{size}.gpkg")
+        if not os.path.exists(gpkg_path):
+            print(f"Génération de {gpkg_path}...", flush=True)
+            for seed, (kind, wkb_type) in enumerate(GEOMETRY_KINDS):
+                write_vector_layer(gpkg_path, "GPKG", f"{kind}_{size}", kind, wkb_type, size, seed)
+        datasets.append(("gpkg", gpkg_path, size * len(GEOMETRY_KINDS)))
+        csv_path = os.path.join(data_dir, f"tableau_{size}.csv")
+        if not os.path.exists(csv_path):
+            print(f"Génération de {csv_path}...", flush=True)
+            write_csv(csv_path, size, len(GEOMETRY_KINDS))
+        datasets.append(("csv", csv_path, size))
+    return datasets
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_database(connection, timeout=120):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            psycopg2.connect(**connection).close()
+            return
+        except psycopg2.OperationalError:
+            if time.time() > deadline:
+                raise
+            time.sleep(1)
+
+
+class DockerPostgis:
+    """Conteneur PostGIS jetable, supprimé à l'arrêt."""
+
+    def __enter__(self):
+        port = free_port()
+        self.container = subprocess.check_output([
+            "docker", "run", "-d", "--rm", "-e", "POSTGRES_PASSWORD=banc", "-p", f"127.0.0.1:{port}:5432", DOCKER_IMAGE
+        ], text=True).strip()
+        self.connection = {"host": "127.0.0.1", "port": str(port), "dbname": "postgres",
+                           "user": "postgres", "password": "banc"}
+        wait_for_database(self.connection)
+        return self.connection
+
+    def __exit__(self, *exc):
+        subprocess.call(["docker", "stop", self.container], stdout=subprocess.DEVNULL)
+
+
+class LocalPostgis:
+    """Instance PostgreSQL temporaire (initdb + pg_ctl) ; l'extension PostGIS doit être installée sur le poste."""
+
+    def __enter__(self):
+        self.data_dir = tempfile.mkdtemp(prefix="gbdd_banc_pg_")
+        port = free_port()
+        subprocess.check_call(["initdb", "-D", self.data_dir, "-U", "postgres", "--auth=trust"],
+                              stdout=subprocess.DEVNULL)
+        subprocess.check_call([
+            "pg_ctl", "-D", self.data_dir, "-l", os.path.join(self.data_dir, "postgres.log"), "-w",
+            "-o", f"-p {port} -k {self.data_dir} -c listen_addresses=''", "start"
+        ], stdout=subprocess.DEVNULL)
+        self.connection = {"host": self.data_dir, "port": str(port), "dbname": "postgres", "user": "postgres"}
+        wait_for_database(self.connection)
+        return self.connection
+
+    def __exit__(self, *exc):
+        subprocess.call(["pg_ctl", "-D", self.data_dir, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class ExistingDatabase:
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def __enter__(self):
+        return {"dsn": self.dsn}
+
+    def __exit__(self, *exc):
+        pass
+
+
+def prepare_database(connection):
+    conn = psycopg2.connect(**connection)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA};")
+    conn.close()
+
+
+def run_case(case):
+    """Exécute un cas d'essai dans le processus courant. Renvoie le dictionnaire de mesures."""
+    conn = psycopg2.connect(**case["connection"])
+    start = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            if case["kind"] == "csv":
+                results = [gbdd.import_csv(cursor, case["path"], BENCH_SCHEMA, BENCH_GEO_SUFFIX,
+                                           chunk_size=case["chunk_size"])]
+            elif case["kind"] == "gpkg":
+                results = gbdd.import_geopackage(cursor, case["path"], BENCH_SCHEMA, BENCH_GEO_SUFFIX,
+                                                 chunk_size=case["chunk_size"], copy_format=case["copy_format"])
+            else:
+                results = [gbdd.import_shapefile(cursor, case["path"], BENCH_SCHEMA, BENCH_GEO_SUFFIX,
+                                                 chunk_size=case["chunk_size"], copy_format=case["copy_format"])]
+        conn.commit()
+        seconds = time.perf_counter() - start
+        # Nettoyage hors mesure, pour que chaque cas parte d'un schéma vide
+        with conn.cursor() as cursor:
+            for table_name, _ in results:
+                cursor.execute(f'DROP TABLE IF EXISTS {BENCH_SCHEMA}."{table_name}";')
+        conn.commit()
+    finally:
+        conn.close()
+    rows = sum(r for _, r in results)
+    return {
+        "cas": f"{case['kind']} {os.path.basename(case['path'])}",
+        "format": case["copy_format"],
+        "lots": case["chunk_size"],
+        "lignes": rows,
+        "duree_s": round(seconds, 3),
+        "lignes_par_s": round(rows / seconds) if seconds > 0 else 0,
+        "rss_max_mo": peak_rss_mb(),
+    }
+
+
+def run_case_in_subprocess(case):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+                                     text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_report(results, total_seconds):
+    headers = ["cas", "format", "lots", "lignes", "duree_s", "lignes_par_s", "rss_max_mo"]
+    widths = [max(len(h), *(len(str(r[h])) for r in results)) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for result in results:
+        print("  ".join(str(result[h]).ljust(w) for h, w in zip(headers, widths)))
+    print(f"Durée totale du banc d'essai : {total_seconds:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du chargeur GBDD")
+    parser.add_argument("--backend", choices=["docker", "pg_ctl", "dsn"], default="docker")
+    parser.add_argument("--dsn", help="Chaîne de connexion d'une base existante (avec --backend dsn) ; son schéma banc_essai est recréé")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--formats", nargs="+", choices=["binary", "text"], default=["binary", "text"])
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[gbdd.DEFAULT_COPY_CHUNK_SIZE])
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "gbdd_banc_donnees"))
+    parser.add_argument("--json", help="Fichier où enregistrer les mesures")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    try:
+        if args.run_case:
+            print(json.dumps(run_case(json.loads(args.run_case))))
+            return
+        if args.backend == "dsn" and not args.dsn:
+            parser.error("--dsn est requis avec --backend dsn")
+        datasets = generate_datasets(args.data_dir, args.sizes)
+        backend = {"docker": DockerPostgis, "pg_ctl": LocalPostgis}.get(args.backend)
+        start = time.perf_counter()
+        results = []
+        with (backend() if backend else ExistingDatabase(args.dsn)) as connection:
+            prepare_database(connection)
+            for kind, path, _ in datasets:
+                # Le CSV passe toujours par COPY texte : une seule stratégie à mesurer
+                formats = ["text"] if kind == "csv" else args.formats
+                for copy_format in formats:
+                    for chunk_size in args.chunk_sizes:
+                        case = {"kind": kind, "path": path, "copy_format": copy_format,
+                                "chunk_size": chunk_size, "connection": connection}
+                        result = run_case_in_subprocess(case)
+                        print(f"{result['cas']} ({copy_format}, lots de {chunk_size}) : "
+                              f"{result['lignes_par_s']} lignes/s", flush=True)
+                        results.append(result)
+        print_report(results, time.perf_counter() - start)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        qgs.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,1110 @@
 from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QTabWidget, QWidget, QTextEdit,
     QPushButton, QLabel, QLineEdit, QMessageBox,
-    QComboBox, QFileDialog, QCheckBox, QListWidget, QListWidgetItem, QHBoxLayout
+    QComboBox, QFileDialog, QCheckBox, QListWidget, QListWidgetItem, QHBoxLayout,
+    QSpinBox, QApplication, QTableWidget, QTableWidgetItem
 )
-from qgis.PyQt.QtCore import Qt, QVariant
-from qgis.core import QgsVectorLayer
+from qgis.PyQt.QtCore import Qt, QVariant, QTimer
+from qgis.core import QgsVectorLayer, QgsFeatureRequest, QgsTask, QgsApplication, QgsMessageLog, Qgis
 import os
+import io
+import re
+import hashlib
+import struct
+import time
+import queue
+import threading
+from itertools import chain
+from datetime import datetime, date
 import psycopg2
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
 import csv
 
+# Connexion à la base gb_ddt21 (login et mot de passe saisis dans le dialogue)
+GBDD_CONNECTION = {"dbname": "gb_ddt21", "host": "10.21.8.40", "port": "5432"}
+# Nombre d'imports menés en parallèle par défaut, chacun sur sa propre connexion
+DEFAULT_IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Nombre d'entités lues pour présenter des exemples de valeurs (la dernière sert d'exemple)
+SAMPLE_FEATURE_LIMIT = 10
+# Nombre de lignes envoyées par lot à PostgreSQL lors d'un COPY
+DEFAULT_COPY_CHUNK_SIZE = 10000
+# Flag EWKB indiquant la présence d'un SRID après le type de géométrie
+EWKB_SRID_FLAG = 0x20000000
+# Format de transfert par défaut des couches vectorielles : "binary" (EWKB brut) ou "text" (EWKB hexadécimal)
+DEFAULT_COPY_FORMAT = "binary"
+# En-tête et fin d'un flux COPY binaire (signature, flags, longueur d'extension ; nombre de champs -1)
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+# Les dates binaires PostgreSQL sont comptées en jours depuis le 01/01/2000
+PG_EPOCH_ORDINAL = date(2000, 1, 1).toordinal()
+# Tailles moyennes (octets) retenues pour estimer le volume d'une table avant chargement
+ESTIMATED_ROW_OVERHEAD = 28  # En-tête de ligne PostgreSQL et colonne id
+ESTIMATED_TYPE_BYTES = {"BOOLEAN": 1, "INTEGER": 4, "BIGINT": 8, "DOUBLE PRECISION": 8, "DATE": 4}
+ESTIMATED_TEXT_BYTES = 16
+ESTIMATED_GEOMETRY_BYTES = {0: 32, 1: 256, 2: 512}  # Point, ligne, polygone
+
+
+def copy_text_value(value):
+    """Formate une valeur pour le format texte de COPY (NULL, tabulations et retours à la ligne échappés)."""
+    if value is None:
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def wkb_to_ewkb(wkb, srid=2154):
+    """Convertit un WKB (ISO ou OGC) en EWKB portant le SRID, lisible directement par PostGIS."""
+    wkb = bytes(wkb)
+    if len(wkb) < 5:
+        return None
+    endian = '<' if wkb[0] == 1 else '>'
+    geom_type = struct.unpack(endian + 'I', wkb[1:5])[0]
+    header = wkb[0:1] + struct.pack(endian + 'I', geom_type | EWKB_SRID_FLAG) + struct.pack(endian + 'I', srid)
+    return header + wkb[5:]
+
+
+def wkb_to_ewkb_hex(wkb, srid=2154):
+    ewkb = wkb_to_ewkb(wkb, srid)
+    return ewkb.hex() if ewkb is not None else None
+
+
+def binary_date(value):
+    if not isinstance(value, date):
+        value = date.fromisoformat(str(value))
+    return struct.pack(">i", value.toordinal() - PG_EPOCH_ORDINAL)
+
+
+# Encodage des valeurs pour COPY binaire, selon le type SQL de la colonne (texte UTF-8 par défaut)
+COPY_BINARY_ENCODERS = {
+    "BOOLEAN": lambda value: b"\x01" if value else b"\x00",
+    "INTEGER": struct.Struct(">i").pack,
+    "BIGINT": struct.Struct(">q").pack,
+    "DOUBLE PRECISION": lambda value: struct.pack(">d", value),
+    "DATE": binary_date,
+    "GEOMETRY": bytes,  # EWKB brut, décodé par la fonction de réception binaire de PostGIS
+}
+
+
+def copy_binary_encoders(column_types):
+    text_encoder = lambda value: str(value).encode("utf-8")
+    return [COPY_BINARY_ENCODERS.get(t, text_encoder) for t in column_types]
+
+
+def convert_field_value(value, ftype):
+    """Convertit une valeur d'attribut QGIS en valeur Python selon le type du champ source."""
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return None
+    if ftype == "String":
+        return str(value)
+    elif ftype in ["Integer", "LongLong", "Integer64"]:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    elif ftype in ["Real", "Double"]:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    elif ftype == "Date":
+        return value.toString(Qt.ISODate) if hasattr(value, 'toString') else str(value)
+    return str(value)
+
+
+# Nombre de lignes lues en tête de CSV pour déduire le type des colonnes
+CSV_SAMPLE_SIZE = 1000
+# Ordre d'essai des types lors de la détection, du plus strict au plus large
+CSV_CANDIDATE_TYPES = ["BOOLEAN", "INTEGER", "BIGINT", "DOUBLE PRECISION", "DATE"]
+# Élargissement d'une colonne quand une valeur ne respecte plus le type détecté
+CSV_TYPE_WIDENING = {
+    "BOOLEAN": "TEXT",
+    "INTEGER": "BIGINT",
+    "BIGINT": "DOUBLE PRECISION",
+    "DOUBLE PRECISION": "TEXT",
+    "DATE": "TEXT",
+}
+# Seuls les mots sans ambiguïté font un booléen : F/M, O/N, oui/non... sont des codes qui peuvent s'enrichir
+CSV_BOOLEAN_VALUES = {"true": "true", "vrai": "true", "false": "false", "faux": "false"}
+# Types PostgreSQL d'une table existante que le chargeur CSV sait valider et normaliser
+CSV_TARGET_TYPES = {
+    "boolean": "BOOLEAN", "integer": "INTEGER", "bigint": "BIGINT", "double precision": "DOUBLE PRECISION",
+    "date": "DATE", "text": "TEXT", "character varying": "TEXT", "character": "TEXT",
+}
+INTEGER_PATTERN = re.compile(r"^[+-]?(0|[1-9]\d*)$")
+FLOAT_PATTERN = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+
+def parse_csv_value(text, sqltype, decimal_comma=False):
+    """Valide une valeur CSV pour un type SQL et la normalise pour COPY. Renvoie (valide, valeur)."""
+    if text is None or text == "":
+        return True, None if sqltype != "TEXT" else text
+    if sqltype == "TEXT":
+        return True, text
+    value = text.strip()
+    if sqltype == "BOOLEAN":
+        normalized = CSV_BOOLEAN_VALUES.get(value.lower())
+        return normalized is not None, normalized
+    if sqltype in ("INTEGER", "BIGINT"):
+        if not INTEGER_PATTERN.match(value):
+            return False, None
+        limit = 2 ** 31 if sqltype == "INTEGER" else 2 ** 63
+        return -limit <= int(value) < limit, value
+    if sqltype == "DOUBLE PRECISION":
+        if decimal_comma:
+            value = value.replace(",", ".")
+        # Les codes à zéros significatifs (INSEE, codes postaux...) restent du texte, signés ou non
+        digits = value.lstrip("+-")
+        if len(digits) > 1 and digits[0] == "0" and digits[1] != ".":
+            return False, None
+        return bool(FLOAT_PATTERN.match(value)), value
+    if sqltype == "DATE":
+        for date_format in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                return True, datetime.strptime(value, date_format).date().isoformat()
+            except ValueError:
+                continue
+        return False, None
+    return True, text
+
+
+def infer_csv_column_type(values, decimal_comma=False):
+    """Déduit le type SQL le plus strict compatible avec toutes les valeurs non vides de l'échantillon."""
+    non_empty = [v for v in values if v not in (None, "")]
+    if not non_empty:
+        return "TEXT"
+    for sqltype in CSV_CANDIDATE_TYPES:
+        if all(parse_csv_value(v, sqltype, decimal_comma)[0] for v in non_empty):
+            return sqltype
+    return "TEXT"
+
+
+def sniff_csv_dialect(file_path, encoding):
+    """Détecte le séparateur d'un CSV (virgule, point-virgule, tabulation ou barre verticale)."""
+    with open(file_path, 'r', newline='', encoding=encoding) as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        return csv.excel
+
+
+class ImportCanceledError(Exception):
+    """Levée quand l'utilisateur annule un import en cours depuis le gestionnaire de tâches."""
+
+
+class BulkCopyLoader:
+    """Charge des lignes dans une table PostgreSQL par COPY ... FROM STDIN, par lots de taille fixe.
+
+    Avec `column_types` (types SQL des colonnes), le COPY se fait au format binaire : nombres et
+    géométries EWKB partent tels quels, sans passage par le texte.
+    """
+
+    def __init__(self, cursor, schema, table_name, columns, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+                 progress_callback=None, is_canceled=None, column_types=None):
+        self.cursor = cursor
+        self.chunk_size = max(1, chunk_size)
+        self.progress_callback = progress_callback
+        self.is_canceled = is_canceled
+        self.encoders = copy_binary_encoders(column_types) if column_types else None
+        self.copy_statement = sql.SQL("COPY {schema}.{table_name} ({cols}) FROM STDIN{options}").format(
+            schema=sql.Identifier(schema),
+            table_name=sql.Identifier(table_name),
+            cols=sql.SQL(", ").join([sql.Identifier(c) for c in columns]),
+            options=sql.SQL(" WITH (FORMAT binary)" if self.encoders else "")
+        )
+        self.buffer = []
+        self.row_count = 0
+        self.start_time = time.perf_counter()
+
+    def add_row(self, values):
+        if self.encoders:
+            self.buffer.append(self.encode_binary_row(values))
+        else:
+            self.buffer.append("\t".join(copy_text_value(v) for v in values))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def encode_binary_row(self, values):
+        parts = [struct.pack(">h", len(values))]
+        for encoder, value in zip(self.encoders, values):
+            if value is None:
+                parts.append(struct.pack(">i", -1))
+            else:
+                data = encoder(value)
+                parts.append(struct.pack(">i", len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.is_canceled and self.is_canceled():
+            raise ImportCanceledError("Import annulé par l'utilisateur.")
+        if self.encoders:
+            data = io.BytesIO(COPY_BINARY_HEADER + b"".join(self.buffer) + COPY_BINARY_TRAILER)
+        else:
+            data = io.StringIO("\n".join(self.buffer) + "\n")
+        self.cursor.copy_expert(self.copy_statement, data)
+        self.row_count += len(self.buffer)
+        self.buffer = []
+        if self.progress_callback:
+            self.progress_callback(self.row_count, self.rows_per_second())
+
+    def finish(self):
+        self.flush()
+        return self.row_count
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def rows_per_second(self):
+        elapsed = self.elapsed()
+        return self.row_count / elapsed if elapsed > 0 else 0.0
+
+
+class BlockingConnectionPool:
+    """Pool de connexions psycopg2 partagé entre threads : getconn attend qu'une connexion se libère."""
+
+    def __init__(self, size, **connect_kwargs):
+        self.pool = ThreadedConnectionPool(1, size, **connect_kwargs)
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        self.semaphore.acquire()
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.semaphore.release()
+            raise
+
+    def putconn(self, conn):
+        self.pool.putconn(conn, close=bool(conn.closed))
+        self.semaphore.release()
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+def sample_features(layer, limit=SAMPLE_FEATURE_LIMIT):
+    """Lit au plus `limit` entités d'une couche, sans géométrie, pour un aperçu des valeurs."""
+    request = QgsFeatureRequest().setLimit(limit).setFlags(QgsFeatureRequest.NoGeometry)
+    return list(layer.getFeatures(request))
+
+
+def field_examples(layer, limit=SAMPLE_FEATURE_LIMIT):
+    """Décrit les champs d'une couche avec une valeur d'exemple tirée d'un aperçu borné."""
+    features = sample_features(layer, limit)
+    example_feature = features[-1] if features else None  # La 10ème ligne si possible
+    fields_info = []
+    for field in layer.fields():
+        example_value = example_feature[field.name()] if example_feature is not None else "N/A"
+        fields_info.append({
+            'name': field.name(),
+            'type': field.typeName(),
+            'example': str(example_value) if example_value is not None else "NULL"
+        })
+    return fields_info
+
+
+def sql_column_name(name):
+    return name.lower().replace('-', '_').replace(' ', '_')
+
+
+def geometry_type_suffix(geom_type_qgis):
+    if geom_type_qgis == 0:  # Point
+        return "_p"
+    elif geom_type_qgis == 1:  # Line
+        return "_l"
+    elif geom_type_qgis == 2:  # Polygon
+        return "_s"
+    return "_t"  # Table sans géométrie
+
+
+def gbdd_table_name(base_name, type_suffix, geo_suffix):
+    """Nom de la table cible : ade_<nom><_p|_l|_s|_t><suffixe géographique>."""
+    return f"ade_{base_name}{type_suffix}{geo_suffix}"
+
+
+def create_table_statement(schema, table_name, columns_sql):
+    return sql.SQL("""
+    CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
+        id SERIAL PRIMARY KEY,
+        {columns}
+    );
+    """).format(
+        schema=sql.Identifier(schema),
+        table_name=sql.Identifier(table_name),
+        columns=columns_sql
+    )
+
+
+def qgis_field_sql_type(ftype):
+    if ftype in ["Integer", "LongLong", "Integer64"]:
+        return "INTEGER"
+    elif ftype in ["Real", "Double"]:
+        return "DOUBLE PRECISION"
+    elif ftype == "String":
+        # Corriger VARCHAR(0) en VARCHAR(255)
+        return "VARCHAR(255)"
+    elif ftype == "Date":
+        return "DATE"
+    return "TEXT"
+
+
+def import_shapefile(cursor, file_path, schema, geo_suffix, layer_name=None, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+                     progress_callback=None, log_callback=None, is_canceled=None, unique_id_field=None, incremental=False,
+                     copy_format=DEFAULT_COPY_FORMAT):
+    """Importe une couche vectorielle (shapefile ou couche de GeoPackage) dans une nouvelle table. Renvoie (table, nb de lignes).
+
+    Les géométries sont transmises en EWKB : brut en COPY binaire, hexadécimal en COPY texte (`copy_format`).
+
+    En mode incrémental, les lignes sont rapprochées sur `unique_id_field` : seules les lignes nouvelles,
+    modifiées (empreinte différente) ou disparues sont écrites dans une table déjà existante.
+    """
+    base_name = os.path.splitext(os.path.basename(file_path if layer_name is None else layer_name))[0].lower()
+    layer = QgsVectorLayer(file_path, base_name, "ogr")
+    if not layer.isValid():
+        raise ValueError(f"La couche {base_name} est invalide.")
+    geom_type_qgis = layer.geometryType()
+    original_names = [field.name() for field in layer.fields()]
+    sql_names = [sql_column_name(name) for name in original_names]
+    field_types = [field.typeName() for field in layer.fields()]
+    new_table_name = gbdd_table_name(base_name, geometry_type_suffix(geom_type_qgis), geo_suffix)
+    key_column = sql_column_name(unique_id_field) if incremental and unique_id_field else None
+    if key_column and key_column not in sql_names:
+        raise ValueError(f"L'identifiant unique {unique_id_field} est absent de la couche {base_name}.")
+    try:
+        column_defs = [sql.Identifier(n) + sql.SQL(f" {qgis_field_sql_type(t)}") for n, t in zip(sql_names, field_types)]
+        has_geom = geom_type_qgis in (0, 1, 2)
+        geom_def = sql.SQL(", geom GEOMETRY(GEOMETRY, 2154)") if has_geom else sql.SQL("")
+        columns_sql = sql.SQL(", ").join(column_defs) + geom_def
+        if key_column:
+            columns_sql += sql.SQL(", row_hash TEXT")
+        # Une table créée à vide par le planificateur se charge directement, sans rapprochement
+        existing_table = table_has_rows(cursor, schema, new_table_name)
+
+        # Création de la table
+        cursor.execute(create_table_statement(schema, new_table_name, columns_sql))
+        # Table existante typée par l'optimisation post-chargement : les géométries sont adaptées à son typage
+        target_typmod = geometry_column_typmod(cursor, schema, new_table_name) if has_geom else ("", 0)
+        conform = target_typmod[0] not in ("", "GEOMETRY")
+
+        copy_columns = sql_names + (["geom"] if has_geom else [])
+        target_schema, target_table = schema, new_table_name
+        if key_column:
+            # Empreinte des lignes et unicité de l'identifiant, nécessaires au rapprochement
+            cursor.execute(
+                sql.SQL("ALTER TABLE {schema}.{table_name} ADD COLUMN IF NOT EXISTS row_hash TEXT;").format(
+                    schema=sql.Identifier(schema), table_name=sql.Identifier(new_table_name))
+            )
+            cursor.execute(
+                sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {schema}.{table_name} ({key});").format(
+                    index=sql.Identifier(f"{new_table_name}_{key_column}_uidx"), schema=sql.Identifier(schema),
+                    table_name=sql.Identifier(new_table_name), key=sql.Identifier(key_column))
+            )
+            if existing_table:
+                # Table déjà présente : chargement dans une table de transit temporaire
+                target_schema, target_table = "pg_temp", f"stg_{new_table_name}"
+                cursor.execute(
+                    sql.SQL("""
+                    CREATE TEMP TABLE {stage} ON COMMIT DROP AS
+                    SELECT {cols}, row_hash FROM {schema}.{table_name} WITH NO DATA;
+                    """).format(
+                        stage=sql.Identifier(target_table),
+                        cols=sql.SQL(", ").join(
+                            [sql.SQL("geom::geometry AS geom") if c == "geom" else sql.Identifier(c) for c in copy_columns]),
+                        schema=sql.Identifier(schema),
+                        table_name=sql.Identifier(new_table_name)
+                    )
+                )
+            copy_columns = copy_columns + ["row_hash"]
+
+        # Insertion des données par COPY, lot par lot
+        binary = copy_format == "binary"
+        column_types = None
+        if binary:
+            column_types = ([qgis_field_sql_type(t) for t in field_types] + (["GEOMETRY"] if has_geom else [])
+                            + (["TEXT"] if key_column else []))
+        loader = BulkCopyLoader(
+            cursor, target_schema, target_table, copy_columns, chunk_size=chunk_size,
+            progress_callback=(lambda rows, rate: progress_callback(new_table_name, rows, rate)) if progress_callback else None,
+            is_canceled=is_canceled, column_types=column_types
+        )
+        to_ewkb = wkb_to_ewkb if binary else wkb_to_ewkb_hex
+        # Parcours en flux unique : aucune entité n'est conservée au-delà du lot en cours
+        request = QgsFeatureRequest()
+        if not has_geom:
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+        for feature in layer.getFeatures(request):
+            values = [convert_field_value(feature[orig_name], field_types[i]) for i, orig_name in enumerate(original_names)]
+            if has_geom:
+                geom = feature.geometry()
+                if conform and geom and not geom.isNull():
+                    conform_geometry(geom, *target_typmod)
+                values.append(to_ewkb(geom.asWkb()) if geom and not geom.isNull() else None)
+            if key_column:
+                values.append(row_hash(values))
+            loader.add_row(values)
+        loader.finish()
+
+        if key_column and existing_table:
+            cursor.execute(
+                sql.SQL("CREATE INDEX ON pg_temp.{stage} ({key}); ANALYZE pg_temp.{stage};").format(
+                    stage=sql.Identifier(target_table), key=sql.Identifier(key_column))
+            )
+            inserted, updated, deleted = apply_incremental_merge(
+                cursor, schema, new_table_name, target_table, copy_columns[:-1], key_column
+            )
+            if log_callback:
+                log_callback(
+                    f"{new_table_name} : mise à jour incrémentale sur {key_column}, "
+                    f"{inserted} insertions, {updated} mises à jour, {deleted} suppressions."
+                )
+    except ImportCanceledError:
+        raise
+    except Exception as e:
+        raise RuntimeError(
+            f"Erreur lors de l'import de {base_name} : {str(e)}\n\n"
+            f"Types de champs détectés : {field_types}\n"
+            f"Noms de champs détectés : {original_names}"
+        ) from e
+    if log_callback:
+        log_callback(
+            f"{new_table_name} : {loader.row_count} lignes chargées en {loader.elapsed():.1f} s "
+            f"({loader.rows_per_second():.0f} lignes/s)."
+        )
+    return new_table_name, loader.row_count
+
+
+def row_hash(values):
+    """Empreinte MD5 des attributs et de la géométrie d'une ligne, pour détecter les lignes modifiées."""
+    # Les géométries binaires sont hachées en hexadécimal : même empreinte quel que soit le format de transfert
+    return hashlib.md5(
+        "\x1f".join(copy_text_value(v.hex() if isinstance(v, bytes) else v) for v in values).encode("utf-8")
+    ).hexdigest()
+
+
+def table_has_rows(cursor, schema, table_name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (sql.Identifier(schema, table_name).as_string(cursor),))
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute(
+        sql.SQL("SELECT EXISTS (SELECT 1 FROM {schema}.{table_name});").format(
+            schema=sql.Identifier(schema), table_name=sql.Identifier(table_name))
+    )
+    return cursor.fetchone()[0]
+
+
+def geometry_column_typmod(cursor, schema, table_name):
+    """(type, dimension) déclarés de la colonne geom : type GEOMETRY si non typée, ("", 0) si absente."""
+    cursor.execute(
+        "SELECT type, coord_dimension FROM geometry_columns "
+        "WHERE f_table_schema = %s AND f_table_name = %s AND f_geometry_column = 'geom';",
+        (schema, table_name)
+    )
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+
+def conform_geometry(geom, geom_type, dimension):
+    """Adapte en place une géométrie au typage d'une colonne (simple ou multi, Z et M), comme le ferait
+    ST_Multi/ST_Force2D/ST_Force3D : une table typée par l'optimisation accepte ainsi les ajouts suivants."""
+    # PostGIS suffixe le type par M pour les géométries XYM (dimension 3)
+    has_m = dimension == 4 or (dimension == 3 and geom_type.endswith("M"))
+    has_z = dimension == 4 or (dimension == 3 and not has_m)
+    base_type = geom_type[:-1] if has_m and dimension == 3 else geom_type
+    if base_type.startswith("MULTI"):
+        geom.convertToMultiType()
+    elif geom.isMultipart():
+        # Réussit pour une seule partie ; sinon PostgreSQL refusera la ligne
+        geom.convertToSingleType()
+    abstract = geom.get()
+    if has_z and not abstract.is3D():
+        abstract.addZValue(0)
+    elif not has_z and abstract.is3D():
+        abstract.dropZValue()
+    if has_m and not abstract.isMeasure():
+        abstract.addMValue(0)
+    elif not has_m and abstract.isMeasure():
+        abstract.dropMValue()
+
+
+def apply_incremental_merge(cursor, schema, table_name, stage_name, columns, key_column):
+    """Reporte la table de transit sur la table cible : insertions, mises à jour des lignes dont l'empreinte
+    a changé et suppressions des identifiants disparus. Renvoie (insérées, mises à jour, supprimées)."""
+    table = sql.SQL("{schema}.{table}").format(schema=sql.Identifier(schema), table=sql.Identifier(table_name))
+    stage = sql.SQL("pg_temp.{stage}").format(stage=sql.Identifier(stage_name))
+    merge_columns = columns + ["row_hash"]
+    # La table cible a pu être typée en multi par une optimisation post-chargement antérieure
+    multi = geometry_column_typmod(cursor, schema, table_name)[0].startswith("MULTI")
+    select_items = [
+        sql.SQL("ST_Multi(geom)") if c == "geom" and multi else sql.Identifier(c)
+        for c in merge_columns
+    ]
+    cursor.execute(
+        sql.SQL("""
+        WITH upsert AS (
+            INSERT INTO {table} ({cols})
+            SELECT DISTINCT ON ({key}) {select_items} FROM {stage}
+            WHERE {key} IS NOT NULL
+            ORDER BY {key}
+            ON CONFLICT ({key}) DO UPDATE SET {updates}
+            WHERE {table_name}.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upsert;
+        """).format(
+            table=table,
+            table_name=sql.Identifier(table_name),
+            cols=sql.SQL(", ").join([sql.Identifier(c) for c in merge_columns]),
+            select_items=sql.SQL(", ").join(select_items),
+            stage=stage,
+            key=sql.Identifier(key_column),
+            updates=sql.SQL(", ").join(
+                [sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c)) for c in merge_columns if c != key_column]
+            )
+        )
+    )
+    inserted, updated = cursor.fetchone()
+    cursor.execute(
+        sql.SQL("""
+        DELETE FROM {table} AS t
+        WHERE NOT EXISTS (SELECT 1 FROM {stage} AS s WHERE s.{key} = t.{key});
+        """).format(table=table, stage=stage, key=sql.Identifier(key_column))
+    )
+    return inserted, updated, cursor.rowcount
+
+
+def list_geopackage_layers(file_path):
+    """Renvoie la liste (nom de couche, source OGR) des couches valides d'un GeoPackage."""
+    all_layers = QgsVectorLayer(file_path, "temp", "ogr")
+    if not all_layers.isValid():
+        raise ValueError("Impossible de lire les couches du GeoPackage.")
+    layers = []
+    for sublayer in all_layers.dataProvider().subLayers():
+        layer_name = sublayer.split('!!::!!')[1] if '!!::!!' in sublayer else sublayer
+        gpkg_layer = QgsVectorLayer(f"{file_path}|layername={layer_name}", layer_name, "ogr")
+        if gpkg_layer.isValid():
+            layers.append((layer_name, gpkg_layer.source()))
+    return layers
+
+
+def import_geopackage(cursor, file_path, schema, geo_suffix, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+                      progress_callback=None, log_callback=None, is_canceled=None, copy_format=DEFAULT_COPY_FORMAT):
+    """Importe successivement toutes les couches d'un GeoPackage. Renvoie la liste des (table, nb de lignes)."""
+    return [
+        import_shapefile(cursor, source, schema, geo_suffix, layer_name=layer_name, chunk_size=chunk_size,
+                         progress_callback=progress_callback, log_callback=log_callback, is_canceled=is_canceled,
+                         copy_format=copy_format)
+        for layer_name, source in list_geopackage_layers(file_path)
+    ]
+
+
+def table_column_types(cursor, schema, table_name):
+    """Types des colonnes d'une table existante, {colonne: type PostgreSQL} (vide si la table n'existe pas)."""
+    cursor.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = %s AND table_name = %s;",
+        (schema, table_name)
+    )
+    return dict(cursor.fetchall())
+
+
+def import_csv(cursor, file_path, schema, geo_suffix, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+               progress_callback=None, log_callback=None, is_canceled=None, append=False):
+    """Importe un CSV dans une table aux colonnes typées d'après un échantillon. Renvoie (table, nb de lignes).
+
+    Avec `append` (table déjà présente avant l'import), les valeurs sont validées contre les types de la table :
+    elle n'est jamais élargie ni vidée, et une valeur incompatible interrompt l'import de ce fichier.
+    """
+    log_callback = log_callback or (lambda message: None)
+    base_name = os.path.splitext(os.path.basename(file_path))[0].lower()
+    new_table_name = gbdd_table_name(base_name, "_t", geo_suffix)
+    try:
+        encoding = 'utf-8-sig'
+        dialect = sniff_csv_dialect(file_path, encoding)
+        decimal_comma = dialect.delimiter != ','
+        with open(file_path, 'r', newline='', encoding=encoding) as f:
+            reader = csv.reader(f, dialect)
+            header = next(reader)
+            header_lower = [sql_column_name(h) for h in header]
+            nb_cols = len(header_lower)
+
+            # Échantillon des premières lignes pour déduire le type des colonnes
+            sample_rows = []
+            for row in reader:
+                sample_rows.append((row + [""] * nb_cols)[:nb_cols])
+                if len(sample_rows) >= CSV_SAMPLE_SIZE:
+                    break
+            target_types = table_column_types(cursor, schema, new_table_name) if append else {}
+            if append:
+                missing = [h for h in header_lower if h not in target_types]
+                if missing:
+                    raise ValueError(f"colonnes absentes de la table existante {new_table_name} : {', '.join(missing)}")
+                # Types hors de CSV_TARGET_TYPES : valeur transmise telle quelle, convertie par PostgreSQL
+                column_types = [CSV_TARGET_TYPES.get(target_types[h], target_types[h].upper()) for h in header_lower]
+            else:
+                column_types = [
+                    infer_csv_column_type([row[i] for row in sample_rows], decimal_comma)
+                    for i in range(nb_cols)
+                ]
+                log_callback(
+                    f"{new_table_name} : types détectés "
+                    + ", ".join(f"{h} {t}" for h, t in zip(header_lower, column_types))
+                )
+
+            column_defs = [sql.Identifier(h) + sql.SQL(f" {t}") for h, t in zip(header_lower, column_types)]
+            cursor.execute(create_table_statement(schema, new_table_name, sql.SQL(", ").join(column_defs)))
+
+            # Chargement en flux : l'échantillon puis le reste du fichier, par lots COPY
+            def new_loader():
+                return BulkCopyLoader(
+                    cursor, schema, new_table_name, header_lower, chunk_size=chunk_size,
+                    progress_callback=(lambda rows, rate: progress_callback(new_table_name, rows, rate)) if progress_callback else None,
+                    is_canceled=is_canceled
+                )
+
+            def file_rows():
+                for row in reader:
+                    yield (row + [""] * nb_cols)[:nb_cols]
+
+            loader = new_loader()
+            rows = chain(sample_rows, file_rows())
+            while True:
+                reload = False
+                for row in rows:
+                    values = []
+                    for i, text in enumerate(row):
+                        ok, value = parse_csv_value(text, column_types[i], decimal_comma)
+                        if not ok and append:
+                            raise ValueError(
+                                f"valeur « {text} » incompatible avec la colonne {header_lower[i]} "
+                                f"({target_types[header_lower[i]]}) de la table existante {new_table_name}, "
+                                f"aucune ligne de ce fichier n'est ajoutée"
+                            )
+                        while not ok:
+                            # Valeur hors du type détecté : on élargit la colonne, créée par cet import, avant de continuer
+                            loader.flush()
+                            column_types[i] = CSV_TYPE_WIDENING[column_types[i]]
+                            if column_types[i] == "TEXT" and not reload:
+                                # Les lignes chargées portent des valeurs normalisées (dates ISO, booléens,
+                                # décimales à point) : on les supprime pour recharger le texte d'origine
+                                cursor.execute(sql.SQL("TRUNCATE {schema}.{table_name};").format(
+                                    schema=sql.Identifier(schema), table_name=sql.Identifier(new_table_name)))
+                                reload = True
+                            cursor.execute(
+                                sql.SQL("ALTER TABLE {schema}.{table_name} ALTER COLUMN {col} TYPE {type} USING {col}::{type};").format(
+                                    schema=sql.Identifier(schema),
+                                    table_name=sql.Identifier(new_table_name),
+                                    col=sql.Identifier(header_lower[i]),
+                                    type=sql.SQL(column_types[i])
+                                )
+                            )
+                            log_callback(f"{new_table_name} : colonne {header_lower[i]} élargie en {column_types[i]}.")
+                            ok, value = parse_csv_value(text, column_types[i], decimal_comma)
+                        values.append(value)
+                    if reload:
+                        break
+                    loader.add_row(values)
+                if not reload:
+                    break
+                log_callback(f"{new_table_name} : rechargement depuis le début du fichier.")
+                f.seek(0)
+                reader = csv.reader(f, dialect)
+                next(reader)
+                loader = new_loader()
+                rows = file_rows()
+            loader.finish()
+    except ImportCanceledError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Erreur lors de l'import de {new_table_name} : {e}") from e
+    log_callback(
+        f"{new_table_name} : {loader.row_count} lignes chargées en {loader.elapsed():.1f} s "
+        f"({loader.rows_per_second():.0f} lignes/s)."
+    )
+    return new_table_name, loader.row_count
+
+
+def estimate_csv_rows(file_path):
+    """Estime le nombre de lignes d'un CSV d'après la longueur moyenne des lignes de son début."""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        head = f.read(64 * 1024)
+    nb_lines = head.count(b"\n")
+    if nb_lines == 0:
+        return 1 if size else 0
+    return max(0, int(size / (len(head) / nb_lines)) - 1)
+
+
+def format_bytes(size):
+    for unit in ["o", "Ko", "Mo", "Go"]:
+        if size < 1024 or unit == "Go":
+            return f"{size:.0f} {unit}" if unit == "o" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def plan_vector_layer(source, geo_suffix, layer_name=None):
+    """Décrit la table cible d'une couche vectorielle à partir de ses seules métadonnées (aucune entité lue)."""
+    base_name = os.path.splitext(os.path.basename(source if layer_name is None else layer_name))[0].lower()
+    layer = QgsVectorLayer(source, base_name, "ogr")
+    if not layer.isValid():
+        raise ValueError(f"La couche {base_name} est invalide.")
+    geom_type_qgis = layer.geometryType()
+    columns = [(sql_column_name(field.name()), qgis_field_sql_type(field.typeName())) for field in layer.fields()]
+    rows = max(0, layer.featureCount())
+    has_geom = geom_type_qgis in (0, 1, 2)
+    row_bytes = ESTIMATED_ROW_OVERHEAD + sum(ESTIMATED_TYPE_BYTES.get(t, ESTIMATED_TEXT_BYTES) for _, t in columns)
+    geometry_bytes = 0
+    if has_geom:
+        shp_path = source if layer_name is None else ""
+        # Pour un shapefile, le .shp donne directement le volume des géométries
+        geometry_bytes = (os.path.getsize(shp_path) if shp_path.lower().endswith('.shp') and os.path.exists(shp_path)
+                          else ESTIMATED_GEOMETRY_BYTES[geom_type_qgis] * rows)
+    return {
+        "table": gbdd_table_name(base_name, geometry_type_suffix(geom_type_qgis), geo_suffix),
+        "columns": columns + ([("geom", "GEOMETRY(GEOMETRY, 2154)")] if has_geom else []),
+        "rows": rows,
+        "bytes": row_bytes * rows + geometry_bytes,
+    }
+
+
+def plan_csv_file(file_path, geo_suffix):
+    """Décrit la table cible d'un CSV d'après son en-tête et un échantillon borné de lignes."""
+    base_name = os.path.splitext(os.path.basename(file_path))[0].lower()
+    encoding = 'utf-8-sig'
+    dialect = sniff_csv_dialect(file_path, encoding)
+    decimal_comma = dialect.delimiter != ','
+    with open(file_path, 'r', newline='', encoding=encoding) as f:
+        reader = csv.reader(f, dialect)
+        header = [sql_column_name(h) for h in next(reader)]
+        sample_rows = []
+        for row in reader:
+            sample_rows.append((row + [""] * len(header))[:len(header)])
+            if len(sample_rows) >= CSV_SAMPLE_SIZE:
+                break
+    columns = [
+        (h, infer_csv_column_type([row[i] for row in sample_rows], decimal_comma))
+        for i, h in enumerate(header)
+    ]
+    rows = estimate_csv_rows(file_path)
+    row_bytes = ESTIMATED_ROW_OVERHEAD + sum(ESTIMATED_TYPE_BYTES.get(t, ESTIMATED_TEXT_BYTES) for _, t in columns)
+    return {
+        "table": gbdd_table_name(base_name, "_t", geo_suffix),
+        "columns": columns,
+        "rows": rows,
+        "bytes": max(row_bytes * rows, os.path.getsize(file_path)),
+    }
+
+
+def find_existing_tables(cursor, schema, table_names):
+    """Interroge le catalogue en une seule requête : {table existante: ensemble de ses colonnes}."""
+    cursor.execute(
+        """
+        SELECT c.relname, array_agg(a.attname::text)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE n.nspname = %s AND c.relname = ANY(%s)
+        GROUP BY c.relname;
+        """,
+        (schema, list(table_names))
+    )
+    return {table_name: set(columns) for table_name, columns in cursor.fetchall()}
+
+
+def check_import_plan(plans, existing_tables):
+    """Renseigne l'état de chaque table prévue : nouvelle, existante, ou en conflit."""
+    seen = {}
+    for plan in plans:
+        table_name = plan["table"]
+        if table_name in seen:
+            plan["status"] = "Conflit"
+            plan["conflict"] = f"même table cible que {seen[table_name]}"
+        elif table_name in existing_tables:
+            missing = [name for name, _ in plan["columns"] if name not in existing_tables[table_name]]
+            plan["status"] = "Conflit" if missing else "Existante"
+            plan["conflict"] = f"colonnes absentes de la table existante : {', '.join(missing)}" if missing else ""
+        else:
+            plan["status"] = "Nouvelle"
+            plan["conflict"] = ""
+        seen.setdefault(table_name, plan["job"]["file"])
+    return [plan for plan in plans if plan["status"] == "Conflit"]
+
+
+def create_planned_tables(conn, schema, plans, owner_rights, admin_rights, read_rights):
+    """Crée toutes les nouvelles tables du plan et leurs droits dans une seule transaction : tout ou rien."""
+    statements = []
+    for plan in plans:
+        if plan["status"] != "Nouvelle":
+            continue
+        statements.append(create_table_statement(
+            schema, plan["table"],
+            sql.SQL(", ").join([sql.Identifier(name) + sql.SQL(f" {sqltype}") for name, sqltype in plan["columns"]])
+        ))
+        statements.extend(table_rights_statements(schema, plan["table"], owner_rights, admin_rights, read_rights))
+    created = sum(1 for plan in plans if plan["status"] == "Nouvelle")
+    if not statements:
+        return 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("\n").join(statements))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return created
+
+
+def drop_planned_tables(conn, schema, table_names):
+    """Supprime en une transaction les tables créées par le plan dont le chargement n'a pas abouti.
+
+    Sans cela, une table restée vide après un échec ou une annulation serait vue comme « Existante »
+    au lancement suivant, et les lignes y seraient ajoutées.
+    """
+    if not table_names:
+        return 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("\n").join(
+                sql.SQL("DROP TABLE IF EXISTS {schema}.{table};").format(
+                    schema=sql.Identifier(schema), table=sql.Identifier(table_name))
+                for table_name in table_names
+            ))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(table_names)
+
+
+def table_rights_statements(schema, table_name, owner_rights, admin_rights, read_rights):
+    """Propriétaire et droits d'une table, à exécuter avec le DDL de création."""
+    table = sql.SQL("{schema}.{table}").format(schema=sql.Identifier(schema), table=sql.Identifier(table_name))
+    return [
+        sql.SQL("ALTER TABLE {table} OWNER TO {owner};").format(table=table, owner=sql.Identifier(owner_rights)),
+        sql.SQL("GRANT SELECT, UPDATE, INSERT, DELETE, REFERENCES ON TABLE {table} TO {owner};").format(
+            table=table, owner=sql.Identifier(owner_rights)),
+        sql.SQL("GRANT ALL ON TABLE {table} TO {admin};").format(table=table, admin=sql.Identifier(admin_rights)),
+        sql.SQL("GRANT SELECT ON TABLE {table} TO {read};").format(table=table, read=sql.Identifier(read_rights)),
+    ]
+
+
+def save_import_metadata(cursor, schema, table_name, metadata):
+    cursor.execute(
+        sql.SQL("""
+        INSERT INTO {schema}.metadata_import (table_name, metadata, import_date)
+        VALUES (%s, %s, NOW());
+        """).format(schema=sql.Identifier(schema)),
+        (table_name, metadata)
+    )
+
+
+def detect_geometry_typmod(cursor, schema, table_name):
+    """Renvoie (type, passage en multi) si toutes les géométries chargées partagent un même type, sinon (None, False)."""
+    cursor.execute(
+        sql.SQL("SELECT DISTINCT GeometryType(geom), ST_Zmflag(geom) FROM {schema}.{table} WHERE geom IS NOT NULL;").format(
+            schema=sql.Identifier(schema),
+            table=sql.Identifier(table_name)
+        )
+    )
+    rows = cursor.fetchall()
+    if not rows or len({zmflag for _, zmflag in rows}) != 1:
+        return None, False
+    # GeometryType suffixe les géométries M-seules par "M" : on repart du type de base
+    types = {geom_type[:-1] if geom_type.endswith("M") and rows[0][1] == 1 else geom_type for geom_type, _ in rows}
+    dims = {0: "", 1: "M", 2: "Z", 3: "ZM"}[rows[0][1]]
+    if len(types) == 1:
+        return types.pop() + dims, False
+    # Mélange simple/multi d'une même famille (POLYGON + MULTIPOLYGON) : on passe tout en multi
+    multi_types = {t if t.startswith("MULTI") else "MULTI" + t for t in types}
+    if len(multi_types) == 1 and multi_types.pop() in ("MULTIPOINT", "MULTILINESTRING", "MULTIPOLYGON"):
+        return [t for t in types if t.startswith("MULTI")][0] + dims, True
+    return None, False
+
+
+def optimize_table(conn, schema, table_name, index_columns=(), cluster=False, typed_geometry=True):
+    """Étape post-chargement : géométrie typée, index GiST et attributaires, CLUSTER optionnel puis VACUUM ANALYZE.
+
+    Sans `typed_geometry` (tables mises à jour en incrémental), la colonne geom reste générique : une version
+    suivante de la couche peut mélanger les types. Exécutée hors transaction (VACUUM l'impose).
+    Renvoie la liste des (étape, durée en secondes).
+    """
+    timings = []
+    table = sql.SQL("{schema}.{table}").format(schema=sql.Identifier(schema), table=sql.Identifier(table_name))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            def timed(step, statement):
+                start = time.perf_counter()
+                cursor.execute(statement)
+                timings.append((step, time.perf_counter() - start))
+
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s;",
+                (schema, table_name)
+            )
+            columns = {row[0] for row in cursor.fetchall()}
+            geom_index = f"{table_name}_geom_idx"
+            if "geom" in columns:
+                typmod, to_multi = detect_geometry_typmod(cursor, schema, table_name) if typed_geometry else (None, False)
+                if typmod:
+                    timed(f"géométrie typée {typmod}", sql.SQL(
+                        "ALTER TABLE {table} ALTER COLUMN geom TYPE geometry({typmod}, 2154) USING {expr};"
+                    ).format(table=table, typmod=sql.SQL(typmod),
+                             expr=sql.SQL("ST_Multi(geom)" if to_multi else "geom")))
+                timed("index GiST", sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} USING GIST (geom);").format(
+                    index=sql.Identifier(geom_index), table=table))
+            for column in index_columns:
+                if column in columns and column != "id":
+                    timed(f"index {column}", sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} ({column});").format(
+                        index=sql.Identifier(f"{table_name}_{column}_idx"), table=table,
+                        column=sql.Identifier(column)))
+            if cluster and "geom" in columns:
+                timed("CLUSTER", sql.SQL("CLUSTER {table} USING {index};").format(
+                    table=table, index=sql.Identifier(geom_index)))
+            timed("VACUUM ANALYZE", sql.SQL("VACUUM ANALYZE {table};").format(table=table))
+    finally:
+        conn.autocommit = False
+    return timings
+
+
+def run_import_job(job, db_pool, settings, events, is_canceled=None, progress_callback=None):
+    """Importe un fichier (ou une couche de GeoPackage) dans sa propre transaction, sur une connexion du pool.
+
+    Exécutée dans un thread de travail : aucun accès à l'interface, la progression passe par la file `events`.
+    """
+    result = {"job": job, "table": None, "rows": 0, "seconds": 0.0, "status": "Erreur", "message": ""}
+    start = time.perf_counter()
+
+    def progress(table_name, rows, rate):
+        events.put(("progress", job["index"], table_name, rows, rate))
+        if progress_callback:
+            progress_callback(rows)
+
+    def log(message):
+        events.put(("log", message))
+
+    try:
+        conn = db_pool.getconn()
+    except Exception as e:
+        result["message"] = f"Impossible de se connecter à la base : {e}"
+        return result
+    try:
+        with conn.cursor() as cursor:
+            if job["kind"] == "csv":
+                if settings["incremental"]:
+                    log(f"{job['file']} : mode incrémental non disponible pour les CSV, import complet.")
+                table_name, rows = import_csv(cursor, job["source"], settings["schema"], settings["geo_suffix"],
+                                              settings["chunk_size"], progress, log, is_canceled,
+                                              append=job.get("plan", {}).get("status") == "Existante")
+            else:
+                table_name, rows = import_shapefile(cursor, job["source"], settings["schema"], settings["geo_suffix"],
+                                                    layer_name=job["layer_name"], chunk_size=settings["chunk_size"],
+                                                    progress_callback=progress, log_callback=log, is_canceled=is_canceled,
+                                                    unique_id_field=job["unique_id_field"],
+                                                    incremental=settings["incremental"],
+                                                    copy_format=settings["copy_format"])
+            result.update(table=table_name, rows=rows)
+            warnings = []
+
+            # Sauvegarde de la métadonnée
+            if settings["metadata"]:
+                try:
+                    cursor.execute("SAVEPOINT metadonnee;")
+                    save_import_metadata(cursor, settings["schema"], table_name, settings["metadata"])
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT metadonnee;")
+                    warnings.append(f"Erreur lors de la sauvegarde de la métadonnée : {e}")
+        conn.commit()
+        result["status"] = "OK"
+
+        # Optimisation post-chargement, les données étant déjà validées
+        if settings["post_load"]:
+            index_columns = list(settings["index_columns"])
+            key_column = sql_column_name(job["unique_id_field"]) if job["unique_id_field"] else None
+            if key_column and not settings["incremental"]:
+                index_columns.append(key_column)
+            elif key_column in index_columns:
+                # Déjà couverte par l'index unique créé pour le rapprochement incrémental
+                index_columns.remove(key_column)
+            try:
+                timings = optimize_table(conn, settings["schema"], table_name, index_columns, settings["cluster"],
+                                         typed_geometry=not settings["incremental"])
+            except Exception as e:
+                conn.rollback()
+                warnings.append(f"Erreur lors de l'optimisation de {table_name} : {e}")
+            else:
+                summary = ", ".join(f"{step} {seconds:.1f} s" for step, seconds in timings)
+                log(f"{table_name} : optimisation post-chargement ({summary}).")
+                # Étape distincte : un échec d'écriture des durées ne remet pas en cause l'optimisation faite
+                try:
+                    with conn.cursor() as cursor:
+                        save_import_metadata(cursor, settings["schema"], table_name,
+                                             f"Optimisation post-chargement : {summary}")
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    warnings.append(f"Durées d'optimisation de {table_name} non enregistrées dans metadata_import : {e}")
+        result["message"] = "\n".join(warnings)
+    except ImportCanceledError as e:
+        conn.rollback()
+        result["status"] = "Annulé"
+        result["message"] = str(e)
+    except Exception as e:
+        conn.rollback()
+        result["message"] = str(e)
+    finally:
+        db_pool.putconn(conn)
+        result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class GBDDImportFileTask(QgsTask):
+    """Sous-tâche QGIS important un fichier (ou une couche de GeoPackage) en arrière-plan."""
+
+    def __init__(self, job, db_pool, settings, events):
+        super().__init__(f"Import GBDD : {job['file']}", QgsTask.CanCancel)
+        self.job = job
+        self.db_pool = db_pool
+        self.settings = settings
+        self.events = events
+
+    def run(self):
+        expected_rows = self.job.get("expected_rows") or 0
+
+        def progress(rows):
+            if expected_rows:
+                self.setProgress(min(99.0, 100.0 * rows / expected_rows))
+
+        result = run_import_job(self.job, self.db_pool, self.settings, self.events,
+                                is_canceled=self.isCanceled, progress_callback=progress)
+        self.events.put(("result", result))
+        # Un échec d'import est consigné dans le résultat : renvoyer False annulerait les autres sous-tâches
+        return not self.isCanceled()
+
+
+class GBDDImportTask(QgsTask):
+    """Tâche QGIS regroupant un import GBDD : une sous-tâche par fichier, au plus `workers` à la fois."""
+
+    def __init__(self, jobs, db_pool, settings, events, workers):
+        super().__init__(f"Import GBDD ({len(jobs)} fichiers)", QgsTask.CanCancel)
+        self.file_tasks = []
+        for job in jobs:
+            file_task = GBDDImportFileTask(job, db_pool, settings, events)
+            # Chaque sous-tâche attend la fin de celle lancée `workers` rangs avant elle
+            dependencies = [self.file_tasks[-workers]] if len(self.file_tasks) >= workers else []
+            self.addSubTask(file_task, dependencies, QgsTask.ParentDependsOnSubTask)
+            self.file_tasks.append(file_task)
+
+    def run(self):
+        return True
+
+
 class SelectUniqueIdDialog(QDialog):
     def __init__(self, fields, parent=None):
         super(SelectUniqueIdDialog, self).__init__(parent)
@@ -104,6 +1199,7 @@ class ImportFromFolderDialog(QDialog):
         # Initialiser l'interface
         self.setup_ui()
         self.selected_folder = None
+        self.import_task = None
 
     def setup_ui(self):
         layout = QVBoxLayout()
@@ -139,6 +1235,8 @@ class ImportFromFolderDialog(QDialog):
             <li>Cochez les fichiers à importer dans la liste.</li>
             <li>Cliquez sur "Importer et allouer les droits" pour lancer le processus.</li>
         </ol>
+        <p>L'import s'exécute en arrière-plan dans le gestionnaire de tâches de QGIS (une tâche par fichier) :
+        vous pouvez continuer à travailler, suivre la progression dans le tableau récapitulatif ou l'annuler.</p>
         <h3>Règles de nommage :</h3>
         <p>Le nom de chaque couche sera transformé selon les règles suivantes :
         <code>ade_[nom]_p</code> (point), <code>ade_[nom]_l</code> (ligne), <code>ade_[nom]_s</code> (surface), <code>ade_[nom]_t</code> (tableur),
@@ -233,10 +1331,79 @@ class ImportFromFolderDialog(QDialog):
         password_layout.addWidget(self.show_password_check)
         layout.addLayout(password_layout)
 
-        # Bouton d'import
+        # Taille des lots COPY
+        chunk_layout = QHBoxLayout()
+        chunk_layout.addWidget(QLabel("Taille des lots de chargement (lignes) :"))
+        self.chunk_size_spin = QSpinBox()
+        self.chunk_size_spin.setRange(100, 1000000)
+        self.chunk_size_spin.setSingleStep(1000)
+        self.chunk_size_spin.setValue(DEFAULT_COPY_CHUNK_SIZE)
+        chunk_layout.addWidget(self.chunk_size_spin)
+        chunk_layout.addWidget(QLabel("Imports simultanés :"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 16)
+        self.workers_spin.setValue(DEFAULT_IMPORT_WORKERS)
+        chunk_layout.addWidget(self.workers_spin)
+        layout.addLayout(chunk_layout)
+
+        # Mode d'import
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(QLabel("Mode d'import :"))
+        self.import_mode_combo = QComboBox()
+        self.import_mode_combo.addItems([
+            "Complet (création de la table et ajout des lignes)",
+            "Incrémental (mise à jour des lignes selon l'identifiant unique)"
+        ])
+        mode_layout.addWidget(self.import_mode_combo)
+        mode_layout.addWidget(QLabel("Transfert des couches :"))
+        self.copy_format_combo = QComboBox()
+        self.copy_format_combo.addItem("Binaire (géométries EWKB brutes)", "binary")
+        self.copy_format_combo.addItem("Texte (géométries EWKB hexadécimales)", "text")
+        mode_layout.addWidget(self.copy_format_combo)
+        layout.addLayout(mode_layout)
+
+        # Optimisation post-chargement
+        self.post_load_check = QCheckBox("Optimiser les tables après chargement (géométrie typée, index GiST, VACUUM ANALYZE)")
+        self.post_load_check.setChecked(True)
+        layout.addWidget(self.post_load_check)
+        self.cluster_check = QCheckBox("Réordonner physiquement les tables selon l'index spatial (CLUSTER)")
+        layout.addWidget(self.cluster_check)
+        index_layout = QHBoxLayout()
+        index_layout.addWidget(QLabel("Index attributaires (colonnes séparées par des virgules) :"))
+        self.index_columns_edit = QLineEdit()
+        index_layout.addWidget(self.index_columns_edit)
+        layout.addLayout(index_layout)
+
+        self.show_table_messages_check = QCheckBox("Afficher un message après chaque table importée")
+        self.show_table_messages_check.setChecked(False)
+        layout.addWidget(self.show_table_messages_check)
+
+        # Boutons d'import et d'annulation
+        import_layout = QHBoxLayout()
+        self.plan_button = QPushButton("Planifier (sans charger)")
+        self.plan_button.clicked.connect(self.show_import_plan)
+        import_layout.addWidget(self.plan_button)
         self.import_button = QPushButton("Importer et allouer les droits")
         self.import_button.clicked.connect(self.import_to_postgis)
-        layout.addWidget(self.import_button)
+        import_layout.addWidget(self.import_button)
+        self.cancel_button = QPushButton("Annuler l'import")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_import)
+        import_layout.addWidget(self.cancel_button)
+        layout.addLayout(import_layout)
+
+        # Débit de chargement et journal
+        self.throughput_label = QLabel("")
+        layout.addWidget(self.throughput_label)
+        layout.addWidget(QLabel("Journal :"))
+        self.log_text = QTextEdit()
+        self.log_text.setReadOnly(True)
+        layout.addWidget(self.log_text)
+
+        # Tableau récapitulatif des imports
+        self.summary_table = QTableWidget(0, 6)
+        self.summary_table.setHorizontalHeaderLabels(["Fichier", "Table", "Lignes", "Lignes/s", "Durée (s)", "Statut"])
+        layout.addWidget(self.summary_table)
 
         self.analysis_tab.setLayout(layout)
 
@@ -317,232 +1484,225 @@ class ImportFromFolderDialog(QDialog):
             writer = csv.writer(f)
             writer.writerow([self.region_combo.currentText(), self.dep_combo.currentText()])
 
-    def import_shapefile(self, file_path, schema, geo_suffix, cursor, conn, is_gpkg_layer=False, layer_name=None):
-        base_name = os.path.splitext(os.path.basename(file_path if not is_gpkg_layer else layer_name))[0].lower()
-        layer = QgsVectorLayer(file_path, base_name, "ogr")
-        if not layer.isValid():
-            QMessageBox.warning(self, "Erreur", f"La couche {base_name} est invalide.")
+    def ask_unique_id_field(self, layer):
+        # Exemples de valeurs lus sur un aperçu borné de la couche
+        dialog = SelectUniqueIdDialog(field_examples(layer), self)
+        if dialog.exec_() == QDialog.Rejected:
             return None
-        try:
-            geom_type_qgis = layer.geometryType()
-            if geom_type_qgis == 0:  # Point
-                type_suffix = "_p"
-            elif geom_type_qgis == 1:  # Line
-                type_suffix = "_l"
-            elif geom_type_qgis == 2:  # Polygon
-                type_suffix = "_s"
-            else:
-                type_suffix = "_t"  # Table sans géométrie
-            fields = layer.fields()
-            column_defs = []
-            original_names = []
-            sql_names = []
-            field_types = []
-            field_examples = []
-
-            # Récupérer des exemples de valeurs pour chaque champ
-            features = list(layer.getFeatures())
-            if features:
-                example_feature = features[min(9, len(features) - 1)]  # Prendre la 10ème ligne si possible
-
-            for field in fields:
-                orig_name = field.name()
-                sql_name = orig_name.lower().replace('-', '_').replace(' ', '_')
-                original_names.append(orig_name)
-                sql_names.append(sql_name)
-                ftype = field.typeName()
-                field_types.append(ftype)
-
-                # Récupérer un exemple de valeur
-                example_value = example_feature[orig_name] if features else "N/A"
-                field_examples.append(str(example_value) if example_value is not None else "NULL")
-
-                # Déterminer le type SQL
-                if ftype in ["Integer", "LongLong", "Integer64"]:
-                    sqltype = "INTEGER"
-                elif ftype in ["Real", "Double"]:
-                    sqltype = "DOUBLE PRECISION"
-                elif ftype == "String":
-                    # Corriger VARCHAR(0) en VARCHAR(255)
-                    sqltype = "VARCHAR(255)"
-                elif ftype == "Date":
-                    sqltype = "DATE"
-                else:
-                    sqltype = "TEXT"
-                column_defs.append(sql.Identifier(sql_name) + sql.SQL(f" {sqltype}"))
-
-            # Demander à l'utilisateur de sélectionner un identifiant unique
-            if is_gpkg_layer:
-                fields_info = [{'name': orig_name, 'type': ftype, 'example': example} for orig_name, ftype, example in zip(original_names, field_types, field_examples)]
-                dialog = SelectUniqueIdDialog(fields_info, self)
-                if dialog.exec_() == QDialog.Rejected:
-                    return None
-                unique_id_field = dialog.get_selected_field()
-                if not unique_id_field:
-                    QMessageBox.warning(self, "Erreur", "Vous devez sélectionner un identifiant unique.")
-                    return None
-            else:
+        unique_id_field = dialog.get_selected_field()
+        if not unique_id_field:
+            QMessageBox.warning(self, "Erreur", "Vous devez sélectionner un identifiant unique.")
+        return unique_id_field
+
+    def build_import_jobs(self, selected_files, incremental=False):
+        """Décompose la sélection en imports unitaires (un par fichier ou par couche de GeoPackage)."""
+        jobs = []
+        for file_path in selected_files:
+            file_name = os.path.basename(file_path)
+            if file_path.lower().endswith('.shp'):
+                shp_layer = QgsVectorLayer(file_path, file_name, "ogr")
                 unique_id_field = "id"  # Par défaut pour les shapefiles
+                if incremental:
+                    # Le mode incrémental rapproche les lignes sur un identifiant choisi par l'utilisateur
+                    unique_id_field = self.ask_unique_id_field(shp_layer)
+                    if not unique_id_field:
+                        continue
+                jobs.append({"file": file_name, "kind": "vector", "source": file_path,
+                             "layer_name": None, "unique_id_field": unique_id_field,
+                             "expected_rows": shp_layer.featureCount()})
+            elif file_path.lower().endswith('.csv'):
+                jobs.append({"file": file_name, "kind": "csv", "source": file_path,
+                             "layer_name": None, "unique_id_field": None,
+                             "expected_rows": estimate_csv_rows(file_path)})
+            elif file_path.lower().endswith('.gpkg'):
+                try:
+                    gpkg_layers = list_geopackage_layers(file_path)
+                except ValueError as e:
+                    QMessageBox.warning(self, "Erreur", str(e))
+                    continue
+                for layer_name, source in gpkg_layers:
+                    gpkg_layer = QgsVectorLayer(source, layer_name, "ogr")
+                    # Demander à l'utilisateur de sélectionner un identifiant unique
+                    unique_id_field = self.ask_unique_id_field(gpkg_layer)
+                    if not unique_id_field:
+                        continue
+                    jobs.append({"file": f"{file_name} / {layer_name}", "kind": "vector", "source": source,
+                                 "layer_name": layer_name, "unique_id_field": unique_id_field,
+                                 "expected_rows": gpkg_layer.featureCount()})
+        for index, job in enumerate(jobs):
+            job["index"] = index
+        return jobs
 
-            if geom_type_qgis in (0, 1, 2):
-                geom_def = sql.SQL(", geom GEOMETRY(GEOMETRY, 2154)")
-            else:
-                geom_def = sql.SQL("")
-            columns_sql = sql.SQL(", ").join(column_defs) + geom_def
-            new_table_name = f"ade_{base_name}{type_suffix}{geo_suffix}"
+    def set_summary_row(self, index, table_name=None, rows=None, rate=None, seconds=None, status=None):
+        values = {1: table_name, 2: rows, 3: None if rate is None else f"{rate:.0f}",
+                  4: None if seconds is None else f"{seconds:.1f}", 5: status}
+        for column, value in values.items():
+            if value is not None:
+                self.summary_table.setItem(index, column, QTableWidgetItem(str(value)))
 
-            # Création de la table
-            cursor.execute(
-                sql.SQL("""
-                CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
-                    id SERIAL PRIMARY KEY,
-                    {columns}
-                );
-                """).format(
-                    schema=sql.Identifier(schema),
-                    table_name=sql.Identifier(new_table_name),
-                    columns=columns_sql
-                )
-            )
+    def drain_import_events(self, events):
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                return
+            if event[0] == "progress":
+                _, index, table_name, rows, rate = event
+                self.set_summary_row(index, table_name=table_name, rows=rows, rate=rate, status="En cours")
+            elif event[0] == "log":
+                self.log_text.append(event[1])
+            elif event[0] == "result":
+                self.handle_import_result(event[1])
 
-            # Insertion des données
-            for feature in layer.getFeatures():
-                values = []
-                for i, orig_name in enumerate(original_names):
-                    value = feature[orig_name]
-                    if value is None or (isinstance(value, QVariant) and value.isNull()):
-                        values.append(None)
-                        continue
-                    ftype = field_types[i]
-                    if ftype == "String":
-                        values.append(str(value))
-                    elif ftype in ["Integer", "LongLong", "Integer64"]:
-                        try:
-                            values.append(int(value))
-                        except ValueError:
-                            values.append(None)
-                    elif ftype in ["Real", "Double"]:
-                        try:
-                            values.append(float(value))
-                        except ValueError:
-                            values.append(None)
-                    elif ftype == "Date":
-                        values.append(str(value))
-                    else:
-                        values.append(str(value))
-
-                if geom_type_qgis in (0, 1, 2):
-                    geom_wkt = feature.geometry().asWkt() if feature.geometry() else None
-                    placeholders = sql.SQL(", ").join(sql.Placeholder() * len(values))
-                    cursor.execute(
-                        sql.SQL("""
-                        INSERT INTO {schema}.{table_name} ({cols}, geom)
-                        VALUES ({placeholders}, ST_GeomFromText(%s, 2154));
-                        """).format(
-                            schema=sql.Identifier(schema),
-                            table_name=sql.Identifier(new_table_name),
-                            cols=sql.SQL(", ").join([sql.Identifier(c) for c in sql_names]),
-                            placeholders=placeholders
-                        ),
-                        values + [geom_wkt]
-                    )
-                else:
-                    placeholders = sql.SQL(", ").join(sql.Placeholder() * len(values))
-                    cursor.execute(
-                        sql.SQL("""
-                        INSERT INTO {schema}.{table_name} ({cols})
-                        VALUES ({placeholders});
-                        """).format(
-                            schema=sql.Identifier(schema),
-                            table_name=sql.Identifier(new_table_name),
-                            cols=sql.SQL(", ").join([sql.Identifier(c) for c in sql_names]),
-                            placeholders=placeholders
-                        ),
-                        values
-                    )
+    def handle_import_result(self, result):
+        self.import_results.append(result)
+        index = result["job"]["index"]
+        rate = result["rows"] / result["seconds"] if result["seconds"] > 0 else 0.0
+        self.set_summary_row(index, table_name=result["table"], rows=result["rows"], rate=rate,
+                             seconds=result["seconds"], status=result["status"])
+        if result["status"] == "OK":
+            QgsMessageLog.logMessage(f"Table {result['table']} importée ({result['rows']} lignes).", "GBDD", Qgis.Info)
+            if result["message"]:
+                QgsMessageLog.logMessage(result["message"], "GBDD", Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(f"{result['job']['file']} : {result['message']}", "GBDD", Qgis.Critical)
+        if result["message"]:
+            self.log_text.append(f"{result['job']['file']} : {result['message']}")
+        if self.show_table_messages_check.isChecked():
+            # Mis en file : affichés par show_pending_table_messages, hors du traitement des événements
+            if result["status"] == "OK":
+                self.pending_table_messages.append(
+                    (QMessageBox.information, "Succès", f"Table {result['table']} importée avec succès."))
+                if result["message"]:
+                    self.pending_table_messages.append((QMessageBox.warning, "Erreur", result["message"]))
+            elif result["status"] != "Annulé":
+                self.pending_table_messages.append((QMessageBox.critical, "Erreur", result["message"]))
+
+    def show_pending_table_messages(self):
+        """Affiche les messages par table un à un, timer suspendu : ni boîtes empilées ni réentrance du rafraîchissement."""
+        if self.showing_table_messages or not self.pending_table_messages:
+            return
+        timer_active = self.import_timer.isActive()
+        self.import_timer.stop()
+        self.showing_table_messages = True
+        try:
+            while self.pending_table_messages:
+                show, title, text = self.pending_table_messages.pop(0)
+                show(self, title, text)
+        finally:
+            self.showing_table_messages = False
+            if timer_active and self.import_task is not None:
+                self.import_timer.start(200)
 
-            QMessageBox.information(self, "Succès", f"Table {new_table_name} importée avec succès.")
-            return new_table_name
+    def refresh_import_status(self):
+        self.drain_import_events(self.import_events)
+        self.show_pending_table_messages()
+        total_rows = sum(r["rows"] for r in self.import_results)
+        elapsed = time.perf_counter() - self.import_start
+        self.throughput_label.setText(
+            f"{len(self.import_results)}/{len(self.import_jobs)} imports terminés, {total_rows} lignes "
+            f"({total_rows / elapsed if elapsed > 0 else 0:.0f} lignes/s)"
+        )
+
+    def drop_failed_planned_tables(self):
+        """Retire les tables créées par le plan dont l'import n'est pas arrivé à « OK » (échec, annulation)."""
+        loaded = {r["table"] for r in self.import_results if r["status"] == "OK"}
+        failed = sorted({plan["table"] for plan in self.import_plans
+                         if plan["status"] == "Nouvelle" and plan["table"] not in loaded})
+        if not failed:
+            return
+        conn = self.import_pool.getconn()
+        try:
+            drop_planned_tables(conn, self.import_settings["schema"], failed)
+            self.log_text.append(f"Tables créées puis non chargées, supprimées : {', '.join(failed)}")
         except Exception as e:
-            conn.rollback()
-            QMessageBox.critical(
-                self,
-                "Erreur",
-                f"Erreur lors de l'import de {base_name} : {str(e)}\n\n"
-                f"Types de champs détectés : {field_types}\n"
-                f"Noms de champs détectés : {original_names}"
+            self.log_text.append(f"Suppression des tables non chargées impossible ({', '.join(failed)}) : {e}")
+        finally:
+            self.import_pool.putconn(conn)
+
+    def cancel_import(self):
+        if self.import_task is not None:
+            self.import_task.cancel()
+
+    def plan_import_jobs(self, jobs, settings):
+        """Plan de chargement des imports, sans lecture des données. Renvoie la liste des plans."""
+        plans = []
+        for job in jobs:
+            try:
+                if job["kind"] == "csv":
+                    plan = plan_csv_file(job["source"], settings["geo_suffix"])
+                else:
+                    plan = plan_vector_layer(job["source"], settings["geo_suffix"], job["layer_name"])
+            except Exception as e:
+                plan = {"table": None, "columns": [], "rows": 0, "bytes": 0}
+                plan["status"], plan["conflict"] = "Conflit", f"lecture des métadonnées impossible : {e}"
+            plan["job"] = job
+            job["plan"] = plan
+            plans.append(plan)
+        return plans
+
+    def log_import_plan(self, plans, incremental):
+        self.summary_table.setRowCount(len(plans))
+        for plan in plans:
+            index = plan["job"]["index"]
+            self.summary_table.setItem(index, 0, QTableWidgetItem(plan["job"]["file"]))
+            status = plan["status"]
+            if status == "Existante" and not incremental:
+                status = "Existante (ajout)"
+            self.set_summary_row(index, table_name=plan["table"] or "", rows=plan["rows"], status=status)
+            columns = ", ".join(f"{name} {sqltype}" for name, sqltype in plan["columns"])
+            self.log_text.append(
+                f"{plan['job']['file']} → {plan['table']} : {plan['rows']} lignes, "
+                f"~{format_bytes(plan['bytes'])} ({columns})"
+                + (f" — Conflit : {plan['conflict']}" if plan["conflict"] else "")
             )
-            return None
+        total_bytes = sum(plan["bytes"] for plan in plans)
+        self.log_text.append(
+            f"Plan : {len(plans)} tables, {sum(plan['rows'] for plan in plans)} lignes, ~{format_bytes(total_bytes)}, "
+            f"{sum(1 for plan in plans if plan['status'] == 'Nouvelle')} à créer, "
+            f"{sum(1 for plan in plans if plan['status'] == 'Conflit')} en conflit."
+        )
 
-    def import_geopackage(self, file_path, schema, geo_suffix, cursor, conn):
-        all_layers = QgsVectorLayer(file_path, "temp", "ogr")
-        if all_layers.isValid():
-            sublayers = all_layers.dataProvider().subLayers()
-            for sublayer in sublayers:
-                layer_name = sublayer.split('!!::!!')[1] if '!!::!!' in sublayer else sublayer
-                gpkg_layer = QgsVectorLayer(f"{file_path}|layername={layer_name}", layer_name, "ogr")
-                if gpkg_layer.isValid():
-                    self.import_shapefile(gpkg_layer.source(), schema, geo_suffix, cursor, conn, is_gpkg_layer=True, layer_name=layer_name)
-        else:
-            QMessageBox.warning(self, "Erreur", f"Impossible de lire les couches du GeoPackage.")
+    def check_import_plan_against_base(self, plans, settings, login, password):
+        """Confronte le plan au catalogue de la base (une seule requête). Renvoie la liste des conflits."""
+        conn = psycopg2.connect(user=login, password=password, **GBDD_CONNECTION)
+        try:
+            with conn.cursor() as cursor:
+                existing = find_existing_tables(cursor, settings["schema"], [p["table"] for p in plans if p["table"]])
+            conn.rollback()
+        finally:
+            conn.close()
+        readable = [plan for plan in plans if plan["table"]]
+        return check_import_plan(readable, existing) + [plan for plan in plans if not plan["table"]]
 
-    def import_csv(self, file_path, schema, geo_suffix, cursor, conn):
-        base_name = os.path.splitext(os.path.basename(file_path))[0].lower()
-        type_suffix = "_t"
-        new_table_name = f"ade_{base_name}{type_suffix}{geo_suffix}"
+    def show_import_plan(self):
+        prepared = self.prepare_import()
+        if prepared is None:
+            return
+        settings, jobs, login, password = prepared
+        plans = self.plan_import_jobs(jobs, settings)
         try:
-            with open(file_path, 'r', newline='', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                header = next(reader)
-                header_lower = [h.lower().replace('-', '_').replace(' ', '_') for h in header]
-                column_defs = [sql.Identifier(h) + sql.SQL(" VARCHAR(255)") for h in header_lower]
-                columns_sql = sql.SQL(", ").join(column_defs)
-                cursor.execute(
-                    sql.SQL("""
-                    CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
-                        id SERIAL PRIMARY KEY,
-                        {columns}
-                    );
-                    """).format(
-                        schema=sql.Identifier(schema),
-                        table_name=sql.Identifier(new_table_name),
-                        columns=columns_sql
-                    )
-                )
-                for row in reader:
-                    cursor.execute(
-                        sql.SQL("""
-                        INSERT INTO {schema}.{table_name} ({cols})
-                        VALUES ({placeholders});
-                        """).format(
-                            schema=sql.Identifier(schema),
-                            table_name=sql.Identifier(new_table_name),
-                            cols=sql.SQL(", ").join([sql.Identifier(c) for c in header_lower]),
-                            placeholders=sql.SQL(", ").join(sql.Placeholder() * len(header_lower))
-                        ),
-                        row
-                    )
-            QMessageBox.information(self, "Succès", f"Table {new_table_name} importée avec succès.")
-            return new_table_name
+            self.check_import_plan_against_base(plans, settings, login, password)
         except Exception as e:
-            conn.rollback()
-            QMessageBox.critical(self, "Erreur", f"Erreur lors de l'import de {new_table_name} : {e}")
-            return None
+            QMessageBox.critical(self, "Erreur de connexion", f"Impossible de se connecter à la base : {e}")
+            return
+        self.log_import_plan(plans, settings["incremental"])
 
-    def import_to_postgis(self):
+    def prepare_import(self):
+        """Contrôle la saisie et décompose la sélection. Renvoie (paramètres, imports, login, mot de passe) ou None."""
         selected_files = self.get_checked_files()
         if not selected_files:
             QMessageBox.warning(self, "Erreur", "Veuillez sélectionner au moins un fichier à importer.")
-            return
+            return None
         login = self.login_edit.text()
         password = self.password_edit.text()
         if not login or not password:
             QMessageBox.warning(self, "Erreur", "Login et mot de passe sont requis.")
-            return
+            return None
         schema = self.schema_edit.text()
         if not schema:
             QMessageBox.warning(self, "Erreur", "Le schéma est requis.")
-            return
+            return None
         suffixes = []
         if self.national_check.isChecked():
             suffixes.append("_000")
@@ -560,83 +1720,120 @@ class ImportFromFolderDialog(QDialog):
                 suffixes.append(f"_{code}")
         if len(suffixes) != 1:
             QMessageBox.warning(self, "Erreur", "Veuillez cocher exactement un niveau géographique.")
+            return None
+        settings = {
+            "schema": schema,
+            "geo_suffix": suffixes[0],
+            "metadata": self.metadata_edit.toPlainText(),
+            "chunk_size": self.chunk_size_spin.value(),
+            "owner_rights": self.owner_rights_edit.text(),
+            "admin_rights": self.admin_rights_edit.text(),
+            "read_rights": self.read_rights_edit.text(),
+            "incremental": self.import_mode_combo.currentIndex() == 1,
+            "copy_format": self.copy_format_combo.currentData(),
+            "post_load": self.post_load_check.isChecked(),
+            "cluster": self.cluster_check.isChecked(),
+            "index_columns": [sql_column_name(c.strip()) for c in self.index_columns_edit.text().split(",") if c.strip()],
+        }
+
+        jobs = self.build_import_jobs(selected_files, settings["incremental"])
+        if not jobs:
+            return None
+        return settings, jobs, login, password
+
+    def import_to_postgis(self):
+        prepared = self.prepare_import()
+        if prepared is None:
             return
-        geo_suffix = suffixes[0]
-        metadata = self.metadata_edit.toPlainText()
+        settings, jobs, login, password = prepared
 
+        # Plan de chargement : conflits détectés avant toute écriture
+        plans = self.plan_import_jobs(jobs, settings)
         try:
-            conn = psycopg2.connect(
-                dbname="gb_ddt21",
-                user=login,
-                password=password,
-                host="10.21.8.40",
-                port="5432"
+            conflicts = self.check_import_plan_against_base(plans, settings, login, password)
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur de connexion", f"Impossible de se connecter à la base : {e}")
+            return
+        self.log_import_plan(plans, settings["incremental"])
+        if conflicts:
+            QMessageBox.critical(
+                self, "Conflits",
+                "Import interrompu, aucune table n'a été créée :\n"
+                + "\n".join(f"{plan['job']['file']} : {plan['conflict']}" for plan in conflicts)
+            )
+            return
+        appended = [plan["table"] for plan in plans if plan["status"] == "Existante"]
+        if appended and not settings["incremental"]:
+            reply = QMessageBox.question(
+                self, "Tables existantes",
+                "Les tables suivantes existent déjà, les lignes y seront ajoutées :\n" + "\n".join(appended)
+                + "\n\nContinuer ?",
+                QMessageBox.Yes | QMessageBox.No
             )
-            cursor = conn.cursor()
+            if reply != QMessageBox.Yes:
+                return
+
+        workers = min(self.workers_spin.value(), len(jobs))
+        try:
+            db_pool = BlockingConnectionPool(workers, user=login, password=password, **GBDD_CONNECTION)
         except Exception as e:
             QMessageBox.critical(self, "Erreur de connexion", f"Impossible de se connecter à la base : {e}")
             return
 
-        for file_path in selected_files:
-            if file_path.lower().endswith('.shp'):
-                table_name = self.import_shapefile(file_path, schema, geo_suffix, cursor, conn)
-            elif file_path.lower().endswith('.csv'):
-                table_name = self.import_csv(file_path, schema, geo_suffix, cursor, conn)
-            elif file_path.lower().endswith('.gpkg'):
-                table_name = self.import_geopackage(file_path, schema, geo_suffix, cursor, conn)
+        # Création groupée des nouvelles tables et de leurs droits, en une transaction
+        conn = db_pool.getconn()
+        try:
+            created = create_planned_tables(conn, settings["schema"], plans, settings["owner_rights"],
+                                            settings["admin_rights"], settings["read_rights"])
+        except Exception as e:
+            db_pool.putconn(conn)
+            db_pool.closeall()
+            QMessageBox.critical(self, "Erreur", f"Création des tables impossible, aucune table n'a été créée : {e}")
+            return
+        db_pool.putconn(conn)
+        self.log_text.append(f"{created} tables créées en une transaction.")
+        self.import_plans = plans
+        self.import_settings = settings
 
-            if table_name:
-                # Allocation des droits
-                owner_rights = self.owner_rights_edit.text()
-                admin_rights = self.admin_rights_edit.text()
-                read_rights = self.read_rights_edit.text()
+        self.summary_table.setRowCount(len(jobs))
+        for job in jobs:
+            self.summary_table.setItem(job["index"], 0, QTableWidgetItem(job["file"]))
+            self.set_summary_row(job["index"], status="En attente")
+        self.import_jobs = jobs
+        self.import_results = []
+        self.pending_table_messages = []
+        self.showing_table_messages = False
+        self.import_events = queue.Queue()
+        self.import_pool = db_pool
+        self.import_workers = workers
+        self.import_start = time.perf_counter()
 
-                try:
-                    cursor.execute(
-                        sql.SQL("ALTER TABLE {schema}.{table} OWNER TO {owner};").format(
-                            schema=sql.Identifier(schema),
-                            table=sql.Identifier(table_name),
-                            owner=sql.Identifier(owner_rights)
-                        )
-                    )
-                    cursor.execute(
-                        sql.SQL("GRANT SELECT, UPDATE, INSERT, DELETE, REFERENCES ON TABLE {schema}.{table} TO {owner};").format(
-                            schema=sql.Identifier(schema),
-                            table=sql.Identifier(table_name),
-                            owner=sql.Identifier(owner_rights)
-                        )
-                    )
-                    cursor.execute(
-                        sql.SQL("GRANT ALL ON TABLE {schema}.{table} TO {admin};").format(
-                            schema=sql.Identifier(schema),
-                            table=sql.Identifier(table_name),
-                            admin=sql.Identifier(admin_rights)
-                        )
-                    )
-                    cursor.execute(
-                        sql.SQL("GRANT SELECT ON TABLE {schema}.{table} TO {read};").format(
-                            schema=sql.Identifier(schema),
-                            table=sql.Identifier(table_name),
-                            read=sql.Identifier(read_rights)
-                        )
-                    )
-                except Exception as e:
-                    QMessageBox.warning(self, "Erreur", f"Erreur lors de l'allocation des droits pour {table_name} : {e}")
-
-                # Sauvegarde de la métadonnée
-                if metadata:
-                    try:
-                        cursor.execute(
-                            sql.SQL("""
-                            INSERT INTO {schema}.metadata_import (table_name, metadata, import_date)
-                            VALUES (%s, %s, NOW());
-                            """).format(schema=sql.Identifier(schema)),
-                            (table_name, metadata)
-                        )
-                    except Exception as e:
-                        QMessageBox.warning(self, "Erreur", f"Erreur lors de la sauvegarde de la métadonnée : {e}")
+        # Import en arrière-plan : une sous-tâche QGIS par fichier, chacune dans sa transaction
+        self.import_task = GBDDImportTask(jobs, db_pool, settings, self.import_events, workers)
+        self.import_task.taskCompleted.connect(self.on_import_finished)
+        self.import_task.taskTerminated.connect(self.on_import_finished)
+        self.import_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.import_timer = QTimer(self)
+        self.import_timer.timeout.connect(self.refresh_import_status)
+        self.import_timer.start(200)
+        QgsApplication.taskManager().addTask(self.import_task)
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def on_import_finished(self):
+        self.import_timer.stop()
+        self.refresh_import_status()
+        self.drop_failed_planned_tables()
+        self.import_pool.closeall()
+        self.import_task = None
+        self.import_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+        total_rows = sum(r["rows"] for r in self.import_results)
+        nb_ok = sum(1 for r in self.import_results if r["status"] == "OK")
+        message = (
+            f"Import terminé : {nb_ok}/{len(self.import_jobs)} tables importées, {total_rows} lignes "
+            f"en {time.perf_counter() - self.import_start:.1f} s avec {self.import_workers} connexion(s)."
+        )
+        self.log_text.append(message)
+        QgsMessageLog.logMessage(message, "GBDD", Qgis.Info)
         self.save_last_choices()
@@ -1,27 +1,856 @@
 #TELECHARGEMENTS_Import_Naïades_Pesticides_Etats_Eco2.py
 
 import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from pathlib import Path
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 
 from qgis.PyQt.QtCore import QVariant, QDate, Qt, QSizeF
 from qgis.PyQt.QtGui import QColor, QFont
 from qgis.PyQt.QtWidgets import (
-    QDialog, QVBoxLayout, QHBoxLayout, QTabWidget, QWidget, QTextEdit, QLabel, QPushButton,
-    QLineEdit, QDateEdit, QComboBox, QListWidget, QRadioButton, QGroupBox, QFileDialog, QMessageBox, QProgressBar, QCheckBox
+    QApplication, QDialog, QVBoxLayout, QHBoxLayout, QTabWidget, QWidget, QTextEdit, QLabel, QPushButton,
+    QLineEdit, QDateEdit, QComboBox, QListWidget, QRadioButton, QGroupBox, QFileDialog, QMessageBox, QProgressBar, QCheckBox,
+    QSpinBox
 )
 from qgis.core import (
-    QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsField,
+    QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsPoint, QgsField, QgsFields, QgsWkbTypes,
     QgsVectorFileWriter, QgsCoordinateReferenceSystem, QgsPalLayerSettings,
     QgsTextFormat, QgsDiagramRenderer, QgsPieDiagram, QgsHistogramDiagram,
     QgsLinearlyInterpolatedDiagramRenderer, QgsDiagramLayerSettings, QgsDiagramSettings,
     QgsExpression, QgsVectorLayerSimpleLabeling, QgsMarkerSymbol, QgsCategorizedSymbolRenderer, QgsRendererCategory
 )
 from qgis.gui import QgsMapCanvas
+from osgeo import ogr, osr
+
+from ..memoire_BAO_ADL import peak_rss_mb
+
+# Module de rendu importé sous son nom de premier niveau : les processus de rendu le rechargent ainsi
+# sans passer par le paquet du plugin (et donc sans QGIS)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+from TELECHARGEMENTS_Naiades_rendu_graphiques import NAIADES_GRAPH_TYPES, NAIADES_RENDU_VERSION, iter_naiades_renders
+
+# Cache colonnaire des CSV Naïades, rangé dans un sous-dossier du dossier des CSV
+NAIADES_CACHE_DIR = "cache_naiades"
+# Colonnes d'Analyses.csv utilisées par les traitements et les graphiques
+NAIADES_ANALYSES_COLUMNS = [
+    'CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'DateAna', 'CdParametre',
+    'LbLongParamètre', 'RsAna', 'LqAna'
+]
+# Version du format de cache : à incrémenter si la conversion des colonnes change
+NAIADES_CACHE_VERSION = 1
+# Libellés très répétés, stockés en catégories dans le cache
+NAIADES_CATEGORY_COLUMNS = [
+    'LbStationMesureEauxSurface', 'LbLongParamètre', 'LbCommune', 'LbDepartement', 'LbRegion',
+    'NomMasseDEau', 'NomCoursdEau', 'LibelleProjection', 'NomSsBassinDCEAdmin', 'NomEuBassinDCE'
+]
+try:
+    import pyarrow  # noqa: F401
+    NAIADES_CACHE_FORMAT = "parquet"
+except ImportError:
+    # Sans pyarrow, le cache reste disponible au format pickle de pandas
+    NAIADES_CACHE_FORMAT = "pickle"
+
+
+def file_content_hash(path, block_size=1 << 20):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_naiades_csv(path):
+    """Lecture brute d'un CSV Naïades, typée comme l'ont toujours été les traitements."""
+    return pd.read_csv(path, sep=';', encoding='utf8', low_memory=False)
+
+
+def naiades_cache_paths(folder, file_name):
+    base = os.path.join(folder, NAIADES_CACHE_DIR, os.path.splitext(file_name)[0])
+    return base + (".parquet" if NAIADES_CACHE_FORMAT == "parquet" else ".pkl"), base + ".json"
+
+
+def naiades_cache_is_valid(folder, file_name):
+    """Indique si le cache d'un CSV est à jour (taille, date de modification, puis empreinte MD5)."""
+    csv_path = os.path.join(folder, file_name)
+    data_path, meta_path = naiades_cache_paths(folder, file_name)
+    stat = os.stat(csv_path)
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(data_path):
+        try:
+            with open(meta_path, 'r', encoding='utf8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+    valid = (
+        meta is not None
+        and meta.get("version") == NAIADES_CACHE_VERSION
+        and meta.get("format") == NAIADES_CACHE_FORMAT
+        and meta.get("size") == stat.st_size
+    )
+    if valid and meta.get("mtime_ns") != stat.st_mtime_ns:
+        valid = meta.get("hash") == file_content_hash(csv_path)
+        if valid:
+            meta["mtime_ns"] = stat.st_mtime_ns
+            with open(meta_path, 'w', encoding='utf8') as f:
+                json.dump(meta, f)
+    return valid
+
+
+def restore_category_columns(df):
+    # Les traitements regroupent sur ces libellés : on revient à des chaînes pour garder leurs résultats
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def load_naiades_csv(folder, file_name, columns=None, log=None):
+    """Lit Stations.csv ou Analyses.csv via le cache colonnaire, reconstruit seulement si le CSV a changé.
+
+    Le cache est repéré par la taille, la date de modification et l'empreinte MD5 du CSV : l'empreinte
+    n'est recalculée que si la date a changé, pour qu'un fichier simplement recopié ne relance pas la conversion.
+    """
+    csv_path = os.path.join(folder, file_name)
+    cache_dir = os.path.join(folder, NAIADES_CACHE_DIR)
+    data_path, meta_path = naiades_cache_paths(folder, file_name)
+    stat = os.stat(csv_path)
+
+    if naiades_cache_is_valid(folder, file_name):
+        if NAIADES_CACHE_FORMAT == "parquet":
+            df = pd.read_parquet(data_path, columns=columns)
+        else:
+            df = pd.read_pickle(data_path)
+            if columns is not None:
+                df = df[columns]
+        if log:
+            log(f"{file_name} lu depuis le cache ({NAIADES_CACHE_FORMAT}).")
+    else:
+        df = read_naiades_csv(csv_path)
+        for col in NAIADES_CATEGORY_COLUMNS:
+            if col in df.columns and df[col].dtype == object:
+                df[col] = df[col].astype('category')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = data_path + ".tmp"
+            if NAIADES_CACHE_FORMAT == "parquet":
+                df.to_parquet(tmp_path, index=False)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, data_path)
+            with open(meta_path, 'w', encoding='utf8') as f:
+                json.dump({
+                    "version": NAIADES_CACHE_VERSION, "format": NAIADES_CACHE_FORMAT, "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns, "hash": file_content_hash(csv_path)
+                }, f)
+            if log:
+                log(f"{file_name} converti en cache {NAIADES_CACHE_FORMAT}.")
+        except Exception as e:
+            # Un cache impossible à écrire (droits, colonne mal typée) ne doit pas bloquer le traitement
+            if log:
+                log(f"Cache non écrit pour {file_name} : {e}")
+        if columns is not None:
+            df = df[columns]
+
+    return restore_category_columns(df)
+
+
+def iter_naiades_chunks(folder, file_name, columns, chunksize, log=None):
+    """Parcourt un CSV Naïades par blocs de `chunksize` lignes, depuis le cache Parquet s'il est à jour."""
+    if NAIADES_CACHE_FORMAT == "parquet" and naiades_cache_is_valid(folder, file_name):
+        import pyarrow.parquet as pq
+        if log:
+            log(f"{file_name} parcouru par blocs depuis le cache (parquet).")
+        for batch in pq.ParquetFile(naiades_cache_paths(folder, file_name)[0]).iter_batches(
+                batch_size=chunksize, columns=columns):
+            yield restore_category_columns(batch.to_pandas())
+        return
+    if log:
+        log(f"{file_name} parcouru par blocs de {chunksize} lignes.")
+    # DateAna forcée en texte : un bloc sans date serait sinon lu en flottants
+    yield from pd.read_csv(os.path.join(folder, file_name), sep=';', encoding='utf8', usecols=columns,
+                           dtype={'DateAna': str}, chunksize=chunksize)
+
+
+# Taille par défaut des blocs lus en mode flux
+DEFAULT_NAIADES_CHUNK_SIZE = 500000
+# Clés d'identification d'une paire station-substance
+NAIADES_ID_COLUMNS = ['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre']
+# Clés des accumulateurs : station-substance, normes, limite de quantification et année
+NAIADES_GROUP_KEYS = NAIADES_ID_COLUMNS + ['NQE-MA', 'NQE-CMA', 'LqAna', 'Annee']
+# Accumulateurs additifs : lignes, mesures renseignées, dépassements bruts NQE-MA, somme des valeurs
+# (LQ/2 sous la LQ) et dépassements NQE-CMA sur ces valeurs
+NAIADES_METRICS = ['n_lignes', 'n_mesures', 'n_sup_MA', 'somme_valeurs', 'n_sup_CMA']
+
+
+def naiades_substances_frame(subst):
+    return pd.DataFrame.from_dict(subst, orient='index', columns=['LbLongParamètre', 'NQE-MA', 'NQE-CMA', 'Type_polluants'])
+
+
+def naiades_accumulators(df_analyses, df_subst):
+    """Accumulateurs additifs par (station, substance, normes, LQ, année) d'un bloc d'analyses.
+
+    Les accumulateurs de plusieurs blocs s'additionnent : c'est ce qui permet le traitement en flux.
+    """
+    df = df_analyses.loc[:, NAIADES_ANALYSES_COLUMNS]
+    df = pd.merge(df, df_subst[['NQE-MA', 'NQE-CMA']], left_on=['CdParametre'], right_index=True, how='left')
+    df['Annee'] = df['DateAna'].str[:4]
+    rs_ana = df['RsAna']
+    # Valeurs sous la limite de quantification remplacées par LQ/2 pour les moyennes
+    valeurs = rs_ana.mask(rs_ana.notnull() & (rs_ana < df['LqAna']), df['LqAna'] / 2)
+    work = df[NAIADES_GROUP_KEYS].assign(
+        n_lignes=1,
+        n_mesures=rs_ana.notnull().astype('int64'),
+        n_sup_MA=(rs_ana > df['NQE-MA']).astype('int64'),
+        somme_valeurs=valeurs,
+        n_sup_CMA=(valeurs > df['NQE-CMA']).astype('int64'),
+    )
+    return work.groupby(NAIADES_GROUP_KEYS, dropna=False, sort=False)[NAIADES_METRICS].sum().reset_index()
+
+
+def merge_naiades_accumulators(partials):
+    return pd.concat(partials, ignore_index=True).groupby(
+        NAIADES_GROUP_KEYS, dropna=False, sort=False)[NAIADES_METRICS].sum().reset_index()
+
+
+def naiades_lq_table(acc):
+    """Part des mesures de chaque substance dont la LQ dépasse la NQE-MA."""
+    lq_table = acc.dropna(subset=['CdParametre', 'LbLongParamètre']).assign(
+        nbNQMAsupLQ=lambda d: d['n_lignes'].where(d['NQE-MA'] < d['LqAna'], 0)
+    ).groupby(['CdParametre', 'LbLongParamètre'])[['n_mesures', 'nbNQMAsupLQ']].sum()
+    lq_table = lq_table.rename(columns={'n_mesures': 'nb_mesures'}).reset_index()
+    lq_table['pourcentage'] = (100 * lq_table['nbNQMAsupLQ'] / lq_table['nb_mesures']).round(2)
+    return lq_table.sort_values(by=['pourcentage'], ascending=False)
+
+
+def naiades_depassements_table(acc):
+    """Met en forme les accumulateurs en table depassements_NQE_MA_CMA. Renvoie (table, liste des années).
+
+    Reproduit les colonnes du traitement historique : nombre de mesures et dépassements NQE-MA par année,
+    moyennes annuelles par LQ (nulles sous 4 mesures) et non-respects NQE-MA, dépassements NQE-CMA.
+    """
+    liste_id = NAIADES_ID_COLUMNS
+    acc = acc.dropna(subset=liste_id + ['Annee'])
+
+    # Nombre de mesures et dépassements NQE-MA par station, substance et année
+    base_keys = liste_id + ['NQE-MA', 'NQE-CMA']
+    counts = acc.dropna(subset=base_keys).groupby(base_keys + ['Annee'])[['n_mesures', 'n_sup_MA']].sum()
+    counts = counts.unstack('Annee', fill_value=0)
+    annees_mesures = list(counts['n_mesures'].columns)
+    final = counts.index.to_frame(index=False)
+    final.columns = liste_id + ['NQE-MA_x', 'NQE-CMA_x']
+    for year in annees_mesures:
+        final['nb_M_' + year] = counts[('n_mesures', year)].to_numpy()
+    has_sup_ma = (counts['n_sup_MA'] > 0).any(axis=1).to_numpy()
+    final['NQE-MA_y'] = final['NQE-MA_x'].where(has_sup_ma)
+    final['NQE-CMA_y'] = final['NQE-CMA_x'].where(has_sup_ma)
+    for year in annees_mesures:
+        final['supMA_' + year] = counts[('n_sup_MA', year)].to_numpy()
+
+    # Moyennes annuelles par limite de quantification
+    lq_keys = liste_id + ['NQE-MA', 'LqAna']
+    means = acc.dropna(subset=lq_keys).groupby(lq_keys + ['Annee'])[['n_lignes', 'n_mesures', 'somme_valeurs']].sum()
+    means = means.unstack('Annee', fill_value=0)
+    liste_annees = list(means['n_lignes'].columns)
+    table_2 = means.index.to_frame(index=False)
+    for year in liste_annees:
+        table_2['nb_' + year] = means[('n_lignes', year)].to_numpy()
+    for year in liste_annees:
+        n_mesures = means[('n_mesures', year)].to_numpy()
+        moyenne = np.divide(means[('somme_valeurs', year)].to_numpy(), n_mesures,
+                            out=np.zeros(len(n_mesures)), where=n_mesures > 0)
+        # Suppression des moyennes avec moins de 4 mesures
+        table_2['moy_' + year] = np.where(table_2['nb_' + year] < 4, 0, moyenne)
+
+    # Identification des non-respects NQE-MA
+    for year in liste_annees:
+        col = 'moy_' + year
+        conditions_non_respect = [
+            (table_2['LqAna'] > table_2['NQE-MA']) & (table_2[col] > table_2['LqAna']),
+            (table_2['LqAna'] > table_2['NQE-MA']) & (table_2[col] <= table_2['LqAna']),
+            (table_2['LqAna'] <= table_2['NQE-MA']) & (table_2[col] > table_2['NQE-MA'])
+        ]
+        table_2[year + '_MA'] = np.select(conditions_non_respect, [1, np.nan, 1], default=np.nan)
+    nb_depassements_NQE_MA = table_2.dropna(subset=[year + '_MA' for year in liste_annees], how='all')
+
+    # Dépassements NQE-CMA
+    cma = acc.groupby(liste_id + ['Annee'])['n_sup_CMA'].sum().unstack('Annee', fill_value=0)
+    cma.columns = [year + '_CMA' for year in cma.columns]
+
+    final = pd.merge(final, nb_depassements_NQE_MA, on=liste_id, how='left')
+    final = pd.merge(final, cma.reset_index(), on=liste_id, how='left')
+    return final.fillna(0).replace(0, np.nan), liste_annees
+
+
+# Colonnes des tranches station-substance exportées en CSV à côté des graphiques
+NAIADES_GRAPH_COLUMNS = NAIADES_ID_COLUMNS + ['Annee', 'DateAna', 'RsAna', 'NQE-MA', 'NQE-CMA']
+
+
+def naiades_graph_index(df_analyses_LQ, dico_dataframe, liste_annees, log=None):
+    """Partitionne une seule fois les analyses par (département, station, substance, année).
+
+    Seules les paires présentes dans les tables annuelles sont retenues. Chaque entrée porte la tranche
+    à exporter et les séries prêtes à tracer, dont les dépassements NQE-MA et NQE-CMA mois par mois.
+    """
+    # Paires station-substance de chaque département, toutes années confondues
+    combos = pd.concat([df_year[['CodeDepartement'] + NAIADES_ID_COLUMNS] for df_year, _ in dico_dataframe.values()],
+                       ignore_index=True)
+    combos = combos.dropna(subset=['CodeDepartement']).drop_duplicates()
+    data = pd.merge(df_analyses_LQ[NAIADES_GRAPH_COLUMNS].drop_duplicates(), combos, on=NAIADES_ID_COLUMNS, how='inner')
+    data['Month'] = pd.to_datetime(data['DateAna'], errors='coerce').dt.month
+
+    index = []
+    keys = ['CodeDepartement', 'CdStationMesureEauxSurface', 'CdParametre']
+    for (dpt, sta, prod), dp in data.groupby(keys, sort=False):
+        entry = {
+            'dpt': dpt, 'sta': sta, 'prod': prod,
+            'nom_sta': dp['LbStationMesureEauxSurface'].iloc[0], 'nom_pro': dp['LbLongParamètre'].iloc[0],
+            'slice': dp[NAIADES_GRAPH_COLUMNS], 'years': [], 'dates': [], 'values': [], 'ma': [], 'cma': [],
+        }
+        annees = dp['Annee'].to_numpy()
+        mois = dp['Month'].to_numpy(dtype=float)
+        rs_ana = dp['RsAna'].to_numpy(dtype=float)
+        sup_ma = rs_ana > dp['NQE-MA'].to_numpy(dtype=float)
+        sup_cma = rs_ana > dp['NQE-CMA'].to_numpy(dtype=float)
+        retenues = np.zeros(len(dp), dtype=bool)
+        for y in liste_annees:
+            sel = annees == y
+            if not sel.any():
+                continue
+            if np.isnan(rs_ana[sel]).all() or np.isnan(mois[sel]).all():
+                if log:
+                    log(f"Données invalides (RsAna ou mois manquants) pour station {sta}, produit {prod}, année {y}")
+                continue
+            retenues |= sel
+            connu = sel & ~np.isnan(mois)
+            entry['years'].append(y)
+            entry['dates'].append(pd.to_datetime(dp['DateAna'].to_numpy()[sel], errors='coerce').to_numpy())
+            entry['values'].append(rs_ana[sel])
+            # Dépassements par mois (indices 1 à 12)
+            entry['ma'].append(np.bincount(mois[connu & sup_ma].astype(int), minlength=13)[1:13])
+            entry['cma'].append(np.bincount(mois[connu & sup_cma].astype(int), minlength=13)[1:13])
+        if not entry['years']:
+            if log:
+                log(f"Aucune donnée valide pour générer les graphiques pour station {sta}, produit {prod}")
+            continue
+
+        combined = dp[retenues]
+        entry['ma'] = np.array(entry['ma'])
+        entry['cma'] = np.array(entry['cma'])
+        entry['has_monthly'] = bool(entry['ma'].sum() > 0 or entry['cma'].sum() > 0)
+        entry['max_rs'] = np.nanmax(rs_ana[retenues]) if not np.isnan(rs_ana[retenues]).all() else 0
+        entry['nqe_ma'] = combined['NQE-MA'].iloc[0]
+        entry['nqe_cma'] = combined['NQE-CMA'].iloc[0]
+        # Nombre de mesures par année et par mois (heatmap)
+        mesures = combined.dropna(subset=['RsAna', 'Month'])
+        counts = np.zeros((len(entry['years']), 12), dtype=int)
+        np.add.at(counts, (np.searchsorted(entry['years'], mesures['Annee'].to_numpy()),
+                           mesures['Month'].to_numpy(dtype=int) - 1), 1)
+        entry['counts'] = counts
+        # Valeurs par mois (boxplot) et moyenne mobile sur 5 mesures (tendance)
+        entry['box'] = {int(m): g.to_numpy(dtype=float) for m, g in mesures.groupby('Month')['RsAna']}
+        tri = combined.sort_values('DateAna')
+        entry['trend_dates'] = pd.to_datetime(tri['DateAna'], errors='coerce').to_numpy()
+        entry['trend_values'] = tri['RsAna'].rolling(window=5, min_periods=1).mean().to_numpy()
+        index.append(entry)
+    return index
+
+
+# Manifeste des sorties graphiques, écrit dans le dossier des CSV
+NAIADES_MANIFEST_FILE = "manifeste_graphiques_naiades.json"
+
+
+def naiades_pair_key(entry):
+    return f"{entry['dpt']}|{entry['sta']}|{entry['prod']}"
+
+
+def naiades_slice_hash(slice_df):
+    """Empreinte du contenu d'une tranche station-substance, et de la version du rendu."""
+    digest = hashlib.md5(f"{NAIADES_RENDU_VERSION}|{'|'.join(slice_df.columns)}".encode('utf8'))
+    digest.update(pd.util.hash_pandas_object(slice_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_naiades_manifest(folder):
+    try:
+        with open(os.path.join(folder, NAIADES_MANIFEST_FILE), 'r', encoding='utf8') as f:
+            return json.load(f).get("paires", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_naiades_manifest(folder, paires):
+    path = os.path.join(folder, NAIADES_MANIFEST_FILE)
+    with open(path + ".tmp", 'w', encoding='utf8') as f:
+        json.dump({"version_rendu": NAIADES_RENDU_VERSION, "paires": paires}, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def naiades_pair_is_current(folder, record, slice_hash, graph_types):
+    """Une paire est à jour si sa tranche n'a pas changé, que les graphiques demandés ont déjà été rendus
+    et que ses fichiers sont toujours dans le dossier."""
+    return (
+        record is not None
+        and record.get("hash") == slice_hash
+        and set(graph_types) <= set(record.get("graphiques", []))
+        and all(os.path.exists(os.path.join(folder, name)) for name in record.get("fichiers", []))
+    )
+
+
+# Colonnes de coordonnées (Lambert 93) des tables annuelles, portées par la géométrie
+NAIADES_COORD_COLUMNS = ['CoordXStationMesureEauxSurface', 'CoordYStationMesureEauxSurface']
+# Nombre d'entités transmises à chaque addFeatures
+NAIADES_SIG_BATCH_SIZE = 10000
+# Mappage des types Pandas vers les types QVariant (QGIS)
+NAIADES_QVARIANT_TYPES = {
+    'object': QVariant.String,
+    'int64': QVariant.Int,
+    'Int64': QVariant.Int,
+    'int32': QVariant.Int,
+    'float64': QVariant.Double,
+    'float32': QVariant.Double,
+    'bool': QVariant.Bool
+}
+# Types explicites des tables annuelles : codes station et paramètre entiers, autres codes et libellés en texte
+NAIADES_YEAR_INT_COLUMNS = ['CdStationMesureEauxSurface', 'CdParametre']
+NAIADES_YEAR_TEXT_COLUMNS = [
+    'CdProjStationMesureEauxSurface', 'CodeCommune', 'CodeDepartement', 'CodeRegion', 'CdMasseDEau', 'CdEuMasseDEau',
+    'CdEuSsBassinDCEAdmin', 'CdBassinDCE', 'CdEuBassinDCE', 'CdTronconHydrographique', 'CdCoursdEau'
+]
+# Index attributaires des couches du GeoPackage multi-couches
+NAIADES_GPKG_INDEX_COLUMNS = ['CdStationMesureEauxSurface', 'CdParametre']
+# GeoPackage regroupant toutes les années
+NAIADES_GPKG_FILE = "stations_nb_depassements_NQE_CMA.gpkg"
+NAIADES_SIG_MODES = ["Un GeoPackage par année", "Un GeoPackage multi-couches (toutes les années)"]
+
+
+def read_naiades_year_table(path):
+    """Lit une table stations_nb_depassements_NQE_CMA_<année> avec des types explicites.
+
+    Sans cela, pandas lit les codes départements ou communes en entiers (01 devient 1) et les colonnes
+    annuelles entièrement vides en texte.
+    """
+    dtype = {}
+    for col in pd.read_csv(path, sep=';', nrows=0, encoding='utf8').columns:
+        if col in NAIADES_YEAR_TEXT_COLUMNS or col.startswith(('Lb', 'Nom', 'Libelle')):
+            dtype[col] = str
+        elif col in NAIADES_COORD_COLUMNS or col.startswith(('moy_', 'nb_M_', 'supMA_')) or col.endswith(('_MA', '_CMA')):
+            dtype[col] = 'float64'
+    df = pd.read_csv(path, sep=';', dtype=dtype, encoding='utf8')
+    # Codes lus en flottants (6000990.0) si la colonne avait des manques lors de l'écriture
+    for col in NAIADES_YEAR_INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    return df
+
+
+def naiades_sig_fields(df):
+    fields = QgsFields()
+    for col in df.columns:
+        if col not in NAIADES_COORD_COLUMNS:
+            fields.append(QgsField(col, NAIADES_QVARIANT_TYPES.get(str(df[col].dtype), QVariant.String)))
+    return fields
+
+
+def naiades_sig_rows(df, columns):
+    """Attributs ligne à ligne, chaque colonne étant convertie une seule fois en valeurs Python (NaN en NULL)."""
+    colonnes = []
+    for col in columns:
+        serie = df[col]
+        colonnes.append(serie.astype(object).where(serie.notna(), None).tolist())
+    return zip(*colonnes)
+
+
+def naiades_sig_coordinates(df):
+    xs = pd.to_numeric(df[NAIADES_COORD_COLUMNS[0]], errors='coerce').to_numpy(dtype=float)
+    ys = pd.to_numeric(df[NAIADES_COORD_COLUMNS[1]], errors='coerce').to_numpy(dtype=float)
+    return xs.tolist(), ys.tolist(), (np.isfinite(xs) & np.isfinite(ys)).tolist()
+
+
+def write_naiades_layer(df, gpkg_path, layer_name, transform_context):
+    """Écrit une table annuelle en couche de points GPKG, sans couche mémoire intermédiaire.
+
+    Les entités sont construites depuis des tableaux de colonnes et transmises par lots au writer OGR ;
+    la fonction ne touche pas au projet et peut tourner dans un thread. Renvoie le nombre d'entités.
+    """
+    fields = naiades_sig_fields(df)
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = layer_name
+    writer = QgsVectorFileWriter.create(
+        gpkg_path, fields, QgsWkbTypes.Point, QgsCoordinateReferenceSystem("EPSG:2154"), transform_context, options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError(f"Création de {gpkg_path} impossible : {writer.errorMessage()}")
+
+    batch = []
+    for x, y, valide, attrs in zip(*naiades_sig_coordinates(df), naiades_sig_rows(df, fields.names())):
+        feat = QgsFeature(fields)
+        if valide:
+            feat.setGeometry(QgsGeometry(QgsPoint(x, y)))
+        feat.setAttributes(list(attrs))
+        batch.append(feat)
+        if len(batch) >= NAIADES_SIG_BATCH_SIZE:
+            writer.addFeatures(batch)
+            batch = []
+    if batch:
+        writer.addFeatures(batch)
+    # La destruction du writer vide ses tampons et ferme le fichier
+    del writer
+    return len(df)
+
+
+def export_naiades_year_file(export_folder, file, transform_context):
+    df = read_naiades_year_table(os.path.join(export_folder, file))
+    layer_name = file.replace(".csv", "")
+    gpkg_path = os.path.join(export_folder, layer_name + ".gpkg")
+    count = write_naiades_layer(df, gpkg_path, layer_name, transform_context)
+    return layer_name, gpkg_path, count
+
+
+def naiades_ogr_field_type(dtype):
+    name = str(dtype)
+    if name in ('int64', 'Int64'):
+        return ogr.OFTInteger64, ogr.OFSTNone
+    if name in ('int32', 'Int32'):
+        return ogr.OFTInteger, ogr.OFSTNone
+    if name.startswith(('float', 'Float')):
+        return ogr.OFTReal, ogr.OFSTNone
+    if name in ('bool', 'boolean'):
+        return ogr.OFTInteger, ogr.OFSTBoolean
+    return ogr.OFTString, ogr.OFSTNone
+
+
+@contextmanager
+def naiades_ogr_exceptions():
+    """Exceptions OGR le temps d'un bloc, puis retour au mode précédent : le réglage vaut pour tout le processus QGIS."""
+    if hasattr(ogr, 'ExceptionMgr'):
+        with ogr.ExceptionMgr():
+            yield
+        return
+    previous = ogr.GetUseExceptions()
+    ogr.UseExceptions()
+    try:
+        yield
+    finally:
+        if not previous:
+            ogr.DontUseExceptions()
+
+
+def write_naiades_geopackage(tables, gpkg_path):
+    """Écrit les tables annuelles comme couches d'un seul GeoPackage, dans une seule transaction.
+
+    Chaque couche reçoit des champs typés, un index spatial R-tree et des index attributaires sur les codes
+    station et paramètre. Le fichier est écrit à côté puis remplace l'export précédent : en cas d'erreur,
+    l'ancien GeoPackage reste intact. Renvoie {nom de couche: nombre d'entités}.
+    """
+    tmp_path = os.path.splitext(gpkg_path)[0] + "_en_cours.gpkg"
+    counts = {}
+    with naiades_ogr_exceptions():
+        driver = ogr.GetDriverByName("GPKG")
+        if os.path.exists(tmp_path):
+            driver.DeleteDataSource(tmp_path)
+        ds = driver.CreateDataSource(tmp_path)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(2154)
+        ds.StartTransaction()
+        try:
+            for layer_name, df in tables:
+                layer = ds.CreateLayer(layer_name, srs, ogr.wkbPoint, options=['SPATIAL_INDEX=YES'])
+                columns = [col for col in df.columns if col not in NAIADES_COORD_COLUMNS]
+                for col in columns:
+                    field_type, subtype = naiades_ogr_field_type(df[col].dtype)
+                    field = ogr.FieldDefn(col, field_type)
+                    field.SetSubType(subtype)
+                    layer.CreateField(field)
+                defn = layer.GetLayerDefn()
+                for x, y, valide, attrs in zip(*naiades_sig_coordinates(df), naiades_sig_rows(df, columns)):
+                    feat = ogr.Feature(defn)
+                    for i, value in enumerate(attrs):
+                        if value is not None:
+                            feat.SetField(i, int(value) if isinstance(value, bool) else value)
+                    if valide:
+                        point = ogr.Geometry(ogr.wkbPoint)
+                        point.AddPoint_2D(x, y)
+                        feat.SetGeometryDirectly(point)
+                    layer.CreateFeature(feat)
+                # La table doit exister en base avant d'y poser les index
+                layer.SyncToDisk()
+                for col in NAIADES_GPKG_INDEX_COLUMNS:
+                    if col in columns:
+                        ds.ExecuteSQL(f'CREATE INDEX "{layer_name}_{col}_idx" ON "{layer_name}" ("{col}")')
+                counts[layer_name] = len(df)
+            ds.CommitTransaction()
+        except Exception:
+            ds.RollbackTransaction()
+            ds = None
+            driver.DeleteDataSource(tmp_path)
+            raise
+        finally:
+            # La fermeture du GeoPackage finalise les index R-tree
+            ds = None
+    os.replace(tmp_path, gpkg_path)
+    return counts
+
+
+# Colonnes de Stations.csv reprises dans les tables annuelles et la base locale
+NAIADES_STATION_COLUMNS = [
+    'CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CoordXStationMesureEauxSurface',
+    'CoordYStationMesureEauxSurface', 'CdProjStationMesureEauxSurface', 'LibelleProjection',
+    'CodeCommune', 'LbCommune', 'CodeDepartement', 'LbDepartement', 'CodeRegion',
+    'LbRegion', 'CdMasseDEau', 'CdEuMasseDEau', 'NomMasseDEau', 'CdEuSsBassinDCEAdmin',
+    'NomSsBassinDCEAdmin', 'CdBassinDCE', 'CdEuBassinDCE', 'NomEuBassinDCE',
+    'CdTronconHydrographique', 'CdCoursdEau', 'NomCoursdEau'
+]
+# Colonnes de la table des analyses de la base locale : analyses, année et département de la station
+NAIADES_STORE_COLUMNS = NAIADES_ANALYSES_COLUMNS + ['Annee', 'CodeDepartement']
+
+
+def naiades_departement_code(value):
+    """Code département sur deux caractères au moins (6 ou 6.0 lus par pandas redeviennent '06')."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    try:
+        return f"{int(float(value)):02d}"
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def parse_naiades_filter(text, ranges=False):
+    """Liste de valeurs saisies séparées par des virgules ou des espaces ('2019-2022' pour une plage d'années)."""
+    values = []
+    for token in text.replace(';', ',').replace(' ', ',').split(','):
+        token = token.strip()
+        if not token:
+            continue
+        if ranges and '-' in token:
+            debut, fin = token.split('-', 1)
+            values.extend(str(year) for year in range(int(debut), int(fin) + 1))
+        else:
+            values.append(token)
+    return values or None
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class NaiadesStore:
+    """Base locale SQLite cumulant les extraits Naïades (Stations.csv / Analyses.csv).
+
+    Les analyses sont dédoublonnées sur (station, paramètre, date) et indexées par département, année
+    et paramètre : les traitements lisent une tranche quelconque sans relire les CSV bruts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.create_schema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def create_schema(self):
+        station_cols = ", ".join(quote_ident(col) for col in NAIADES_STATION_COLUMNS[1:])
+        with self.conn:
+            self.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS stations ("CdStationMesureEauxSurface" INTEGER PRIMARY KEY, {station_cols})'
+            )
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    "CdStationMesureEauxSurface" INTEGER NOT NULL,
+                    "LbStationMesureEauxSurface" TEXT,
+                    "DateAna" TEXT NOT NULL,
+                    "CdParametre" INTEGER NOT NULL,
+                    "LbLongParamètre" TEXT,
+                    "RsAna" REAL,
+                    "LqAna" REAL,
+                    "Annee" TEXT,
+                    "CodeDepartement" TEXT,
+                    PRIMARY KEY ("CdStationMesureEauxSurface", "CdParametre", "DateAna")
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS analyses_partition_idx ON analyses ("CodeDepartement", "Annee", "CdParametre")'
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS extraits (dossier TEXT, date_import TEXT, analyses_lues INTEGER, analyses_ajoutees INTEGER)"
+            )
+
+    @staticmethod
+    def python_rows(df):
+        # sqlite3 n'accepte pas les scalaires numpy : valeurs Python, NaN en NULL
+        return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+    def append_extract(self, folder, chunksize=DEFAULT_NAIADES_CHUNK_SIZE, log=None):
+        """Ajoute l'extrait d'un dossier. Les stations sont mises à jour, les analyses déjà connues ignorées.
+
+        Renvoie (analyses lues, analyses ajoutées).
+        """
+        stations = load_naiades_csv(folder, "Stations.csv", log=log)
+        stations = stations.reindex(columns=NAIADES_STATION_COLUMNS)
+        stations['CdStationMesureEauxSurface'] = pd.to_numeric(stations['CdStationMesureEauxSurface'], errors='coerce').astype('Int64')
+        stations = stations.dropna(subset=['CdStationMesureEauxSurface'])
+        stations['CodeDepartement'] = stations['CodeDepartement'].map(naiades_departement_code)
+        departements = dict(zip(stations['CdStationMesureEauxSurface'], stations['CodeDepartement']))
+
+        lues = 0
+        ajoutees = 0
+        placeholders = ", ".join("?" for _ in NAIADES_STORE_COLUMNS)
+        insert_analyses = (f"INSERT OR IGNORE INTO analyses ({', '.join(quote_ident(c) for c in NAIADES_STORE_COLUMNS)}) "
+                           f"VALUES ({placeholders})")
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO stations ({', '.join(quote_ident(c) for c in NAIADES_STATION_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in NAIADES_STATION_COLUMNS)})",
+                self.python_rows(stations)
+            )
+            for chunk in iter_naiades_chunks(folder, "Analyses.csv", NAIADES_ANALYSES_COLUMNS, chunksize, log=log):
+                lues += len(chunk)
+                for col in ('CdStationMesureEauxSurface', 'CdParametre'):
+                    chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('Int64')
+                chunk = chunk.dropna(subset=['CdStationMesureEauxSurface', 'CdParametre', 'DateAna'])
+                chunk = chunk.assign(Annee=chunk['DateAna'].str[:4],
+                                     CodeDepartement=chunk['CdStationMesureEauxSurface'].map(departements))
+                before = self.conn.total_changes
+                self.conn.executemany(insert_analyses, self.python_rows(chunk[NAIADES_STORE_COLUMNS]))
+                ajoutees += self.conn.total_changes - before
+                if log:
+                    log(f"{lues} analyses lues, {ajoutees} ajoutées à la base.")
+            self.conn.execute("INSERT INTO extraits VALUES (?, ?, ?, ?)",
+                              (os.path.abspath(folder), datetime.now().isoformat(timespec='seconds'), lues, ajoutees))
+        return lues, ajoutees
+
+    @staticmethod
+    def filters(departements=None, annees=None, parametres=None):
+        clauses, params = [], []
+        for column, values in (('CodeDepartement', departements), ('Annee', annees), ('CdParametre', parametres)):
+            if values:
+                if column == 'CodeDepartement':
+                    values = [naiades_departement_code(v) for v in values]
+                elif column == 'CdParametre':
+                    values = [int(v) for v in values]
+                clauses.append(f'{quote_ident(column)} IN ({", ".join("?" for _ in values)})')
+                params.extend(values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def analyses(self, departements=None, annees=None, parametres=None, chunksize=None):
+        """Analyses d'une tranche, aux colonnes d'Analyses.csv. Avec `chunksize`, un itérateur de blocs."""
+        where, params = self.filters(departements, annees, parametres)
+        sql = f"SELECT {', '.join(quote_ident(c) for c in NAIADES_ANALYSES_COLUMNS)} FROM analyses{where}"
+        return pd.read_sql_query(sql, self.conn, params=params, chunksize=chunksize)
+
+    def stations(self, departements=None):
+        where, params = self.filters(departements)
+        return pd.read_sql_query(f"SELECT * FROM stations{where}", self.conn, params=params)
+
+    def summary(self):
+        """Nombre d'analyses par département et par année."""
+        return pd.read_sql_query(
+            'SELECT "CodeDepartement", "Annee", COUNT(*) AS nb_analyses FROM analyses '
+            'GROUP BY "CodeDepartement", "Annee" ORDER BY "CodeDepartement", "Annee"', self.conn
+        )
+
+
+# Rapport JSON du profil des étapes, écrit dans le dossier traité
+NAIADES_PROFILE_FILE = "profil_traitements_naiades.json"
+
+
+class NaiadesStage(dict):
+    """Mesures d'une étape ; `frame` y ajoute la taille d'un DataFrame produit par l'étape."""
+
+    def __init__(self, name, enabled):
+        super().__init__(etape=name)
+        self.enabled = enabled
+        self.frames = {}
+
+    def frame(self, label, df):
+        if self.enabled:
+            self.frames[label] = df
+        return df
+
+
+class NaiadesProfiler:
+    """Profil des étapes nommées d'un traitement : durée, temps CPU, pic de mémoire et taille des DataFrames.
+
+    Chaque étape est résumée dans le log à sa fin ; `save` écrit le rapport JSON. Désactivé, le profileur
+    ne mesure rien et ne coûte rien.
+    """
+
+    def __init__(self, enabled=True, log=None):
+        self.enabled = enabled
+        self.log = log
+        self.stages = []
+        self.started = datetime.now()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        stage = NaiadesStage(name, self.enabled)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            if self.enabled:
+                stage['duree_s'] = round(time.perf_counter() - wall, 3)
+                stage['cpu_s'] = round(time.process_time() - cpu, 3)
+                stage['rss_max_mo'] = peak_rss_mb()
+                # Tailles mesurées hors chronométrage : memory_usage(deep=True) parcourt les chaînes
+                stage['dataframes'] = {
+                    label: {
+                        'lignes': int(df.shape[0]), 'colonnes': int(df.shape[1]),
+                        'memoire_mo': round(df.memory_usage(deep=True).sum() / 2 ** 20, 1)
+                    }
+                    for label, df in stage.frames.items()
+                }
+                stage.frames = {}
+                self.stages.append(dict(stage))
+                if self.log:
+                    self.log(self.describe(stage))
+
+    @staticmethod
+    def describe(stage):
+        frames = ", ".join(f"{label} {info['lignes']}×{info['colonnes']} ({info['memoire_mo']} Mo)"
+                           for label, info in stage['dataframes'].items())
+        text = (f"[profil] {stage['etape']} : {stage['duree_s']} s, CPU {stage['cpu_s']} s, "
+                f"pic mémoire {stage['rss_max_mo'] if stage['rss_max_mo'] is not None else '?'} Mo")
+        return text + (f" — {frames}" if frames else "")
+
+    def save(self, folder, **context):
+        """Écrit le rapport JSON dans `folder` et renvoie son chemin (None si le profil est désactivé)."""
+        if not self.enabled:
+            return None
+        report = {
+            'debut': self.started.isoformat(timespec='seconds'),
+            **context,
+            'duree_totale_s': round(time.perf_counter() - self.wall, 3),
+            'cpu_total_s': round(time.process_time() - self.cpu, 3),
+            'rss_max_mo': peak_rss_mb(),
+            'etapes': self.stages,
+        }
+        path = os.path.join(folder, NAIADES_PROFILE_FILE)
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
 
 class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
     def __init__(self, iface, parent=None):
@@ -166,6 +995,11 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
         <li>Histogramme cumulatif des dépassements.</li>
         </ul>
         <p>Export en PNG pour tous les graphiques.</p>
+
+        <h3>Cache des données :</h3>
+        <p>À la première lecture, Stations.csv et Analyses.csv sont convertis dans le sous-dossier cache_naiades (format Parquet si pyarrow est installé). Les lectures suivantes n'y chargent que les colonnes utiles ; le cache est reconstruit automatiquement si un CSV change.</p>
+        <h3>Base locale :</h3>
+        <p>Le bouton « Ajouter l'extrait du dossier à la base » cumule les extraits successifs dans une base SQLite, sans doublon (station, paramètre, date). En cochant « depuis la base locale », les traitements et les graphiques portent sur la tranche saisie (départements, années, substances) sans relire les CSV bruts ; les sorties sont écrites dans le dossier choisi.</p>
         """
         self.instructions_text.setHtml(instructions)
         layout.addWidget(self.instructions_text)
@@ -310,6 +1144,55 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
         folder_layout.addWidget(btn_browse)
         layout.addLayout(folder_layout)
 
+        # Mode flux pour les extraits volumineux
+        stream_layout = QHBoxLayout()
+        self.streaming_check = QCheckBox("Traitement en flux (extraits nationaux ou multi-régions, mémoire bornée)")
+        stream_layout.addWidget(self.streaming_check)
+        stream_layout.addWidget(QLabel("Lignes par bloc :"))
+        self.chunk_size_spin = QSpinBox()
+        self.chunk_size_spin.setRange(10000, 10000000)
+        self.chunk_size_spin.setSingleStep(100000)
+        self.chunk_size_spin.setValue(DEFAULT_NAIADES_CHUNK_SIZE)
+        stream_layout.addWidget(self.chunk_size_spin)
+        layout.addLayout(stream_layout)
+
+        # Profil des étapes
+        self.profile_check = QCheckBox(f"Profiler les étapes (durée, CPU, mémoire) et écrire {NAIADES_PROFILE_FILE}")
+        layout.addWidget(self.profile_check)
+
+        # Base locale : cumul des extraits et lecture d'une tranche département / année / substance
+        store_group = QGroupBox("Base locale Naïades")
+        store_layout = QVBoxLayout()
+        store_path_layout = QHBoxLayout()
+        self.store_line = QLineEdit()
+        btn_store_browse = QPushButton("Parcourir...")
+        btn_store_browse.clicked.connect(self.browse_store)
+        store_path_layout.addWidget(QLabel("Base SQLite :"))
+        store_path_layout.addWidget(self.store_line)
+        store_path_layout.addWidget(btn_store_browse)
+        store_layout.addLayout(store_path_layout)
+        btn_store_append = QPushButton("Ajouter l'extrait du dossier à la base")
+        btn_store_append.clicked.connect(self.append_to_store)
+        store_layout.addWidget(btn_store_append)
+        self.use_store_check = QCheckBox("Traitements et graphiques depuis la base locale (tranche ci-dessous)")
+        store_layout.addWidget(self.use_store_check)
+        filters_layout = QHBoxLayout()
+        self.store_dpt_line = QLineEdit()
+        self.store_dpt_line.setPlaceholderText("ex. 06, 83")
+        self.store_years_line = QLineEdit()
+        self.store_years_line.setPlaceholderText("ex. 2019-2022")
+        self.store_subst_line = QLineEdit()
+        self.store_subst_line.setPlaceholderText("CdParametre, ex. 1107, 1208")
+        filters_layout.addWidget(QLabel("Départements :"))
+        filters_layout.addWidget(self.store_dpt_line)
+        filters_layout.addWidget(QLabel("Années :"))
+        filters_layout.addWidget(self.store_years_line)
+        filters_layout.addWidget(QLabel("Substances :"))
+        filters_layout.addWidget(self.store_subst_line)
+        store_layout.addLayout(filters_layout)
+        store_group.setLayout(store_layout)
+        layout.addWidget(store_group)
+
         # Bouton traitement
         btn_process = QPushButton("Lancer Traitements")
         btn_process.clicked.connect(self.process_pandas)
@@ -332,6 +1215,42 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
         if folder:
             self.folder_line.setText(folder)
 
+    def browse_store(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Base locale Naïades", "", "Base SQLite (*.sqlite)",
+                                              options=QFileDialog.DontConfirmOverwrite)
+        if path:
+            self.store_line.setText(path)
+
+    def open_store(self):
+        path = self.store_line.text()
+        if not path:
+            raise ValueError("Sélectionnez la base locale Naïades.")
+        return NaiadesStore(path)
+
+    def store_slice(self):
+        """Filtres de la tranche lue dans la base locale (None : pas de filtre)."""
+        return {
+            'departements': parse_naiades_filter(self.store_dpt_line.text()),
+            'annees': parse_naiades_filter(self.store_years_line.text(), ranges=True),
+            'parametres': parse_naiades_filter(self.store_subst_line.text()),
+        }
+
+    def append_to_store(self):
+        try:
+            folder = self.folder_line.text()
+            if not folder:
+                raise ValueError("Sélectionnez un dossier.")
+            self.log_text.clear()
+            with self.open_store() as store:
+                lues, ajoutees = store.append_extract(folder, self.chunk_size_spin.value(), log=self.log_text.append)
+                for row in store.summary().itertuples(index=False):
+                    self.log_text.append(f"Département {row.CodeDepartement}, {row.Annee} : {row.nb_analyses} analyses")
+            self.log_text.append(f"Extrait ajouté : {lues} analyses lues, {ajoutees} nouvelles, {lues - ajoutees} déjà présentes.")
+            QMessageBox.information(self, "Succès", f"{ajoutees} analyses ajoutées à la base locale.")
+        except Exception as e:
+            self.log_text.append(f"Erreur: {str(e)}")
+            QMessageBox.critical(self, "Erreur", str(e))
+
     def process_pandas(self):
         try:
             folder = self.folder_line.text()
@@ -341,167 +1260,56 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
             self.progress.setValue(0)
             self.log_text.clear()
 
-            # Lecture Stations.csv
-            df_stations = pd.read_csv(os.path.join(folder, "Stations.csv"), sep=';', encoding='utf8', low_memory=False)
+            # Profil des étapes (durée, CPU, mémoire, taille des DataFrames), résumé dans le log
+            profiler = NaiadesProfiler(self.profile_check.isChecked(), log=self.log_text.append)
+
+            # Lecture Stations.csv, ou des stations de la tranche dans la base locale
+            with profiler.stage("lecture stations") as etape:
+                if self.use_store_check.isChecked():
+                    with self.open_store() as store:
+                        df_stations = store.stations(self.store_slice()['departements'])
+                else:
+                    df_stations = load_naiades_csv(folder, "Stations.csv", log=self.log_text.append)
+                etape.frame("stations", df_stations)
             self.log_text.append("Stations lues.")
             self.progress.setValue(10)
 
-            # Lecture Analyses.csv
-            df_analyses = pd.read_csv(os.path.join(folder, "Analyses.csv"), sep=';', encoding='utf8', low_memory=False)
-            self.log_text.append("Analyses lues.")
-            self.progress.setValue(20)
-
-            # Créer df_subst
-            df_subst = pd.DataFrame.from_dict(self.subst, orient='index', columns=['LbLongParamètre', 'NQE-MA', 'NQE-CMA', 'Type_polluants'])
-            self.log_text.append("Dictionnaire des substances créé.")
-            self.progress.setValue(30)
-
-            # Mise en dataframe des colonnes utiles
-            df = df_analyses.loc[:, ('CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'DateAna', 'CdParametre', 'LbLongParamètre', 'RsAna', 'LqAna')]
-            df_analyses_LQ = pd.merge(df, df_subst[['NQE-MA', 'NQE-CMA']], left_on=['CdParametre'], right_index=True, how='left')
-            self.log_text.append("Jointure NQE effectuée.")
-            self.progress.setValue(40)
-
-            # Nombre de mesures par substance
-            table0 = df_analyses_LQ.pivot_table(
-                values='RsAna',
-                index=['CdParametre', 'LbLongParamètre'],
-                aggfunc='count'
-            )
-            table0 = pd.DataFrame(table0.to_records())
-            table0['nb_mesures'] = table0['RsAna']
-            table0 = table0.drop(columns=['RsAna'])
+            liste_id = NAIADES_ID_COLUMNS
+            df_subst = naiades_substances_frame(self.subst)
+            if self.streaming_check.isChecked():
+                with profiler.stage("lecture, jointure NQE et agrégation en flux") as etape:
+                    accumulators = etape.frame("accumulateurs", self.accumulateurs_en_flux(folder, df_subst))
+            else:
+                # Lecture Analyses.csv (seules les colonnes utiles)
+                with profiler.stage("lecture analyses") as etape:
+                    df_analyses = etape.frame("analyses", self.read_analyses(folder, self.log_text.append))
+                self.log_text.append("Analyses lues.")
+                self.progress.setValue(20)
+
+                # Jointure NQE et agrégation en une seule passe par station, substance, LQ et année
+                with profiler.stage("jointure NQE et agrégation") as etape:
+                    accumulators = etape.frame("accumulateurs", naiades_accumulators(df_analyses, df_subst))
+                del df_analyses
+                self.log_text.append(f"Jointure NQE et agrégation effectuées ({len(accumulators)} groupes).")
+                self.progress.setValue(60)
 
             # Cas où NQE-MA < LQ
-            mask = df_analyses_LQ['NQE-MA'] < df_analyses_LQ['LqAna']
-            table1 = df_analyses_LQ[mask].pivot_table(
-                values='NQE-MA',
-                index=['CdParametre', 'LbLongParamètre'],
-                aggfunc='count'
-            )
-            table1 = pd.DataFrame(table1.to_records())
-            table1['nbNQMAsupLQ'] = table1['NQE-MA']
-            table1 = table1.drop(columns=['NQE-MA'])
-
-            # Ratio
-            table2 = pd.merge(table0, table1['nbNQMAsupLQ'], left_index=True, right_index=True, how='left')
-            table2['pourcentage'] = (100 * table2['nbNQMAsupLQ'] / table2['nb_mesures']).round(2)
-            table3 = table2.sort_values(by=['pourcentage'], ascending=False)
-            self.log_text.append("Analyse des limites de quantification terminée.")
-            self.progress.setValue(50)
-
-            # Extraction par stations et années
-            df_analyses_2 = df_analyses_LQ.loc[:, ('CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'DateAna', 'CdParametre', 'LbLongParamètre', 'RsAna', 'LqAna', 'NQE-MA', 'NQE-CMA')]
-            df_analyses_2['Annee'] = df_analyses_2['DateAna'].str[:4]
-            df_analyses_3 = df_analyses_2.iloc[:, [0, 1, 3, 4, 5, 6, 7, 8, 9]]
-            new_index = ['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'Annee', 'CdParametre', 'LbLongParamètre', 'RsAna', 'LqAna', 'NQE-MA', 'NQE-CMA']
-            df_analyses_4 = df_analyses_3.reindex(columns=new_index)
-            self.progress.setValue(60)
-
-            # Calcul du nombre d'analyses par substance et année
-            nb_val_table = df_analyses_4.pivot_table(
-                index=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre', 'NQE-MA', 'NQE-CMA'],
-                values='RsAna',
-                columns='Annee',
-                aggfunc='count',
-                fill_value=0
-            )
-            liste_annees = [titre for titre in nb_val_table.columns]  # Définir liste_annees ici
-            nb_val_table = pd.DataFrame(nb_val_table.to_records())
-            for year in liste_annees:
-                titre = 'nb_M_' + year
-                nb_val_table[titre] = nb_val_table[year]
-            nb_val_table = nb_val_table.drop(columns=liste_annees)
-            self.log_text.append("Calcul du nombre d'analyses terminé.")
-            self.progress.setValue(65)
-
-            # Calcul des dépassements NQE-MA
-            mask = df_analyses_4['RsAna'] > df_analyses_4['NQE-MA']
-            nb_val_supMA_table = df_analyses_4[mask].pivot_table(
-                index=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre', 'NQE-MA', 'NQE-CMA'],
-                values='RsAna',
-                columns='Annee',
-                aggfunc='count',
-                fill_value=0
-            )
-            nb_val_supMA_table.columns = [titre.replace(titre, "supMA_%s" % titre) for titre in nb_val_supMA_table.columns]
-            nb_val_supMA_table_2 = pd.DataFrame(nb_val_supMA_table.to_records())
-            nb_depassements_annuel_NQE_MA = nb_val_supMA_table_2.loc[:, :]
-            self.log_text.append("Dépassements NQE-MA calculés.")
+            with profiler.stage("analyse LQ") as etape:
+                lq_table = etape.frame("lq", naiades_lq_table(accumulators))
+            nb_lq = int((lq_table['nbNQMAsupLQ'] > 0).sum())
+            self.log_text.append(f"Analyse des limites de quantification terminée ({nb_lq} substances avec LQ > NQE-MA).")
             self.progress.setValue(70)
 
-            # Calcul des moyennes annuelles
-            df_analyses_5 = df_analyses_4.copy()
-            df_analyses_5['RsAna'] = np.select(
-                [(df_analyses_5['RsAna'].notnull()) & (df_analyses_5['RsAna'] < df_analyses_5['LqAna'])],
-                [df_analyses_5['LqAna'] / 2],
-                df_analyses_5['RsAna']
-            )
-            table = df_analyses_5.pivot_table(
-                index=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre', 'NQE-MA', 'LqAna'],
-                values='RsAna',
-                columns='Annee',
-                aggfunc={'RsAna': [len, np.mean]},
-                fill_value=0
-            )
-            liste_annees = [multi_index[1] for multi_index in table.columns if multi_index[0] == 'mean']  # Extraire les années uniques
-            flattened = pd.DataFrame(table.to_records())
-            flattened.columns = [titre.replace("('len', '", "nb_").replace("')", "") for titre in flattened.columns]
-            flattened.columns = [titre.replace("('mean', '", "moy_").replace("')", "") for titre in flattened.columns]
-            self.progress.setValue(75)
-
-            # Suppression des moyennes avec moins de 4 mesures
-            for year in liste_annees:
-                col = 'nb_' + year
-                titre = 'moy_' + year
-                flattened[titre] = np.select([flattened[col] < 4], [0], default=flattened[titre])
-            table_2 = flattened.loc[:, :]
-            self.log_text.append("Moyennes annuelles calculées.")
-            self.progress.setValue(80)
-
-            # Identification des non-respects NQE-MA
-            for year in liste_annees:
-                col = 'moy_' + year
-                titre_MA = str(year) + '_MA'
-                conditions_non_respect = [
-                    (table_2['LqAna'] > table_2['NQE-MA']) & (table_2[col] > table_2['LqAna']),
-                    (table_2['LqAna'] > table_2['NQE-MA']) & (table_2[col] <= table_2['LqAna']),
-                    (table_2['LqAna'] <= table_2['NQE-MA']) & (table_2[col] > table_2['NQE-MA'])
-                ]
-                choices = [1, np.nan, 1]
-                table_2[titre_MA] = np.select(conditions_non_respect, choices, default=np.nan)
-            table_3 = table_2.loc[:, :]
-            liste_col_subset = [year + '_MA' for year in liste_annees]
-            nb_depassements_NQE_MA = table_3.dropna(subset=liste_col_subset, how='all')
-            self.log_text.append("Non-respects NQE-MA identifiés.")
-            self.progress.setValue(85)
-
-            # Dépassements NQE-CMA
-            depassements_NQE_CMA = df_analyses_5
-            depassements_NQE_CMA['depasse_NQE_CMA'] = np.where(depassements_NQE_CMA['RsAna'] > depassements_NQE_CMA['NQE-CMA'], 1, 0)
-            nb_depassements_NQE_CMA = depassements_NQE_CMA.pivot_table(
-                index=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre'],
-                values='depasse_NQE_CMA',
-                columns='Annee',
-                aggfunc={'depasse_NQE_CMA': np.sum},
-                fill_value=0
-            )
-            nb_depassements_NQE_CMA_plat = pd.DataFrame(nb_depassements_NQE_CMA.to_records())
-            liste_col = [col for col in nb_depassements_NQE_CMA_plat.columns if col not in ['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre']]
-            for col in liste_col:
-                titre = col + '_CMA'
-                nb_depassements_NQE_CMA_plat[titre] = nb_depassements_NQE_CMA_plat[col]
-            nb_depassements_NQE_CMA_plat_1 = nb_depassements_NQE_CMA_plat.drop(columns=liste_col)
-            self.log_text.append("Dépassements NQE-CMA calculés.")
+            # Nombre de mesures, moyennes annuelles, non-respects NQE-MA et dépassements NQE-CMA
+            with profiler.stage("tableaux croisés et fusions") as etape:
+                depassements_NQE_MA_CMA_pb, liste_annees = naiades_depassements_table(accumulators)
+                etape.frame("depassements_NQE_MA_CMA", depassements_NQE_MA_CMA_pb)
+            self.log_text.append("Moyennes annuelles, dépassements NQE-MA et NQE-CMA calculés.")
             self.progress.setValue(90)
 
             # Table finale
-            liste_id = ['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre']
-            depassements_NQE_MA_CMA = pd.merge(nb_val_table, nb_depassements_annuel_NQE_MA, left_on=liste_id, right_on=liste_id, how='left')
-            depassements_NQE_MA_CMA = pd.merge(depassements_NQE_MA_CMA, nb_depassements_NQE_MA, left_on=liste_id, right_on=liste_id, how='left')
-            depassements_NQE_MA_CMA = pd.merge(depassements_NQE_MA_CMA, nb_depassements_NQE_CMA_plat_1, left_on=liste_id, right_on=liste_id, how='left')
-            depassements_NQE_MA_CMA_pb = depassements_NQE_MA_CMA.fillna(0).replace(0, np.nan)
-            depassements_NQE_MA_CMA_pb.to_csv(os.path.join(folder, "depassements_NQE_MA_CMA.csv"), sep=';', index=False, encoding='utf8')
+            with profiler.stage("export table finale"):
+                depassements_NQE_MA_CMA_pb.to_csv(os.path.join(folder, "depassements_NQE_MA_CMA.csv"), sep=';', index=False, encoding='utf8')
             self.log_text.append("Table finale créée et exportée.")
             self.progress.setValue(95)
 
@@ -513,32 +1321,36 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
                 Dico_Annees[titre] = [liste_f, year]
 
             dico_dataframe = {}
-            for key in Dico_Annees.keys():
-                dff = depassements_NQE_MA_CMA_pb[Dico_Annees[key][0]]
-                year = Dico_Annees[key][1]
-                list_of_cols = [col for col in dff.columns if col not in liste_id and col != 'nb_M_' + year]
-                dff = dff.dropna(how='all', subset=list_of_cols)
-                dff = pd.merge(
-                    dff,
-                    df_stations[['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CoordXStationMesureEauxSurface',
-                                 'CoordYStationMesureEauxSurface', 'CdProjStationMesureEauxSurface', 'LibelleProjection',
-                                 'CodeCommune', 'LbCommune', 'CodeDepartement', 'LbDepartement', 'CodeRegion',
-                                 'LbRegion', 'CdMasseDEau', 'CdEuMasseDEau', 'NomMasseDEau', 'CdEuSsBassinDCEAdmin',
-                                 'NomSsBassinDCEAdmin', 'CdBassinDCE', 'CdEuBassinDCE', 'NomEuBassinDCE',
-                                 'CdTronconHydrographique', 'CdCoursdEau', 'NomCoursdEau']],
-                    left_on=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface'],
-                    right_on=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface'],
-                    how='left'
-                )
-                dico_dataframe[key] = [dff, year]
-                dff.to_csv(
-                    os.path.join(folder, f"{key}.csv"),
-                    sep=';',
-                    header=True,
-                    index=False,
-                    encoding='utf8'
-                )
-                self.log_text.append(f"Table annuelle {key} exportée.")
+            with profiler.stage("découpage annuel") as etape:
+                for key in Dico_Annees.keys():
+                    dff = depassements_NQE_MA_CMA_pb[Dico_Annees[key][0]]
+                    year = Dico_Annees[key][1]
+                    list_of_cols = [col for col in dff.columns if col not in liste_id and col != 'nb_M_' + year]
+                    dff = dff.dropna(how='all', subset=list_of_cols)
+                    dff = pd.merge(
+                        dff,
+                        df_stations[NAIADES_STATION_COLUMNS],
+                        left_on=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface'],
+                        right_on=['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface'],
+                        how='left'
+                    )
+                    dico_dataframe[key] = [etape.frame(key, dff), year]
+
+            with profiler.stage("export CSV annuels"):
+                for key, (dff, year) in dico_dataframe.items():
+                    dff.to_csv(
+                        os.path.join(folder, f"{key}.csv"),
+                        sep=';',
+                        header=True,
+                        index=False,
+                        encoding='utf8'
+                    )
+                    self.log_text.append(f"Table annuelle {key} exportée.")
+
+            report_path = profiler.save(folder, dossier=os.path.abspath(folder),
+                                        flux=self.streaming_check.isChecked(), base_locale=self.use_store_check.isChecked())
+            if report_path:
+                self.log_text.append(f"Profil des étapes enregistré : {report_path}")
 
             self.progress.setValue(100)
             self.log_text.append("Traitement terminé.")
@@ -547,6 +1359,42 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
             self.log_text.append(f"Erreur: {str(e)}")
             return False
 
+    def accumulateurs_en_flux(self, folder, df_subst):
+        """Agrège Analyses.csv bloc par bloc : seuls les accumulateurs restent en mémoire."""
+        chunksize = self.chunk_size_spin.value()
+        accumulators = None
+        nb_lignes = 0
+        if self.use_store_check.isChecked():
+            store = self.open_store()
+            chunks = store.analyses(chunksize=chunksize, **self.store_slice())
+        else:
+            store = None
+            chunks = iter_naiades_chunks(folder, "Analyses.csv", NAIADES_ANALYSES_COLUMNS, chunksize,
+                                         log=self.log_text.append)
+        try:
+            for chunk in chunks:
+                partial = naiades_accumulators(chunk, df_subst)
+                accumulators = partial if accumulators is None else merge_naiades_accumulators([accumulators, partial])
+                nb_lignes += len(chunk)
+                self.log_text.append(f"{nb_lignes} analyses agrégées ({len(accumulators)} groupes).")
+                self.progress.setValue(min(60, 20 + nb_lignes // chunksize))
+                QApplication.processEvents()
+        finally:
+            if store is not None:
+                store.close()
+        if accumulators is None:
+            raise ValueError("Analyses.csv ne contient aucune analyse.")
+        return accumulators
+
+    def read_analyses(self, folder, log):
+        """Analyses (colonnes d'Analyses.csv) du dossier, ou de la tranche choisie dans la base locale."""
+        if self.use_store_check.isChecked():
+            with self.open_store() as store:
+                df_analyses = store.analyses(**self.store_slice())
+            log(f"{len(df_analyses)} analyses lues dans la base locale.")
+            return df_analyses
+        return load_naiades_csv(folder, "Analyses.csv", columns=NAIADES_ANALYSES_COLUMNS, log=log)
+
     def setup_sig_tab(self):
         layout = QVBoxLayout()
 
@@ -560,6 +1408,14 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
         export_layout.addWidget(btn_export_browse)
         layout.addLayout(export_layout)
 
+        # Mode d'export : un fichier par année ou un GeoPackage multi-couches indexé
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(QLabel("Mode d'export :"))
+        self.sig_mode_combo = QComboBox()
+        self.sig_mode_combo.addItems(NAIADES_SIG_MODES)
+        mode_layout.addWidget(self.sig_mode_combo)
+        layout.addLayout(mode_layout)
+
         # Bouton création couches
         btn_create = QPushButton("Créer Couches SIG")
         btn_create.clicked.connect(self.create_sig_layers)
@@ -586,55 +1442,22 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
 
             self.sig_log.clear()
 
-            # Mappage des types Pandas vers les types QVariant (QGIS)
-            type_mapping = {
-                'object': QVariant.String,
-                'int64': QVariant.Int,
-                'int32': QVariant.Int,
-                'float64': QVariant.Double,
-                'float32': QVariant.Double,
-                'bool': QVariant.Bool
-            }
-
-            # Parcourir les fichiers CSV dans le dossier d'export
-            for file in os.listdir(export_folder):
-                if file.endswith(".csv") and "stations_nb_depassements" in file:
-                    df = pd.read_csv(os.path.join(export_folder, file), sep=';')
-                    layer_name = file.replace(".csv", "")
-
-                    # Créer une couche mémoire
-                    layer = QgsVectorLayer("Point?crs=EPSG:2154", layer_name, "memory")
-                    pr = layer.dataProvider()
-
-                    # Ajouter les champs
-                    for col in df.columns:
-                        if col not in ['CoordXStationMesureEauxSurface', 'CoordYStationMesureEauxSurface']:
-                            col_type = str(df[col].dtype)
-                            qgis_type = type_mapping.get(col_type, QVariant.String)
-                            pr.addAttributes([QgsField(col, qgis_type)])
-                    layer.updateFields()
-
-                    # Ajouter les entités
-                    for _, row in df.iterrows():
-                        feat = QgsFeature()
-                        x = row['CoordXStationMesureEauxSurface']
-                        y = row['CoordYStationMesureEauxSurface']
-                        feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
-                        attrs = [row[col] for col in df.columns if col not in ['CoordXStationMesureEauxSurface', 'CoordYStationMesureEauxSurface']]
-                        feat.setAttributes(attrs)
-                        pr.addFeature(feat)
-
-                    # Exporter vers GPKG
-                    gpkg_path = os.path.join(export_folder, layer_name + ".gpkg")
-                    options = QgsVectorFileWriter.SaveVectorOptions()
-                    options.driverName = "GPKG"
-                    options.layerName = layer_name
-                    QgsVectorFileWriter.writeAsVectorFormatV3(
-                        layer,
-                        gpkg_path,
-                        QgsProject.instance().transformContext(),
-                        options
-                    )
+            files = sorted(file for file in os.listdir(export_folder) if file.endswith(".csv") and "stations_nb_depassements" in file)
+            if self.sig_mode_combo.currentIndex() == 1:
+                self.create_sig_geopackage(export_folder, files)
+                QMessageBox.information(self, "Succès", f"GeoPackage {NAIADES_GPKG_FILE} créé et couches ajoutées à QGIS avec analyse thématique.")
+                return
+
+            # Tables annuelles écrites en parallèle, une par thread ; le projet n'est modifié que dans le thread principal
+            transform_context = QgsProject.instance().transformContext()
+            with ThreadPoolExecutor(max_workers=max(1, min(len(files), os.cpu_count() or 1))) as pool:
+                futures = {pool.submit(export_naiades_year_file, export_folder, file, transform_context): file for file in files}
+                for future in as_completed(futures):
+                    try:
+                        layer_name, gpkg_path, count = future.result()
+                    except Exception as e:
+                        self.sig_log.append(f"Erreur lors de l'export de {futures[future]}: {str(e)}")
+                        continue
 
                     # Charger la couche GPKG dans QGIS
                     gpkg_layer = QgsVectorLayer(gpkg_path, layer_name, "ogr")
@@ -643,13 +1466,39 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
                     # Configurer les diagrammes et étiquettes
                     self.setup_thematic_analysis(gpkg_layer)
 
-                    self.sig_log.append(f"Couche {layer_name} créée, ajoutée, et analyse thématique configurée.")
+                    self.sig_log.append(f"Couche {layer_name} créée ({count} entités), ajoutée, et analyse thématique configurée.")
+                    QApplication.processEvents()
 
             QMessageBox.information(self, "Succès", "Couches SIG créées et ajoutées à QGIS avec analyse thématique.")
         except Exception as e:
             self.sig_log.append(f"Erreur: {str(e)}")
             QMessageBox.critical(self, "Erreur", str(e))
 
+    def create_sig_geopackage(self, export_folder, files):
+        if not files:
+            raise ValueError("Aucune table stations_nb_depassements_NQE_CMA_<année>.csv dans le dossier d'export.")
+        gpkg_path = os.path.join(export_folder, NAIADES_GPKG_FILE)
+
+        # Les couches d'un précédent export verrouillent le fichier : on les retire du projet avant de le réécrire
+        for layer in list(QgsProject.instance().mapLayers().values()):
+            if os.path.normcase(layer.source().split('|')[0]) == os.path.normcase(gpkg_path):
+                QgsProject.instance().removeMapLayer(layer.id())
+
+        # Lecture typée des tables en parallèle, puis écriture de toutes les années en une transaction
+        with ThreadPoolExecutor(max_workers=max(1, min(len(files), os.cpu_count() or 1))) as pool:
+            tables = list(pool.map(
+                lambda file: (file.replace(".csv", ""), read_naiades_year_table(os.path.join(export_folder, file))), files))
+        self.sig_log.append(f"{len(tables)} tables annuelles lues, écriture de {NAIADES_GPKG_FILE}...")
+        QApplication.processEvents()
+        counts = write_naiades_geopackage(tables, gpkg_path)
+
+        for layer_name, count in counts.items():
+            gpkg_layer = QgsVectorLayer(f"{gpkg_path}|layername={layer_name}", layer_name, "ogr")
+            QgsProject.instance().addMapLayer(gpkg_layer)
+            self.setup_thematic_analysis(gpkg_layer)
+            self.sig_log.append(f"Couche {layer_name} créée ({count} entités), ajoutée, et analyse thématique configurée.")
+            QApplication.processEvents()
+
     def setup_thematic_analysis(self, layer):
         try:
             # Diagramme en camembert pour NQE-MA
@@ -774,6 +1623,17 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
         graphs_group.setLayout(graphs_layout)
         layout.addWidget(graphs_group)
 
+        # Nombre de processus de rendu (1 : rendu dans QGIS, sans pool)
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Processus de rendu :"))
+        self.render_workers_spin = QSpinBox()
+        self.render_workers_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.render_workers_spin.setValue(max(1, (os.cpu_count() or 1) - 1))
+        workers_layout.addWidget(self.render_workers_spin)
+        self.full_regen_check = QCheckBox("Tout régénérer (ignorer le manifeste)")
+        workers_layout.addWidget(self.full_regen_check)
+        layout.addLayout(workers_layout)
+
         # Bouton générer graphiques
         btn_generate = QPushButton("Générer Graphiques")
         btn_generate.clicked.connect(self.generate_graphs)
@@ -809,8 +1669,8 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
             if not os.access(folder, os.W_OK):
                 raise PermissionError(f"Pas de permission d'écriture dans le dossier {folder}.")
 
-            # Charger Analyses.csv
-            df_analyses = pd.read_csv(os.path.join(folder, "Analyses.csv"), sep=';', encoding='utf8', low_memory=False)
+            # Charger Analyses.csv (ou la tranche de la base locale)
+            df_analyses = self.read_analyses(folder, self.graphs_log.append)
             self.graphs_log.append("Analyses lues.")
             self.graphs_progress.setValue(10)
 
@@ -859,15 +1719,8 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
                         self.graphs_log.append(f"Ignorer fichier {file}: année {year} non valide.")
                         continue
                     try:
-                        df_year = pd.read_csv(os.path.join(folder, file), sep=';')
-                        # Convertir CdParametre et CdStationMesureEauxSurface en int64 dans df_year
-                        df_year = df_year.dropna(subset=['CdParametre', 'CdStationMesureEauxSurface'])
-                        try:
-                            df_year['CdParametre'] = pd.to_numeric(df_year['CdParametre'], errors='coerce').astype('Int64')
-                            df_year['CdStationMesureEauxSurface'] = pd.to_numeric(df_year['CdStationMesureEauxSurface'], errors='coerce').astype('Int64')
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de la conversion des types dans {file}: {str(e)}")
-                            raise
+                        # Lecture typée : codes en Int64, codes départements et communes avec leurs zéros initiaux
+                        df_year = read_naiades_year_table(os.path.join(folder, file))
                         invalid_year_rows = df_year[df_year['CdParametre'].isna() | df_year['CdStationMesureEauxSurface'].isna()]
                         if not invalid_year_rows.empty:
                             self.graphs_log.append(f"Avertissement: {len(invalid_year_rows)} lignes non valides dans {file} supprimées.")
@@ -880,308 +1733,72 @@ class ImportNaïadesPesticidesEtatsEcoDialog(QDialog):
                 raise ValueError("Aucun fichier annuel valide trouvé.")
             self.graphs_progress.setValue(30)
 
-            # Construction de Dico_dpt_year pour toutes les années
-            Dico_dpt_year = {}
-            for key in dico_dataframe.keys():
-                df = dico_dataframe[key][0].copy()
-                year = dico_dataframe[key][1]
-                liste_id = ['CdParametre', 'LbLongParamètre', 'CdStationMesureEauxSurface', 'LbStationMesureEauxSurface']
-                liste_dpt = df['CodeDepartement'].unique()
-                for departement in liste_dpt:
-                    if pd.isna(departement):
-                        self.graphs_log.append(f"Département {departement} ignoré (valeur manquante).")
-                        continue
-                    key_D = f"{departement}_{year}"
-                    Dico_dpt_year[key_D] = [departement, year, {}]
-                    dff = df[df['CodeDepartement'] == departement]
-                    if dff.empty:
-                        self.graphs_log.append(f"Aucune donnée pour le département {departement} en {year}.")
-                        continue
-                    # Fusion avec types harmonisés
-                    dff2 = pd.merge(df_analyses_LQ, dff, on=liste_id, how='inner')
-                    dff2 = dff2.drop_duplicates()
-                    dff3 = dff2.set_index(['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre'])
-                    dff3 = pd.DataFrame(dff3.to_records()).drop_duplicates()
-                    dff3 = dff3[['CdStationMesureEauxSurface', 'LbStationMesureEauxSurface', 'CdParametre', 'LbLongParamètre', 'Annee', 'DateAna', 'RsAna', 'NQE-MA', 'NQE-CMA']]
-
-                    liste_station = dff['CdStationMesureEauxSurface'].unique()
-                    liste_produit = dff['CdParametre'].unique()
-                    Dico_stations_produits = {}
-                    for sta in liste_station:
-                        ds = dff3[dff3['CdStationMesureEauxSurface'] == sta]
-                        if len(ds) == 0:
-                            self.graphs_log.append(f"Aucune donnée pour la station {sta}.")
-                            continue
-                        nom_station = ds['LbStationMesureEauxSurface'].unique()[0] if len(ds['LbStationMesureEauxSurface'].unique()) > 0 else f"Station_{sta}"
-                        for prod in liste_produit:
-                            dp = ds[ds['CdParametre'] == prod]
-                            if len(dp) == 0:
-                                self.graphs_log.append(f"Aucune donnée pour la station {sta}, produit {prod}.")
-                                continue
-                            nom_produit = dp['LbLongParamètre'].unique()[0] if len(dp['LbLongParamètre'].unique()) > 0 else f"Produit_{prod}"
-                            Dico_prod_year = {}
-                            for y in liste_annees:
-                                dpyear = dp[dp['Annee'] == y]
-                                if len(dpyear) > 0:
-                                    Dico_prod_year[y] = [dpyear]
-                            Dico_stations_produits[f"{sta}_{prod}"] = [sta, nom_station, prod, nom_produit, Dico_prod_year]
-                            # Export CSV par station-produit
-                            titre_csv = f"Departement_{departement}_Station_{nom_station}_{sta}_et_produit_{nom_produit}_{prod}.csv"
-                            try:
-                                dp.to_csv(os.path.join(folder, titre_csv), sep=';', index=False, encoding='utf8')
-                                self.graphs_log.append(f"CSV exporté: {titre_csv}")
-                            except Exception as e:
-                                self.graphs_log.append(f"Erreur lors de l'export CSV {titre_csv}: {str(e)}")
-                        Dico_dpt_year[key_D][2] = Dico_stations_produits
+            # Index station-substance : une seule partition des analyses, paires absentes jamais tentées
+            index = naiades_graph_index(df_analyses_LQ, dico_dataframe, liste_annees, log=self.graphs_log.append)
+            if not index:
+                raise ValueError("Aucune paire station-substance valide trouvée pour générer les graphiques.")
+            graph_types = [name for name in NAIADES_GRAPH_TYPES if self.graph_types[name].isChecked()]
+
+            # Manifeste : seules les paires dont la tranche a changé sont réexportées et redessinées
+            manifest = {} if self.full_regen_check.isChecked() else load_naiades_manifest(folder)
+            paires = {}
+            a_rendre = []
+            for entry in index:
+                key = naiades_pair_key(entry)
+                entry['hash'] = naiades_slice_hash(entry['slice'])
+                if naiades_pair_is_current(folder, manifest.get(key), entry['hash'], graph_types):
+                    paires[key] = manifest[key]
+                    continue
+                # Export CSV par station-produit
+                titre_csv = f"Departement_{entry['dpt']}_Station_{entry['nom_sta']}_{entry['sta']}_et_produit_{entry['nom_pro']}_{entry['prod']}.csv"
+                try:
+                    entry['slice'].to_csv(os.path.join(folder, titre_csv), sep=';', index=False, encoding='utf8')
+                    self.graphs_log.append(f"CSV exporté: {titre_csv}")
+                    entry['csv'] = titre_csv
+                except Exception as e:
+                    self.graphs_log.append(f"Erreur lors de l'export CSV {titre_csv}: {str(e)}")
+                a_rendre.append(entry)
 
             self.graphs_progress.setValue(40)
-            self.graphs_log.append("Dico_dpt_year construit.")
-
-            # Dictionnaire des couleurs par année
-            Dico_color_year = {
-                '2020': 'black', '2019': 'red', '2018': 'orange', '2017': 'yellow', '2016': 'purple',
-                '2015': 'pink', '2014': 'limegreen', '2013': 'blue', '2021': 'green', '2022': 'cyan',
-                '2023': 'magenta', '2024': 'brown', '2025': 'darkblue'
-            }
+            unchanged_pairs = len(index) - len(a_rendre)
+            self.graphs_log.append(f"Index station-substance construit ({len(index)} paires, {unchanged_pairs} inchangées).")
 
             # Génération des graphiques
-            total_pairs = sum(len(Dico_dpt_year[key_D][2]) for key_D in Dico_dpt_year)
-            if total_pairs == 0:
-                raise ValueError("Aucune paire station-substance valide trouvée pour générer les graphiques.")
+            total_pairs = len(a_rendre)
             processed_pairs = 0
+            workers = self.render_workers_spin.value()
+            if total_pairs:
+                self.graphs_log.append(f"Rendu des graphiques sur {workers} processus.")
 
-            # (Code jusqu'à la boucle for key_dpt in Dico_dpt_year.keys() inchangé, voir réponse précédente)
-
-            for key_dpt in Dico_dpt_year.keys():
-                dpt = Dico_dpt_year[key_dpt][0]
-                year = Dico_dpt_year[key_dpt][1]
-                dico_dpt = Dico_dpt_year[key_dpt][2]
-
-                for key_sta_pro in dico_dpt.keys():
-                    sta = dico_dpt[key_sta_pro][0]
-                    nom_sta = dico_dpt[key_sta_pro][1]
-                    prod = dico_dpt[key_sta_pro][2]
-                    nom_pro = dico_dpt[key_sta_pro][3]
-                    dico_sta_pro = dico_dpt[key_sta_pro][4]
-
-                    # Préparer les données pour les graphiques
-                    has_data = False
-                    max_rs_ana = 0
-                    months = range(1, 13)
-                    ma_values = []
-                    cma_values = []
-                    labels = []
-                    colors = []
-                    has_monthly_data = False
-                    all_years_data = []
-
-                    for y in dico_sta_pro.keys():
-                        dpyear = dico_sta_pro[y][0]
-                        if dpyear.empty:
-                            self.graphs_log.append(f"Données vides pour station {sta}, produit {prod}, année {y}")
-                            continue
-                        if dpyear['RsAna'].isna().all() or dpyear['DateAna'].isna().all():
-                            self.graphs_log.append(f"Données invalides (RsAna ou DateAna manquants) pour station {sta}, produit {prod}, année {y}")
-                            continue
-                        dpyear['Month'] = pd.to_datetime(dpyear['DateAna'], errors='coerce').dt.month
-                        if dpyear['Month'].isna().all():
-                            self.graphs_log.append(f"Mois invalides pour station {sta}, produit {prod}, année {y}")
-                            continue
-                        has_data = True
-                        if dpyear['RsAna'].max() > max_rs_ana:
-                            max_rs_ana = dpyear['RsAna'].max()
-                        depass_ma = dpyear[dpyear['RsAna'] > dpyear['NQE-MA']].groupby('Month').size().reindex(months, fill_value=0)
-                        depass_cma = dpyear[dpyear['RsAna'] > dpyear['NQE-CMA']].groupby('Month').size().reindex(months, fill_value=0)
-                        if depass_ma.sum() > 0 or depass_cma.sum() > 0:
-                            has_monthly_data = True
-                        ma_values.append(depass_ma.to_numpy())  # Convertir en NumPy explicitement
-                        cma_values.append(depass_cma.to_numpy())  # Convertir en NumPy explicitement
-                        labels.extend([f"{y} MA", f"{y} CMA"])
-                        colors.extend([Dico_color_year.get(y, 'gray'), Dico_color_year.get(y, 'gray')])
-                        all_years_data.append(dpyear)
-
-                    if not has_data:
-                        self.graphs_log.append(f"Aucune donnée valide pour générer les graphiques pour station {sta}, produit {prod}")
+            # Rendu réparti sur plusieurs processus, progression remontée à chaque paire terminée
+            try:
+                for entry, resultat in iter_naiades_renders(a_rendre, folder, graph_types, workers):
+                    for message in resultat['messages']:
+                        self.graphs_log.append(message)
+                    if entry is None:
                         continue
-
-                    # Concaténer toutes les données pour les graphiques combinés
-                    combined_data = pd.concat(all_years_data)
-
-                    # Graphique 1: Évolution des concentrations
-                    if self.graph_types["Evolution"].isChecked():
-                        plt.figure(figsize=(10, 6))
-                        for y in dico_sta_pro.keys():
-                            dpyear = dico_sta_pro[y][0]
-                            if dpyear.empty or dpyear['RsAna'].isna().all() or dpyear['DateAna'].isna().all():
-                                continue
-                            color_year = Dico_color_year.get(y, 'gray')
-                            date_x = pd.to_datetime(dpyear['DateAna'], errors='coerce')
-                            rs_ana = dpyear['RsAna']
-                            if date_x.isna().all() or rs_ana.isna().all():
-                                continue
-                            plt.scatter(date_x, rs_ana, c=color_year, label=y, s=50)
-
-                        nqe_ma = combined_data['NQE-MA'].unique()[0] if not combined_data.empty else 0
-                        nqe_cma = combined_data['NQE-CMA'].unique()[0] if not combined_data.empty else 0
-                        if pd.notna(nqe_ma) and nqe_ma != 9999:
-                            plt.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
-                        if pd.notna(nqe_cma) and nqe_cma != 9999:
-                            plt.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
-
-                        if pd.notna(max_rs_ana) and max_rs_ana > 0:
-                            plt.ylim(0, max_rs_ana * 1.1)
-                        else:
-                            plt.ylim(0, 1)
-
-                        plt.title(f"Département: {dpt} Station: {nom_sta} ({sta})\nProduit: {nom_pro} ({prod}) - Évolution Concentrations")
-                        plt.xlabel("Date")
-                        plt.ylabel("Concentrations (µg/L)")
-                        plt.legend()
-                        plt.grid(True)
-                        plt.tight_layout()
-
-                        titre = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Evolution.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre))
-                            self.graphs_log.append(f"Graphique évolution exporté: {titre}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre}: {str(e)}")
-                        plt.close()
-
-                    # Graphique 2: Dépassements mensuels
-                    if self.graph_types["Mensuel"].isChecked() and has_monthly_data:
-                        plt.figure(figsize=(10, 6))
-                        ma_values = np.array(ma_values)
-                        cma_values = np.array(cma_values)
-                        bottom = np.zeros(len(months))
-                        for i, (ma, cma, year) in enumerate(zip(ma_values, cma_values, dico_sta_pro.keys())):
-                            color_year = Dico_color_year.get(year, 'gray')
-                            plt.bar(months, ma, bottom=bottom, color=color_year, label=f"{year} MA")
-                            bottom += ma
-                            plt.bar(months, cma, bottom=bottom, color=color_year, alpha=0.5, label=f"{year} CMA")
-                            bottom += cma
-
-                        plt.title(f"Département: {dpt} Station: {nom_sta} ({sta})\nProduit: {nom_pro} ({prod}) - Dépassements Mensuels")
-                        plt.xlabel("Mois")
-                        plt.ylabel("Nombre de Dépassements")
-                        plt.xticks(months, ['Jan', 'Fev', 'Mar', 'Avr', 'Mai', 'Juin', 'Juil', 'Aou', 'Sep', 'Oct', 'Nov', 'Dec'])
-                        plt.legend()
-                        plt.grid(True, axis='y')
-                        plt.tight_layout()
-
-                        titre_month = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Mensuel.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre_month))
-                            self.graphs_log.append(f"Graphique mensuel exporté: {titre_month}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre_month}: {str(e)}")
-                        plt.close()
-
-                    # Graphique 3: Heatmap des dépassements mensuels
-                    if self.graph_types["Heatmap"].isChecked() and has_monthly_data:
-                        monthly_data = pd.pivot_table(combined_data, index='Annee', columns='Month', values='RsAna', aggfunc='count', fill_value=0)
-                        fig, ax = plt.subplots(figsize=(10, 6))
-                        cax = ax.imshow(monthly_data.to_numpy(), cmap='YlOrRd', norm=mcolors.LogNorm(vmin=1, vmax=monthly_data.max().max() + 1))
-                        ax.set_xticks(range(12))
-                        ax.set_xticklabels(['Jan', 'Fev', 'Mar', 'Avr', 'Mai', 'Juin', 'Juil', 'Aou', 'Sep', 'Oct', 'Nov', 'Dec'])
-                        ax.set_yticks(range(len(monthly_data.index)))
-                        ax.set_yticklabels(monthly_data.index)
-                        plt.colorbar(cax, label='Nombre de Dépassements')
-                        plt.title(f"Département: {dpt} Station: {nom_sta} - Heatmap Dépassements Mensuels")
-                        titre_heatmap = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Heatmap.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre_heatmap))
-                            self.graphs_log.append(f"Graphique heatmap exporté: {titre_heatmap}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre_heatmap}: {str(e)}")
-                        plt.close()
-
-                    # Graphique 4: Boxplot de la variabilité mensuelle
-                    if self.graph_types["Boxplot"].isChecked() and has_data:
-                        plt.figure(figsize=(10, 6))
-                        combined_data.boxplot(column='RsAna', by='Month', ax=plt.gca())
-                        plt.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
-                        plt.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
-                        plt.title(f"Département: {dpt} Station: {nom_sta} - Variabilité Mensuelle des Concentrations")
-                        plt.xlabel("Mois")
-                        plt.ylabel("Concentrations (µg/L)")
-                        plt.legend()
-                        plt.suptitle('')
-                        titre_boxplot = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Boxplot.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre_boxplot))
-                            self.graphs_log.append(f"Graphique boxplot exporté: {titre_boxplot}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre_boxplot}: {str(e)}")
-                        plt.close()
-
-                    # Graphique 5: Ligne de tendance (moyenne mobile)
-                    if self.graph_types["Tendance"].isChecked() and has_data:
-                        plt.figure(figsize=(10, 6))
-                        dpyear_sorted = combined_data.sort_values('DateAna')
-                        rolling_mean = dpyear_sorted['RsAna'].rolling(window=5, min_periods=1).mean().to_numpy()  # Convertir en NumPy
-                        plt.plot(pd.to_datetime(dpyear_sorted['DateAna']).to_numpy(), rolling_mean, color='black', linestyle='-', linewidth=2, label='Moyenne Mobile')
-                        plt.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
-                        plt.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
-                        plt.title(f"Département: {dpt} Station: {nom_sta} - Tendance des Concentrations")
-                        plt.xlabel("Date")
-                        plt.ylabel("Concentrations (µg/L)")
-                        plt.legend()
-                        plt.grid(True)
-                        plt.tight_layout()
-                        titre_tendance = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Tendance.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre_tendance))
-                            self.graphs_log.append(f"Graphique ligne de tendance exporté: {titre_tendance}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre_tendance}: {str(e)}")
-                        plt.close()
-
-                    # Graphique 6: Histogramme cumulatif
-                    if self.graph_types["Cumulatif"].isChecked() and has_monthly_data:
-                        plt.figure(figsize=(10, 6))
-                        ma_values = np.array(ma_values)
-                        cma_values = np.array(cma_values)
-                        bottom = np.zeros(len(months))
-                        for i, (ma, cma, year) in enumerate(zip(ma_values, cma_values, dico_sta_pro.keys())):
-                            color_year = Dico_color_year.get(year, 'gray')
-                            plt.bar(months, ma, bottom=bottom, color=color_year, label=f"{year} MA")
-                            bottom += ma
-                            plt.bar(months, cma, bottom=bottom, color=color_year, alpha=0.5, label=f"{year} CMA")
-                            bottom += cma
-                        ax1 = plt.gca()
-                        ax2 = ax1.twinx()
-                        # Conversion explicite en NumPy pour éviter l'erreur d'indexation
-                        ma_sum = np.sum(ma_values, axis=0)
-                        cma_sum = np.sum(cma_values, axis=0)
-                        cum_ma = np.cumsum(ma_sum) / ma_sum.sum() * 100 if ma_sum.sum() > 0 else np.zeros(len(months))
-                        cum_cma = np.cumsum(cma_sum) / cma_sum.sum() * 100 if cma_sum.sum() > 0 else np.zeros(len(months))
-                        ax2.plot(months, cum_ma, color='blue', linestyle='--', label='Cumul MA (%)')
-                        ax2.plot(months, cum_cma, color='red', linestyle='--', label='Cumul CMA (%)')
-                        ax2.set_ylabel('Pourcentage Cumulatif')
-                        ax1.set_title(f"Département: {dpt} Station: {nom_sta} - Dépassements Mensuels et Cumulatifs")
-                        ax1.set_xlabel("Mois")
-                        ax1.set_ylabel("Nombre de Dépassements")
-                        ax1.set_xticks(months)
-                        ax1.set_xticklabels(['Jan', 'Fev', 'Mar', 'Avr', 'Mai', 'Juin', 'Juil', 'Aou', 'Sep', 'Oct', 'Nov', 'Dec'])
-                        ax1.legend(loc='upper left')
-                        ax2.legend(loc='upper right')
-                        ax1.grid(True, axis='y')
-                        plt.tight_layout()
-                        titre_cumulatif = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}_Cumulatif.png"
-                        try:
-                            plt.savefig(os.path.join(folder, titre_cumulatif))
-                            self.graphs_log.append(f"Graphique cumulatif exporté: {titre_cumulatif}")
-                        except Exception as e:
-                            self.graphs_log.append(f"Erreur lors de l'export du graphique {titre_cumulatif}: {str(e)}")
-                        plt.close()
-
                     processed_pairs += 1
                     self.graphs_progress.setValue(40 + int(60 * processed_pairs / total_pairs))
+                    # Une paire en erreur n'est pas inscrite : elle sera reprise au prochain lancement
+                    if entry.get('csv') and not resultat['erreurs']:
+                        key = naiades_pair_key(entry)
+                        record = manifest.get(key) if not self.full_regen_check.isChecked() else None
+                        graphiques = set(graph_types)
+                        fichiers = {entry['csv']} | set(resultat['fichiers'])
+                        if record is not None and record.get("hash") == entry['hash']:
+                            graphiques |= set(record.get("graphiques", []))
+                            fichiers |= set(record.get("fichiers", []))
+                        paires[key] = {"hash": entry['hash'], "graphiques": sorted(graphiques), "fichiers": sorted(fichiers)}
+                    QApplication.processEvents()
+            finally:
+                try:
+                    save_naiades_manifest(folder, paires)
+                except OSError as e:
+                    self.graphs_log.append(f"Manifeste non écrit : {str(e)}")
 
             self.graphs_progress.setValue(100)
-            self.graphs_log.append(f"Graphiques générés pour {processed_pairs} paires station-substance.")
-            QMessageBox.information(self, "Succès", f"Graphiques générés pour {processed_pairs} paires. Fichiers PNG exportés dans le dossier.")
+            self.graphs_log.append(f"Graphiques générés pour {processed_pairs} paires station-substance, {unchanged_pairs} paires inchangées ignorées.")
+            QMessageBox.information(self, "Succès", f"Graphiques générés pour {processed_pairs} paires ({unchanged_pairs} inchangées). Fichiers PNG exportés dans le dossier.")
         except Exception as e:
             self.graphs_log.append(f"Erreur: {str(e)}")
-            QMessageBox.critical(self, "Erreur", str(e))
\ No newline at end of file
+            QMessageBox.critical(self, "Erreur", str(e))
\ No newline at end of file
@@ -0,0 +1,261 @@
+#TELECHARGEMENTS_Naiades_rendu_graphiques.py
+
+# Rendu des graphiques station-substance de l'outil Naïades. Le module n'importe ni Qt ni QGIS :
+# il est chargé tel quel par les processus de rendu lancés depuis le dialogue.
+
+import os
+import sys
+import multiprocessing
+import multiprocessing.spawn
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import matplotlib.colors as mcolors
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Mois affichés en abscisse des graphiques mensuels
+NAIADES_MOIS = ['Jan', 'Fev', 'Mar', 'Avr', 'Mai', 'Juin', 'Juil', 'Aou', 'Sep', 'Oct', 'Nov', 'Dec']
+# Couleur de chaque année sur les graphiques
+NAIADES_COULEURS_ANNEES = {
+    '2020': 'black', '2019': 'red', '2018': 'orange', '2017': 'yellow', '2016': 'purple',
+    '2015': 'pink', '2014': 'limegreen', '2013': 'blue', '2021': 'green', '2022': 'cyan',
+    '2023': 'magenta', '2024': 'brown', '2025': 'darkblue'
+}
+# Types de graphiques, dans l'ordre de rendu
+NAIADES_GRAPH_TYPES = ["Evolution", "Mensuel", "Heatmap", "Boxplot", "Tendance", "Cumulatif"]
+# Version du rendu, reprise dans le manifeste : à incrémenter si l'aspect des graphiques change
+NAIADES_RENDU_VERSION = 1
+
+# Figure réutilisée d'un graphique à l'autre dans un même processus
+_figure = None
+
+
+def naiades_figure():
+    """Figure Agg du processus, vidée avant chaque graphique : pas de registre pyplot, pas de fuite."""
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(_figure)
+    _figure.clear()
+    return _figure
+
+
+def naiades_resultat(messages=None, erreurs=0):
+    return {'messages': messages or [], 'fichiers': [], 'erreurs': erreurs}
+
+
+def save_figure(fig, folder, titre, libelle, resultat):
+    try:
+        fig.savefig(os.path.join(folder, titre))
+        resultat['messages'].append(f"Graphique {libelle} exporté: {titre}")
+        resultat['fichiers'].append(titre)
+    except Exception as e:
+        resultat['messages'].append(f"Erreur lors de l'export du graphique {titre}: {str(e)}")
+        resultat['erreurs'] += 1
+    fig.clear()
+
+
+def norme_definie(valeur):
+    return valeur is not None and not (isinstance(valeur, float) and np.isnan(valeur))
+
+
+def draw_monthly_bars(ax, entry):
+    months = range(1, 13)
+    bottom = np.zeros(12)
+    for ma, cma, year in zip(entry['ma'], entry['cma'], entry['years']):
+        color_year = NAIADES_COULEURS_ANNEES.get(year, 'gray')
+        ax.bar(months, ma, bottom=bottom, color=color_year, label=f"{year} MA")
+        bottom += ma
+        ax.bar(months, cma, bottom=bottom, color=color_year, alpha=0.5, label=f"{year} CMA")
+        bottom += cma
+    ax.set_xticks(months)
+    ax.set_xticklabels(NAIADES_MOIS)
+
+
+def render_naiades_pair(entry, folder, graph_types):
+    """Rend les graphiques demandés d'une entrée de l'index station-substance.
+
+    Renvoie les messages du log, les fichiers écrits et le nombre d'exports en échec.
+    """
+    resultat = naiades_resultat()
+    dpt, sta, prod = entry['dpt'], entry['sta'], entry['prod']
+    nom_sta, nom_pro = entry['nom_sta'], entry['nom_pro']
+    nqe_ma, nqe_cma = entry['nqe_ma'], entry['nqe_cma']
+    prefixe = f"Departement_{dpt}_Station_{nom_sta}_{sta}_Produit_{nom_pro}_{prod}"
+    months = range(1, 13)
+
+    # Graphique 1: Évolution des concentrations
+    if "Evolution" in graph_types:
+        fig = naiades_figure()
+        ax = fig.add_subplot()
+        for y, date_x, rs_ana in zip(entry['years'], entry['dates'], entry['values']):
+            ax.scatter(date_x, rs_ana, c=NAIADES_COULEURS_ANNEES.get(y, 'gray'), label=y, s=50)
+        if norme_definie(nqe_ma) and nqe_ma != 9999:
+            ax.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
+        if norme_definie(nqe_cma) and nqe_cma != 9999:
+            ax.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
+        max_rs_ana = entry['max_rs']
+        ax.set_ylim(0, max_rs_ana * 1.1 if norme_definie(max_rs_ana) and max_rs_ana > 0 else 1)
+        ax.set_title(f"Département: {dpt} Station: {nom_sta} ({sta})\nProduit: {nom_pro} ({prod}) - Évolution Concentrations")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Concentrations (µg/L)")
+        ax.legend()
+        ax.grid(True)
+        fig.tight_layout()
+        save_figure(fig, folder, f"{prefixe}_Evolution.png", "évolution", resultat)
+
+    # Graphique 2: Dépassements mensuels
+    if "Mensuel" in graph_types and entry['has_monthly']:
+        fig = naiades_figure()
+        ax = fig.add_subplot()
+        draw_monthly_bars(ax, entry)
+        ax.set_title(f"Département: {dpt} Station: {nom_sta} ({sta})\nProduit: {nom_pro} ({prod}) - Dépassements Mensuels")
+        ax.set_xlabel("Mois")
+        ax.set_ylabel("Nombre de Dépassements")
+        ax.legend()
+        ax.grid(True, axis='y')
+        fig.tight_layout()
+        save_figure(fig, folder, f"{prefixe}_Mensuel.png", "mensuel", resultat)
+
+    # Graphique 3: Heatmap des dépassements mensuels
+    if "Heatmap" in graph_types and entry['has_monthly']:
+        fig = naiades_figure()
+        ax = fig.add_subplot()
+        monthly_data = entry['counts']
+        cax = ax.imshow(monthly_data, cmap='YlOrRd', norm=mcolors.LogNorm(vmin=1, vmax=monthly_data.max() + 1))
+        ax.set_xticks(range(12))
+        ax.set_xticklabels(NAIADES_MOIS)
+        ax.set_yticks(range(len(entry['years'])))
+        ax.set_yticklabels(entry['years'])
+        fig.colorbar(cax, ax=ax, label='Nombre de Dépassements')
+        ax.set_title(f"Département: {dpt} Station: {nom_sta} - Heatmap Dépassements Mensuels")
+        save_figure(fig, folder, f"{prefixe}_Heatmap.png", "heatmap", resultat)
+
+    # Graphique 4: Boxplot de la variabilité mensuelle
+    if "Boxplot" in graph_types and entry['box']:
+        fig = naiades_figure()
+        ax = fig.add_subplot()
+        ax.boxplot(list(entry['box'].values()))
+        ax.set_xticks(range(1, len(entry['box']) + 1))
+        ax.set_xticklabels(list(entry['box'].keys()))
+        ax.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
+        ax.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
+        ax.set_title(f"Département: {dpt} Station: {nom_sta} - Variabilité Mensuelle des Concentrations")
+        ax.set_xlabel("Mois")
+        ax.set_ylabel("Concentrations (µg/L)")
+        ax.legend()
+        ax.grid(True)
+        save_figure(fig, folder, f"{prefixe}_Boxplot.png", "boxplot", resultat)
+
+    # Graphique 5: Ligne de tendance (moyenne mobile)
+    if "Tendance" in graph_types:
+        fig = naiades_figure()
+        ax = fig.add_subplot()
+        ax.plot(entry['trend_dates'], entry['trend_values'], color='black', linestyle='-', linewidth=2, label='Moyenne Mobile')
+        ax.axhline(y=nqe_ma, linestyle='--', color='blue', label='NQE-MA')
+        ax.axhline(y=nqe_cma, linestyle='--', color='red', label='NQE-CMA')
+        ax.set_title(f"Département: {dpt} Station: {nom_sta} - Tendance des Concentrations")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Concentrations (µg/L)")
+        ax.legend()
+        ax.grid(True)
+        fig.tight_layout()
+        save_figure(fig, folder, f"{prefixe}_Tendance.png", "ligne de tendance", resultat)
+
+    # Graphique 6: Histogramme cumulatif
+    if "Cumulatif" in graph_types and entry['has_monthly']:
+        fig = naiades_figure()
+        ax1 = fig.add_subplot()
+        draw_monthly_bars(ax1, entry)
+        ax2 = ax1.twinx()
+        ma_sum = np.sum(entry['ma'], axis=0)
+        cma_sum = np.sum(entry['cma'], axis=0)
+        cum_ma = np.cumsum(ma_sum) / ma_sum.sum() * 100 if ma_sum.sum() > 0 else np.zeros(12)
+        cum_cma = np.cumsum(cma_sum) / cma_sum.sum() * 100 if cma_sum.sum() > 0 else np.zeros(12)
+        ax2.plot(months, cum_ma, color='blue', linestyle='--', label='Cumul MA (%)')
+        ax2.plot(months, cum_cma, color='red', linestyle='--', label='Cumul CMA (%)')
+        ax2.set_ylabel('Pourcentage Cumulatif')
+        ax1.set_title(f"Département: {dpt} Station: {nom_sta} - Dépassements Mensuels et Cumulatifs")
+        ax1.set_xlabel("Mois")
+        ax1.set_ylabel("Nombre de Dépassements")
+        ax1.legend(loc='upper left')
+        ax2.legend(loc='upper right')
+        ax1.grid(True, axis='y')
+        fig.tight_layout()
+        save_figure(fig, folder, f"{prefixe}_Cumulatif.png", "cumulatif", resultat)
+
+    return resultat
+
+
+def naiades_python_executable():
+    """Interpréteur à lancer pour les processus de rendu, ou None s'il est introuvable.
+
+    Dans QGIS, sys.executable désigne souvent l'application (qgis-bin.exe, qgis) et non Python.
+    """
+    executable = sys.executable
+    if executable and os.path.basename(executable).lower().startswith('python'):
+        return executable
+    for dossier in (sys.exec_prefix, os.path.join(sys.exec_prefix, 'bin')):
+        for nom in ('python.exe', 'python3', 'python'):
+            candidat = os.path.join(dossier, nom)
+            if os.path.isfile(candidat):
+                return candidat
+    return None
+
+
+def iter_naiades_renders(entries, folder, graph_types, workers):
+    """Rend les entrées et renvoie au fil de l'eau (entrée, résultat), dans l'ordre d'achèvement.
+
+    Les paires sont réparties sur `workers` processus ; si le pool ne démarre pas ou s'interrompt,
+    les paires restantes sont rendues dans le processus courant (entrée None : message d'information).
+    Au plus 2 × `workers` rendus sont soumis à la fois : si l'appelant abandonne le générateur (annulation,
+    exception), la fermeture n'attend que les rendus en cours, sans bloquer QGIS sur toute la file.
+    """
+    graph_types = set(graph_types)
+    restantes = dict(enumerate(entries))
+    executable = naiades_python_executable()
+    if workers > 1 and len(restantes) > 1 and executable:
+        # spawn partout : un fork du processus QGIS dupliquerait ses threads Qt
+        context = multiprocessing.get_context('spawn')
+        # L'interpréteur de spawn est un réglage global du module multiprocessing : il est rétabli
+        # dès la fermeture du pool, les processus pouvant être lancés à la demande jusque-là
+        previous_executable = multiprocessing.spawn.get_executable()
+        pool = None
+        try:
+            context.set_executable(executable)
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(restantes)), mp_context=context)
+            a_soumettre = iter(list(restantes.items()))
+            futures = {}
+
+            def soumettre():
+                for i, entry in islice(a_soumettre, max(0, 2 * workers - len(futures))):
+                    futures[pool.submit(render_naiades_pair, {k: v for k, v in entry.items() if k != 'slice'},
+                                        folder, graph_types)] = i
+
+            soumettre()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    try:
+                        resultat = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        resultat = naiades_resultat(
+                            [f"Erreur de rendu pour station {restantes[i]['sta']}, produit {restantes[i]['prod']}: {str(e)}"], 1)
+                    yield restantes.pop(i), resultat
+                soumettre()
+        except (BrokenProcessPool, OSError) as e:
+            yield None, naiades_resultat(
+                [f"Pool de rendu interrompu ({str(e)}), rendu séquentiel des {len(restantes)} paires restantes."])
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            context.set_executable(previous_executable)
+    for i in list(restantes):
+        entry = restantes.pop(i)
+        yield entry, render_naiades_pair(entry, folder, graph_types)
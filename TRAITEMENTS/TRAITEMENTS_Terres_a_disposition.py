@@ -1,17 +1,412 @@
 # Fichier : TRAITEMENTS_Terres_a_disposition.py
 import os
+import re
+import time
+import sqlite3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 import pandas as pd
 from qgis.core import (
     QgsVectorLayer, QgsFeatureRequest, QgsFeature, QgsGeometry,
-    QgsVectorFileWriter, QgsProject, QgsField, QgsFields, QgsVectorDataProvider
+    QgsVectorFileWriter, QgsProject, QgsField, QgsFields, QgsVectorDataProvider,
+    QgsSpatialIndex, QgsProviderRegistry, QgsApplication, QgsFeatureSource
 )
 from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QTabWidget, QWidget, QTextEdit, QLabel, QLineEdit,
-    QPushButton, QFileDialog, QMessageBox, QFormLayout, QProgressBar, QTextBrowser,QHBoxLayout
+    QPushButton, QFileDialog, QMessageBox, QFormLayout, QProgressBar, QTextBrowser,QHBoxLayout,
+    QSpinBox, QApplication
 )
 from qgis.PyQt.QtGui import QRegExpValidator, QColor
 from qgis.PyQt.QtCore import Qt, QRegExp, QVariant
 
+# Index spatiaux en mémoire des couches non indexables sur disque, par (source, signature des fichiers)
+_memory_indexes = {}
+
+
+class CadastreIndex:
+    """Index R-tree des parcelles cadastrales touchant les emprises données (toute la couche sans emprise).
+
+    Seules les parcelles dont l'emprise touche l'une des emprises (celles des îlots) sont chargées en mémoire,
+    et non tout le rectangle qui les englobe. Les parcelles candidates sont celles dont l'emprise touche la
+    géométrie cherchée ; le test exact se fait ensuite sur la géométrie cherchée préparée, et seule
+    l'intersection finale est calculée par GEOS.
+    """
+
+    def __init__(self, layer, extents=None):
+        request = QgsFeatureRequest()
+        if extents is not None:
+            memory_index = memory_spatial_index(layer, build=False)
+            fids = set()
+            for extent in extents:
+                if memory_index is not None:
+                    # Couche sans index sur disque : candidates lues par identifiant plutôt que par un parcours complet
+                    fids.update(memory_index.intersects(extent))
+                else:
+                    fids.update(f.id() for f in layer.getFeatures(QgsFeatureRequest().setFilterRect(extent).setNoAttributes()))
+            request.setFilterFids(list(fids))
+        self.features = {}
+        self.index = QgsSpatialIndex()
+        for feature in layer.getFeatures(request):
+            if feature.hasGeometry():
+                self.features[feature.id()] = feature
+                self.index.addFeature(feature)
+
+    def intersecting(self, geom):
+        engine = QgsGeometry.createGeometryEngine(geom.constGet())
+        engine.prepareGeometry()
+        for fid in self.index.intersects(geom.boundingBox()):
+            feature = self.features[fid]
+            if engine.intersects(feature.geometry().constGet()):
+                yield feature
+
+
+# Attributs des îlots repris sur les terres en plus et les parcelles intersectées
+TERRES_ATTRIBUTS = ["PACAGE", "NUM_ILOT", "NUM_PARCEL", "SF_ADM_DE", "SF_ADM_CO"]
+# Fichier et couches de l'export par lot : un fichier horodaté par lot, jamais écrasé par le suivant
+TERRES_LOT_FILE = "terres_a_disposition_lot_{horodatage}.gpkg"
+TERRES_LOT_LAYERS = ("terres_plus", "parcelles_intersectees", "synthese_pacage")
+# Base de la table PACAGE → entités, dans le dossier de profil QGIS (les couches sont souvent sur un partage en lecture seule)
+TERRES_FID_CACHE_FILE = "terres_a_disposition_pacage_fid.sqlite"
+
+
+def terres_fields():
+    fields = QgsFields()
+    fields.append(QgsField("PACAGE", QVariant.String, len=10))
+    fields.append(QgsField("NUM_ILOT", QVariant.Int, len=5))
+    fields.append(QgsField("NUM_PARCEL", QVariant.Int, len=4))
+    fields.append(QgsField("SF_ADM_DE", QVariant.Double, len=10))
+    fields.append(QgsField("SF_ADM_CO", QVariant.Double, len=10))
+    return fields
+
+
+def terres_intersect_fields(cadastre_fields):
+    """Champs des parcelles intersectées : attributs P25, champs cadastraux, surface et identifiant."""
+    fields = terres_fields()
+    for field in cadastre_fields:
+        fields.append(field)
+    fields.append(QgsField("SF_INTERSECT", QVariant.Double, len=10, prec=2))
+    fields.append(QgsField("ID_PARCELLE", QVariant.Int, len=10))
+    return fields
+
+
+def terres_attributes(feature):
+    names = feature.fields().names()
+    return [feature[name] if name in names else None for name in TERRES_ATTRIBUTS]
+
+
+def terres_en_plus(p24_features, p25_features):
+    """Parties des îlots P25 absentes de P24 : liste de (attributs, géométrie) non vides.
+
+    Chaque îlot P25 n'est comparé qu'à l'union des îlots P24 dont l'emprise touche la sienne, et non à
+    l'union de toute l'exploitation. Les unions sont mémorisées par voisinage : les îlots voisins d'une même
+    zone partagent souvent les mêmes îlots P24.
+    """
+    p24_geoms = {}
+    p24_index = QgsSpatialIndex()
+    for i, p24_feature in enumerate(p24_features):
+        if p24_feature.hasGeometry():
+            p24_geoms[i] = p24_feature.geometry()
+            p24_index.addFeature(i, p24_geoms[i].boundingBox())
+    unions = {}
+    terres = []
+    for p25_feature in p25_features:
+        p25_geom = p25_feature.geometry()
+        voisins = frozenset(p24_index.intersects(p25_geom.boundingBox()))
+        if voisins and voisins not in unions:
+            unions[voisins] = (p24_geoms[next(iter(voisins))] if len(voisins) == 1
+                               else QgsGeometry.unaryUnion([p24_geoms[i] for i in voisins]))
+        # Sans voisin P24, toute la géométrie est en plus
+        diff_geom = p25_geom.difference(unions[voisins]) if voisins else p25_geom
+        if not diff_geom.isEmpty():
+            terres.append((terres_attributes(p25_feature), diff_geom))
+    return terres
+
+
+def parcelles_intersectees(terres, cadastre_index):
+    """Intersections non vides des terres en plus avec le cadastre : (attributs, parcelle, géométrie)."""
+    for attributs, diff_geom in terres:
+        for parcelle in cadastre_index.intersecting(diff_geom):
+            inter_geom = diff_geom.intersection(parcelle.geometry())
+            if not inter_geom.isEmpty():
+                yield attributs, parcelle, inter_geom
+
+
+def intersect_feature(fields, cadastre_fields, attributs, parcelle, inter_geom):
+    feature = QgsFeature(fields)
+    feature.setGeometry(inter_geom)
+    values = list(attributs) + [parcelle[field.name()] for field in cadastre_fields]
+    # Surface intersectée (en hectares) et ID de la parcelle cadastrale
+    feature.setAttributes(values + [inter_geom.area() / 10000, parcelle.id()])
+    return feature
+
+
+def parse_pacage_list(text):
+    """Numéros de PACAGE d'une saisie libre (virgules, espaces, retours à la ligne).
+
+    Renvoie les numéros valides sans doublon, dans l'ordre de saisie, et les entrées rejetées.
+    """
+    pacages, rejets = [], []
+    for item in text.replace(';', ' ').replace(',', ' ').split():
+        item = item.strip().strip('"\'')
+        if len(item) == 8 and item.isdigit():
+            item = "0" + item  # zéro initial perdu par un tableur
+        if len(item) == 9 and item.isdigit():
+            if item not in pacages:
+                pacages.append(item)
+        elif item:
+            rejets.append(item)
+    return pacages, rejets
+
+
+def read_pacage_csv(path):
+    """Numéros de PACAGE d'un CSV (séparateur ;, virgule ou tabulation) ou d'une liste d'un numéro par ligne.
+
+    Colonne PACAGE si la première ligne est un en-tête qui la nomme, sinon la première colonne, en-tête compris.
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        rows = [re.split(r"[;,\t]", line.strip()) for line in f if line.strip()]
+    column = 0
+    if rows:
+        header = [cell.strip().strip('"\'').upper() for cell in rows[0]]
+        if "PACAGE" in header:
+            column = header.index("PACAGE")
+            rows = rows[1:]
+    return parse_pacage_list(" ".join(row[column] for row in rows if len(row) > column))
+
+
+def features_par_pacage(layer, pacages, cache=None):
+    """Îlots des PACAGE demandés, regroupés par numéro.
+
+    Avec la table PACAGE → entités, seules les entités connues sont lues (accès direct par identifiant) ;
+    sinon le filtre est délégué au fournisseur OGR, qui s'appuie sur l'index attributaire PACAGE.
+    """
+    groupes = {pacage: [] for pacage in pacages}
+    request = QgsFeatureRequest()
+    names = [name for name in TERRES_ATTRIBUTS if name in layer.fields().names()]
+    request.setSubsetOfAttributes(names, layer.fields())
+    lookup = cache.fids(layer, pacages) if cache is not None else None
+    if lookup is not None:
+        fids = [fid for pacage in pacages for fid in lookup.get(pacage, [])]
+        if not fids:
+            return groupes
+        features = layer.getFeatures(request.setFilterFids(fids))
+    else:
+        liste = ", ".join(f"'{pacage}'" for pacage in pacages)
+        previous = layer.subsetString()
+        try:
+            if not layer.setSubsetString(f'"PACAGE" IN ({liste})'):
+                request.setFilterExpression(f"PACAGE IN ({liste})")
+            features = list(layer.getFeatures(request))
+        finally:
+            layer.setSubsetString(previous)
+    for feature in features:
+        groupes.setdefault(str(feature['PACAGE']), []).append(feature)
+    return groupes
+
+
+def quote_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def layer_file(layer):
+    """Chemin du fichier d'une couche OGR, sans les options (|layername=...)."""
+    return QgsProviderRegistry.instance().decodeUri("ogr", layer.source()).get('path') or layer.source().split('|')[0]
+
+
+def layer_signature(layer):
+    """Date de modification et taille des fichiers de la couche (.shp et .dbf), None si ce n'est pas un fichier."""
+    path = layer_file(layer)
+    files = [path]
+    if path.lower().endswith('.shp'):
+        files.append(os.path.splitext(path)[0] + '.dbf')
+    stats = [os.stat(f) for f in files if os.path.isfile(f)]
+    if not stats:
+        return None
+    return max(st.st_mtime for st in stats), sum(st.st_size for st in stats)
+
+
+def gpkg_table_name(layer, conn):
+    table = QgsProviderRegistry.instance().decodeUri("ogr", layer.source()).get('layerName')
+    if not table:
+        # Sans layername, OGR ouvre la première table d'entités du GeoPackage
+        row = conn.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1").fetchone()
+        table = row[0] if row else None
+    return table
+
+
+def has_pacage_index(layer):
+    """Présence d'un index attributaire sur PACAGE : fichiers .idm/.ind d'un shapefile, index SQLite d'un GeoPackage."""
+    path = layer_file(layer)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.shp':
+        base = os.path.splitext(path)[0]
+        return os.path.exists(base + '.idm') and os.path.exists(base + '.ind')
+    if extension == '.gpkg':
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            table = gpkg_table_name(layer, conn)
+            if not table:
+                return False
+            for index in conn.execute(f"PRAGMA index_list({quote_ident(table)})").fetchall():
+                columns = [row[2] for row in conn.execute(f"PRAGMA index_info({quote_ident(index[1])})")]
+                if columns and columns[0].upper() == "PACAGE":
+                    return True
+            return False
+        finally:
+            conn.close()
+    return False
+
+
+def ensure_pacage_index(layer, layer_name):
+    """Crée l'index attributaire PACAGE s'il manque ; renvoie le message du journal."""
+    if has_pacage_index(layer):
+        return f"✅ Index attributaire PACAGE déjà présent pour la couche {layer_name}."
+    provider = layer.dataProvider()
+    if not provider.capabilities() & QgsVectorDataProvider.CreateAttributeIndex:
+        return f"⚠️ Index attributaire PACAGE impossible pour la couche {layer_name} (format non supporté)."
+    if not os.access(os.path.dirname(layer_file(layer)) or '.', os.W_OK):
+        return f"⚠️ Index attributaire PACAGE impossible pour la couche {layer_name} (dossier en lecture seule)."
+    if provider.createAttributeIndex(layer.fields().indexOf("PACAGE")):
+        return f"✅ Index attributaire PACAGE créé pour la couche {layer_name}."
+    return f"⚠️ Échec de la création de l'index attributaire PACAGE pour la couche {layer_name}."
+
+
+def memory_spatial_index(layer, build=True):
+    """Index spatial en mémoire d'une couche, conservé pour la session tant que ses fichiers ne changent pas.
+
+    Avec build=False, renvoie seulement l'index déjà construit (ou None).
+    """
+    key = (layer.source(), layer_signature(layer))
+    index = _memory_indexes.get(key)
+    if index is None and build:
+        # Une seule version par source : les index des versions précédentes du fichier sont libérés
+        for old_key in [k for k in _memory_indexes if k[0] == key[0]]:
+            del _memory_indexes[old_key]
+        index = QgsSpatialIndex(layer.getFeatures(QgsFeatureRequest().setNoAttributes()))
+        _memory_indexes[key] = index
+    return index
+
+
+def ensure_spatial_index(layer, layer_name, memory_fallback=False):
+    """Vérifie l'index spatial d'une couche et ne le construit que s'il est absent ou périmé.
+
+    Un .qix plus ancien que son .shp est périmé. Si l'index ne peut pas être écrit à côté des données
+    (partage en lecture seule, format sans index), un index en mémoire le remplace avec `memory_fallback`,
+    réservé aux couches interrogées par emprise (le cadastre). Renvoie le message du journal.
+    """
+    path = layer_file(layer)
+    extension = os.path.splitext(path)[1].lower()
+    present = layer.hasSpatialIndex() == QgsFeatureSource.SpatialIndexPresent
+    qix = os.path.splitext(path)[0] + '.qix'
+    stale = present and extension == '.shp' and os.path.exists(qix) and os.path.getmtime(qix) < os.path.getmtime(path)
+    if present and not stale:
+        return f"✅ Index spatial déjà présent pour la couche {layer_name}."
+
+    raison = "périmé" if stale else "absent"
+    provider = layer.dataProvider()
+    writable = os.access(path if extension == '.gpkg' else (os.path.dirname(path) or '.'), os.W_OK)
+    if writable and provider.capabilities() & QgsVectorDataProvider.CreateSpatialIndex:
+        start = time.perf_counter()
+        if provider.createSpatialIndex():
+            return f"✅ Index spatial {raison}, construit pour la couche {layer_name} en {time.perf_counter() - start:.1f} s."
+
+    if not memory_fallback:
+        return f"⚠️ Index spatial {raison} et non enregistrable pour la couche {layer_name}."
+    if memory_spatial_index(layer, build=False) is not None:
+        return f"✅ Index spatial {raison} sur disque, index en mémoire déjà construit pour la couche {layer_name}."
+    start = time.perf_counter()
+    memory_spatial_index(layer)
+    return (f"⚠️ Index spatial {raison} et non enregistrable pour la couche {layer_name} : "
+            f"index en mémoire construit en {time.perf_counter() - start:.1f} s.")
+
+
+class PacageFidCache:
+    """Correspondance PACAGE → identifiants d'entités de chaque couche, conservée dans une base SQLite.
+
+    La table d'une couche est reconstruite, en une passe sans géométrie, dès que ses fichiers ont changé.
+    """
+
+    def __init__(self, path, log=None):
+        self.log = log
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fids (source TEXT, pacage TEXT, fid INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fids_source_pacage ON fids (source, pacage)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def rebuild(self, layer, signature):
+        source = layer.source()
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(["PACAGE"], layer.fields())
+        rows = ((source, str(f['PACAGE']), f.id()) for f in layer.getFeatures(request) if f['PACAGE'])
+        with self.conn:
+            self.conn.execute("DELETE FROM fids WHERE source = ?", (source,))
+            self.conn.executemany("INSERT INTO fids VALUES (?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, *signature))
+        if self.log:
+            self.log(f"🗂️ Table PACAGE → entités reconstruite pour {layer.name()}.")
+
+    def fids(self, layer, pacages):
+        """Identifiants des entités de chaque PACAGE, ou None si la couche n'est pas un fichier."""
+        signature = layer_signature(layer)
+        if signature is None:
+            return None
+        source = layer.source()
+        row = self.conn.execute("SELECT mtime, size FROM sources WHERE source = ?", (source,)).fetchone()
+        if row is None or tuple(row) != signature:
+            self.rebuild(layer, signature)
+        lookup = {}
+        pacages = list(pacages)
+        # Par tranches : SQLite limite le nombre de paramètres d'une requête
+        for start in range(0, len(pacages), 500):
+            chunk = pacages[start:start + 500]
+            query = f"SELECT pacage, fid FROM fids WHERE source = ? AND pacage IN ({', '.join('?' * len(chunk))})"
+            for pacage, fid in self.conn.execute(query, (source, *chunk)):
+                lookup.setdefault(pacage, []).append(fid)
+        return lookup
+
+
+def traiter_exploitation(pacage, p24_features, p25_features, cadastre_index):
+    """Calcul complet d'une exploitation à partir d'entités déjà lues : aucun accès aux couches ni à Qt."""
+    terres = terres_en_plus(p24_features, p25_features)
+    intersections = list(parcelles_intersectees(terres, cadastre_index)) if cadastre_index else []
+    return {
+        'pacage': pacage,
+        'nb_p24': len(p24_features),
+        'nb_p25': len(p25_features),
+        'terres': terres,
+        'intersections': intersections,
+        'sf_plus': sum(geom.area() for _, geom in terres) / 10000,
+        'sf_intersect': sum(geom.area() for _, _, geom in intersections) / 10000,
+    }
+
+
+def write_terres_geopackage(path, layers):
+    """Écrit les couches mémoire dans un seul GeoPackage et indexe le champ PACAGE de chacune."""
+    transform_context = QgsProject.instance().transformContext()
+    for i, layer in enumerate(layers):
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.fileEncoding = "UTF-8"
+        options.layerName = layer.name()
+        options.actionOnExistingFile = (QgsVectorFileWriter.CreateOrOverwriteFile if i == 0
+                                        else QgsVectorFileWriter.CreateOrOverwriteLayer)
+        error = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, transform_context, options)
+        if error[0] != QgsVectorFileWriter.NoError:
+            raise ValueError(f"Écriture de la couche {layer.name()} impossible : {error[1]}")
+    conn = sqlite3.connect(path)
+    try:
+        for layer in layers:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{layer.name()}_pacage" ON "{layer.name()}" (PACAGE)')
+        conn.commit()
+    finally:
+        conn.close()
+
+
 class TerresADispositionDialog(QDialog):
     def __init__(self, iface, parent=None):
         super(TerresADispositionDialog, self).__init__(parent)
@@ -50,6 +445,8 @@ class TerresADispositionDialog(QDialog):
         <p>- Couche P25 : W:\\2_DOSSIERS\\AGRICULTURE\\EXPLOITATION_ELEVAGE\\STRUCTURE\\PAC\\p25\\P25.shp</p>
         <p>- Couche cadastrale : W:\\2_DOSSIERS\\AGRICULTURE\\EXPLOITATION_ELEVAGE\\STRUCTURE\\cadastre\\parcelles-21-valide.shp</p>
         <p>Le champ pour le filtrage est 'PACAGE' (type String, taille 10).</p>
+        <p>Un index attributaire sur PACAGE est créé au premier lancement si le dossier des couches est accessible en écriture.
+        La correspondance PACAGE → îlots est mémorisée dans le profil QGIS et reconstruite automatiquement quand P24 ou P25 changent.</p>
         <h3>Utilisation :</h3>
         <ol>
             <li>Vérifiez que les chemins des couches sont corrects et accessibles.</li>
@@ -57,6 +454,12 @@ class TerresADispositionDialog(QDialog):
             <li>Choisissez un dossier d'export.</li>
             <li>Cliquez sur 'Lancer le traitement'.</li>
         </ol>
+        <h3>Traitement par lot :</h3>
+        <p>Saisissez plusieurs numéros de PACAGE (séparés par des virgules ou des espaces) ou choisissez un fichier CSV
+        (colonne 'PACAGE', sinon la première colonne), puis cliquez sur 'Lancer le traitement par lot'.
+        Les couches sont lues une seule fois et les exploitations sont calculées en parallèle.
+        Le résultat est un seul GeoPackage terres_a_disposition_lot_AAAAMMJJ_HHMMSS.gpkg contenant les terres en plus,
+        les parcelles intersectées et une table de synthèse des hectares en plus par PACAGE.</p>
         """
         self.instructions_text.setHtml(instructions)
         layout.addWidget(self.instructions_text)
@@ -113,6 +516,21 @@ class TerresADispositionDialog(QDialog):
         self.pacage_input.setValidator(validator)
         layout.addRow(self.pacage_label, self.pacage_input)
 
+        # Lot de PACAGE
+        self.batch_label = QLabel("Lot de PACAGE (liste ou CSV) :")
+        self.batch_input = QLineEdit()
+        self.batch_input.setPlaceholderText("021155950, 021155951 ... ou chemin d'un fichier CSV")
+        self.batch_button = QPushButton("Choisir CSV")
+        self.batch_button.clicked.connect(self.choose_pacage_csv)
+        batch_layout = QHBoxLayout()
+        batch_layout.addWidget(self.batch_input)
+        batch_layout.addWidget(self.batch_button)
+        layout.addRow(self.batch_label, batch_layout)
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.workers_spin.setValue(min(4, self.workers_spin.maximum()))
+        layout.addRow("Exploitations traitées en parallèle :", self.workers_spin)
+
         # Dossier d'export
         self.export_dir_label = QLabel("Dossier d'export :")
         self.export_dir_input = QLineEdit()
@@ -135,6 +553,9 @@ class TerresADispositionDialog(QDialog):
         self.run_button = QPushButton("Lancer le traitement")
         self.run_button.clicked.connect(self.run_processing)
         layout.addRow(self.run_button)
+        self.batch_run_button = QPushButton("Lancer le traitement par lot")
+        self.batch_run_button.clicked.connect(self.run_batch_processing)
+        layout.addRow(self.batch_run_button)
 
         self.result_label = QLabel("")
         layout.addRow(self.result_label)
@@ -180,13 +601,64 @@ class TerresADispositionDialog(QDialog):
         if dir_path:
             self.export_dir_input.setText(dir_path)
 
-    def create_spatial_index_if_needed(self, layer, layer_name):
+    def choose_pacage_csv(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Sélectionner une liste de PACAGE", "", "Fichiers CSV (*.csv *.txt)")
+        if file_path:
+            self.batch_input.setText(file_path)
+
+    def create_spatial_index_if_needed(self, layer, layer_name, memory_fallback=False):
         """Crée un index spatial si nécessaire et log l'action."""
-        provider = layer.dataProvider()
-        if not provider.createSpatialIndex():
-            self.log_text.append(f"⚠️ Index spatial créé pour la couche {layer_name}.")
-        else:
-            self.log_text.append(f"✅ Index spatial déjà présent pour la couche {layer_name}.")
+        self.log_text.append(ensure_spatial_index(layer, layer_name, memory_fallback))
+        QApplication.processEvents()
+
+    def load_layers(self):
+        """Ouvre les couches P24, P25 et cadastre, vérifie leurs index spatiaux et le champ PACAGE."""
+        # Chemins des couches
+        p24_path = self.p24_path_edit.text()
+        p25_path = self.p25_path_edit.text()
+        cadastre_path = self.cadastre_path_edit.text()
+
+        # Vérification finale des couches
+        self.progress_bar.setValue(5)
+        p24_layer = QgsVectorLayer(p24_path, "P24", "ogr")
+        p25_layer = QgsVectorLayer(p25_path, "P25", "ogr")
+        cadastre_layer = QgsVectorLayer(cadastre_path, "Cadastre", "ogr")
+
+        if not all([p24_layer.isValid(), p25_layer.isValid(), cadastre_layer.isValid()]):
+            raise ValueError("Une ou plusieurs couches ne sont pas valides.")
+
+        # Vérification et création des index spatiaux
+        self.progress_bar.setValue(10)
+        self.log_text.append("🔍 Vérification des index spatiaux...")
+        self.create_spatial_index_if_needed(p24_layer, "P24")
+        self.create_spatial_index_if_needed(p25_layer, "P25")
+        # P24 et P25 sont lues par PACAGE : seul le cadastre, interrogé par emprise, mérite un index en mémoire
+        self.create_spatial_index_if_needed(cadastre_layer, "Cadastre", memory_fallback=True)
+
+        # Vérification du champ PACAGE
+        self.progress_bar.setValue(20)
+        if 'PACAGE' not in [f.name() for f in p24_layer.fields()] or 'PACAGE' not in [f.name() for f in p25_layer.fields()]:
+            raise ValueError("Le champ 'PACAGE' n'existe pas dans les couches P24 ou P25.")
+        self.log_text.append(ensure_pacage_index(p24_layer, "P24"))
+        self.log_text.append(ensure_pacage_index(p25_layer, "P25"))
+        return p24_layer, p25_layer, cadastre_layer
+
+    def open_fid_cache(self):
+        """Table PACAGE → entités sur disque, ou None si la base ne peut pas être ouverte."""
+        try:
+            path = os.path.join(QgsApplication.qgisSettingsDirPath(), TERRES_FID_CACHE_FILE)
+            return PacageFidCache(path, self.log_text.append)
+        except sqlite3.Error as e:
+            self.log_text.append(f"⚠️ Table PACAGE → entités indisponible ({str(e)}), filtrage par le fournisseur.")
+            return None
+
+    def pacage_features(self, p24_layer, p25_layer, pacages):
+        cache = self.open_fid_cache()
+        try:
+            return features_par_pacage(p24_layer, pacages, cache), features_par_pacage(p25_layer, pacages, cache)
+        finally:
+            if cache is not None:
+                cache.close()
 
     def run_processing(self):
         try:
@@ -199,37 +671,13 @@ class TerresADispositionDialog(QDialog):
             if not export_dir:
                 raise ValueError("Veuillez choisir un dossier d'export.")
 
-            # Chemins des couches
-            p24_path = self.p24_path_edit.text()
-            p25_path = self.p25_path_edit.text()
-            cadastre_path = self.cadastre_path_edit.text()
-
-            # Vérification finale des couches
-            self.progress_bar.setValue(5)
-            p24_layer = QgsVectorLayer(p24_path, "P24", "ogr")
-            p25_layer = QgsVectorLayer(p25_path, "P25", "ogr")
-            cadastre_layer = QgsVectorLayer(cadastre_path, "Cadastre", "ogr")
-
-            if not all([p24_layer.isValid(), p25_layer.isValid(), cadastre_layer.isValid()]):
-                raise ValueError("Une ou plusieurs couches ne sont pas valides.")
-
-            # Vérification et création des index spatiaux
-            self.progress_bar.setValue(10)
-            self.log_text.append("🔍 Vérification des index spatiaux...")
-            self.create_spatial_index_if_needed(p24_layer, "P24")
-            self.create_spatial_index_if_needed(p25_layer, "P25")
-            self.create_spatial_index_if_needed(cadastre_layer, "Cadastre")
-
-            # Vérification du champ PACAGE
-            self.progress_bar.setValue(20)
-            if 'PACAGE' not in [f.name() for f in p24_layer.fields()] or 'PACAGE' not in [f.name() for f in p25_layer.fields()]:
-                raise ValueError("Le champ 'PACAGE' n'existe pas dans les couches P24 ou P25.")
+            p24_layer, p25_layer, cadastre_layer = self.load_layers()
 
             # Filtrage des features pour le PACAGE
             self.progress_bar.setValue(30)
-            filter_expr = f"PACAGE = '{pacage}'"
-            p24_features = list(p24_layer.getFeatures(QgsFeatureRequest().setFilterExpression(filter_expr)))
-            p25_features = list(p25_layer.getFeatures(QgsFeatureRequest().setFilterExpression(filter_expr)))
+            p24_groupes, p25_groupes = self.pacage_features(p24_layer, p25_layer, [pacage])
+            p24_features = p24_groupes[pacage]
+            p25_features = p25_groupes[pacage]
 
             if not p25_features:
                 raise ValueError(f"Le numéro de PACAGE {pacage} n'est pas présent dans la table P25.")
@@ -239,12 +687,7 @@ class TerresADispositionDialog(QDialog):
 
             # Création des couches temporaires
             self.progress_bar.setValue(40)
-            fields = QgsFields()
-            fields.append(QgsField("PACAGE", QVariant.String, len=10))
-            fields.append(QgsField("NUM_ILOT", QVariant.Int, len=5))
-            fields.append(QgsField("NUM_PARCEL", QVariant.Int, len=4))
-            fields.append(QgsField("SF_ADM_DE", QVariant.Double, len=10))
-            fields.append(QgsField("SF_ADM_CO", QVariant.Double, len=10))
+            fields = terres_fields()
 
             # Création de couches temporaires pour les features filtrées
             p24_temp = QgsVectorLayer("MultiPolygon?crs=epsg:2154", "P24_filtered", "memory")
@@ -288,35 +731,16 @@ class TerresADispositionDialog(QDialog):
             diff_layer.updateFields()
             diff_layer.startEditing()
             
-            self.log_text.append("✅ Assemblage en une seule geométrie de toutes celles de l'année 2024.")
-            # Combiner toutes les géométries P24 en une seule pour la différence
-            p24_combined = None
-            if p24_features:
-                p24_geometries = [f.geometry() for f in p24_features]
-                p24_combined = QgsGeometry.unaryUnion(p24_geometries)
-            self.progress_bar.setValue(60)
-            
-            # Effectuer la différence pour chaque feature de P25
+            # Différence de chaque îlot 2025 avec l'assemblage des îlots 2024 voisins
             self.log_text.append("✅ Différences avec les ilots 2025.")
+            self.progress_bar.setValue(60)
             total_area = 0
-            for p25_feature in p25_features:
-                p25_geom = p25_feature.geometry()
-                if p24_combined:
-                    diff_geom = p25_geom.difference(p24_combined)
-                else:
-                    diff_geom = p25_geom  # Si pas de P24, toute la géométrie est en plus
-                if not diff_geom.isEmpty():
-                    total_area += diff_geom.area() / 10000  # En hectares
-                    new_feature = QgsFeature(fields)
-                    new_feature.setGeometry(diff_geom)
-                    new_feature.setAttributes([
-                        p25_feature['PACAGE'],
-                        p25_feature['NUM_ILOT'],
-                        p25_feature['NUM_PARCEL'],
-                        p25_feature['SF_ADM_DE'],
-                        p25_feature['SF_ADM_CO']
-                    ])
-                    diff_provider.addFeature(new_feature)
+            for attributs, diff_geom in terres_en_plus(p24_features, p25_features):
+                total_area += diff_geom.area() / 10000  # En hectares
+                new_feature = QgsFeature(fields)
+                new_feature.setGeometry(diff_geom)
+                new_feature.setAttributes(attributs)
+                diff_provider.addFeature(new_feature)
 
             diff_layer.commitChanges()
             if diff_layer.isValid():
@@ -346,24 +770,9 @@ class TerresADispositionDialog(QDialog):
             self.progress_bar.setValue(80)
             self.log_text.append("🔄 Intersection avec les parcelles cadastrales...")
 
-            # Récupération des champs de la couche cadastrale
+            # Champs P25, puis champs cadastraux, surface intersectée et identifiant de parcelle
             cadastre_fields = cadastre_layer.fields()
-            intersect_fields = QgsFields()
-
-            # Ajout des champs de la couche P25 (pour les attributs PACAGE, etc.)
-            intersect_fields.append(QgsField("PACAGE", QVariant.String, len=10))
-            intersect_fields.append(QgsField("NUM_ILOT", QVariant.Int, len=5))
-            intersect_fields.append(QgsField("NUM_PARCEL", QVariant.Int, len=4))
-            intersect_fields.append(QgsField("SF_ADM_DE", QVariant.Double, len=10))
-            intersect_fields.append(QgsField("SF_ADM_CO", QVariant.Double, len=10))
-
-            # Ajout des champs de la couche cadastrale
-            for field in cadastre_fields:
-                intersect_fields.append(field)
-
-            # Ajout d'un champ pour la surface intersectée
-            intersect_fields.append(QgsField("SF_INTERSECT", QVariant.Double, len=10, prec=2))
-            intersect_fields.append(QgsField("ID_PARCELLE", QVariant.Int, len=10))
+            intersect_fields = terres_intersect_fields(cadastre_fields)
 
             # Création de la couche d'intersection
             intersect_layer = QgsVectorLayer("MultiPolygon?crs=epsg:2154", "Parcelles_intersectees", "memory")
@@ -375,38 +784,16 @@ class TerresADispositionDialog(QDialog):
             # Récupération des features de la couche de différence (P25 - P24)
             diff_features = list(diff_layer.getFeatures())
 
-            # Récupération des features cadastrales
-            cadastre_features = {f.id(): f for f in cadastre_layer.getFeatures()}
+            # Index des seules parcelles cadastrales situées dans l'emprise des terres en plus
+            cadastre_index = (CadastreIndex(cadastre_layer, [f.geometry().boundingBox() for f in diff_features])
+                              if diff_features else None)
+            if cadastre_index is not None:
+                self.log_text.append(f"🔍 {len(cadastre_index.features)} parcelles cadastrales dans l'emprise des terres en plus.")
 
             # Intersection et création des features
-            for diff_feature in diff_features:
-                diff_geom = diff_feature.geometry()
-                for cadastre_id, cadastre_feature in cadastre_features.items():
-                    cadastre_geom = cadastre_feature.geometry()
-                    inter_geom = diff_geom.intersection(cadastre_geom)
-                    if not inter_geom.isEmpty():
-                        new_feature = QgsFeature(intersect_fields)
-                        new_feature.setGeometry(inter_geom)
-
-                        # Attributs de la couche P25
-                        new_feature.setAttribute("PACAGE", diff_feature["PACAGE"])
-                        new_feature.setAttribute("NUM_ILOT", diff_feature["NUM_ILOT"])
-                        new_feature.setAttribute("NUM_PARCEL", diff_feature["NUM_PARCEL"])
-                        new_feature.setAttribute("SF_ADM_DE", diff_feature["SF_ADM_DE"])
-                        new_feature.setAttribute("SF_ADM_CO", diff_feature["SF_ADM_CO"])
-
-                        # Attributs de la couche cadastrale
-                        for i, field in enumerate(cadastre_fields):
-                            new_feature.setAttribute(i + 5, cadastre_feature[field.name()])  # +5 car on a déjà 5 champs avant
-
-                        # ID de la parcelle cadastrale
-                        new_feature.setAttribute("ID_PARCELLE", cadastre_id)
-
-                        # Surface intersectée (en hectares)
-                        surface_ha = inter_geom.area() / 10000
-                        new_feature.setAttribute("SF_INTERSECT", surface_ha)
-
-                        intersect_provider.addFeature(new_feature)
+            terres = [(terres_attributes(f), f.geometry()) for f in diff_features]
+            for attributs, parcelle, inter_geom in (parcelles_intersectees(terres, cadastre_index) if terres else []):
+                intersect_provider.addFeature(intersect_feature(intersect_fields, cadastre_fields, attributs, parcelle, inter_geom))
 
             intersect_layer.commitChanges()
 
@@ -432,6 +819,134 @@ class TerresADispositionDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "Erreur", f"Une erreur est survenue : {str(e)}")
 
+    def batch_pacages(self):
+        """Numéros du lot : fichier CSV si le champ désigne un fichier existant, sinon liste saisie."""
+        text = self.batch_input.text().strip()
+        if os.path.isfile(text):
+            return read_pacage_csv(text)
+        return parse_pacage_list(text)
+
+    def run_batch_processing(self):
+        try:
+            self.progress_bar.setValue(0)
+            self.log_text.clear()
+            pacages, rejets = self.batch_pacages()
+            if rejets:
+                self.log_text.append(f"⚠️ Entrées ignorées (PACAGE invalides) : {', '.join(rejets)}")
+            if not pacages:
+                raise ValueError("Aucun numéro de PACAGE valide dans le lot.")
+            export_dir = self.export_dir_input.text()
+            if not export_dir:
+                raise ValueError("Veuillez choisir un dossier d'export.")
+
+            p24_layer, p25_layer, cadastre_layer = self.load_layers()
+
+            # Une seule lecture de P24 et P25 pour tout le lot
+            self.progress_bar.setValue(30)
+            p24_groupes, p25_groupes = self.pacage_features(p24_layer, p25_layer, pacages)
+            presents = [pacage for pacage in pacages if p25_groupes.get(pacage)]
+            absents = [pacage for pacage in pacages if not p25_groupes.get(pacage)]
+            if absents:
+                self.log_text.append(f"⚠️ PACAGE absents de la table P25 : {', '.join(absents)}")
+            if not presents:
+                raise ValueError("Aucun numéro de PACAGE du lot n'est présent dans la table P25.")
+            self.log_text.append(f"📊 {len(presents)} exploitations à traiter.")
+
+            # Un seul index cadastral, limité aux parcelles qui touchent l'emprise d'un îlot 2025 du lot
+            self.progress_bar.setValue(40)
+            p25_features = chain.from_iterable(p25_groupes[pacage] for pacage in presents)
+            cadastre_index = CadastreIndex(cadastre_layer, [f.geometry().boundingBox() for f in p25_features])
+            self.log_text.append(f"🔍 {len(cadastre_index.features)} parcelles cadastrales au contact des îlots du lot.")
+
+            # Calcul des exploitations en parallèle : les threads ne lisent plus aucune couche
+            resultats, erreurs = {}, {}
+            with ThreadPoolExecutor(max_workers=self.workers_spin.value()) as pool:
+                futures = {
+                    pool.submit(traiter_exploitation, pacage, p24_groupes.get(pacage, []),
+                                p25_groupes[pacage], cadastre_index): pacage
+                    for pacage in presents
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    pacage = futures[future]
+                    try:
+                        resultats[pacage] = future.result()
+                        self.log_text.append(f"✅ PACAGE {pacage} : {resultats[pacage]['sf_plus']:.2f} ha en plus.")
+                    except Exception as e:
+                        erreurs[pacage] = str(e)
+                        self.log_text.append(f"❌ PACAGE {pacage} : {str(e)}")
+                    self.progress_bar.setValue(40 + int(50 * done / len(futures)))
+                    QApplication.processEvents()
+
+            # Couches consolidées, dans l'ordre du lot
+            cadastre_fields = cadastre_layer.fields()
+            fields = terres_fields()
+            intersect_fields = terres_intersect_fields(cadastre_fields)
+            synthese_fields = QgsFields()
+            synthese_fields.append(QgsField("PACAGE", QVariant.String, len=10))
+            synthese_fields.append(QgsField("NB_ILOTS_P24", QVariant.Int))
+            synthese_fields.append(QgsField("NB_ILOTS_P25", QVariant.Int))
+            synthese_fields.append(QgsField("SF_PLUS_HA", QVariant.Double, len=10, prec=2))
+            synthese_fields.append(QgsField("NB_PARCELLES", QVariant.Int))
+            synthese_fields.append(QgsField("SF_INTERSECT_HA", QVariant.Double, len=10, prec=2))
+            synthese_fields.append(QgsField("STATUT", QVariant.String, len=100))
+
+            terres_name, intersect_name, synthese_name = TERRES_LOT_LAYERS
+            terres_layer = QgsVectorLayer("MultiPolygon?crs=epsg:2154", terres_name, "memory")
+            intersect_layer = QgsVectorLayer("MultiPolygon?crs=epsg:2154", intersect_name, "memory")
+            synthese_layer = QgsVectorLayer("None", synthese_name, "memory")
+            for layer, layer_fields in ((terres_layer, fields), (intersect_layer, intersect_fields),
+                                        (synthese_layer, synthese_fields)):
+                layer.dataProvider().addAttributes(layer_fields.toList())
+                layer.updateFields()
+
+            total_area = 0
+            for pacage in pacages:
+                resultat = resultats.get(pacage)
+                synthese = QgsFeature(synthese_fields)
+                if resultat is None:
+                    statut = f"Erreur : {erreurs[pacage]}" if pacage in erreurs else "Absent de P25"
+                    synthese.setAttributes([pacage, len(p24_groupes.get(pacage, [])), len(p25_groupes.get(pacage, [])),
+                                            0, 0, 0, statut[:100]])
+                    synthese_layer.dataProvider().addFeature(synthese)
+                    continue
+                total_area += resultat['sf_plus']
+                features = []
+                for attributs, diff_geom in resultat['terres']:
+                    feature = QgsFeature(fields)
+                    feature.setGeometry(diff_geom)
+                    feature.setAttributes(attributs)
+                    features.append(feature)
+                terres_layer.dataProvider().addFeatures(features)
+                intersect_layer.dataProvider().addFeatures([
+                    intersect_feature(intersect_fields, cadastre_fields, attributs, parcelle, inter_geom)
+                    for attributs, parcelle, inter_geom in resultat['intersections']
+                ])
+                synthese.setAttributes([
+                    pacage, resultat['nb_p24'], resultat['nb_p25'], resultat['sf_plus'],
+                    len(resultat['intersections']), resultat['sf_intersect'], "OK"
+                ])
+                synthese_layer.dataProvider().addFeature(synthese)
+
+            # Un seul GeoPackage pour tout le lot
+            self.progress_bar.setValue(95)
+            output = os.path.join(export_dir, TERRES_LOT_FILE.format(horodatage=datetime.now().strftime("%Y%m%d_%H%M%S")))
+            write_terres_geopackage(output, [terres_layer, intersect_layer, synthese_layer])
+            for name in TERRES_LOT_LAYERS:
+                layer = QgsVectorLayer(f"{output}|layername={name}", name, "ogr")
+                if layer.isValid():
+                    QgsProject.instance().addMapLayer(layer)
+
+            self.progress_bar.setValue(100)
+            self.result_label.setText(
+                f"{len(resultats)} exploitations traitées, surface totale en plus : {total_area:.2f} ha")
+            self.log_text.append(f"✅ Lot exporté : {output}")
+            QMessageBox.information(self, "Succès", f"Traitement par lot terminé. Résultats exportés dans {output}.")
+
+        except ValueError as ve:
+            QMessageBox.warning(self, "Erreur de saisie", str(ve))
+        except Exception as e:
+            QMessageBox.critical(self, "Erreur", f"Une erreur est survenue : {str(e)}")
+
             
  
 
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Python 3
+# Mesure mémoire partagée par les profils de traitement et les bancs d'essai (sans Qt ni QGIS)
+import sys
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    # Module absent sous Windows : le pic mémoire y est lu avec psutil
+    resource = None
+
+
+def peak_rss_mb():
+    """Pic de mémoire résidente du processus en Mo (psutil sous Windows, resource ailleurs), None si inconnu."""
+    if psutil is not None:
+        peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        if peak:
+            return round(peak / 2 ** 20, 1)
+    if resource is not None:
+        # ru_maxrss est en Ko sous Linux, en octets sous macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+    return None